@@ -1,29 +1,104 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response, stream_with_context
 from dotenv import load_dotenv
 import os
-from groq import Groq
-from datetime import datetime
+import functools
+import time
 from flask_cors import CORS  # Import CORS
+from clients import pool_stats, rate_limit_stats
+from dispatcher import Overloaded, QUEUE_FULL
+from pipeline import make_pipeline
+from history_store import history_etag, parse_page_args, parse_search_args
+from sessions import SESSION_HEADER, new_session_id, session_id_from, set_session_cookie
+from metrics import CONTENT_TYPE, IN_FLIGHT, REQUEST_LATENCY, SERIALIZE_LATENCY, registry
+from logs import REQUEST_ID_HEADER, bind_request_id, get_logger, log_event, setup_logging
+from tracing import tracer
 
 # Load the .env file
 load_dotenv()
 
-# Retrieve the API key from environment variables
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY is not set in the environment variables.")
+# Structured JSON logs, written by a background thread (see logs.py)
+setup_logging()
+log = get_logger("app")
 
-# Initialize the Groq client with the API key
-client = Groq(api_key=api_key)
+# The chat pipeline: context, caches, routing, dispatch and history (see pipeline.py)
+pipeline = make_pipeline()
 
 # Initialize Flask app
 app = Flask(__name__)
 
 # Allow CORS for all domains (for development purposes)
-CORS(app)
-
-# Store chat history in memory
-chat_history = []
+CORS(app, expose_headers=[SESSION_HEADER, REQUEST_ID_HEADER])
+
+# JSON response for a pipeline result, with Retry-After when the client should come back later
+def json_response(status, body, seconds=None):
+    if status == 200:
+        with SERIALIZE_LATENCY.time(), tracer.span("chat.serialize"):
+            return jsonify(body)
+    response = jsonify(body)
+    if seconds is not None:
+        response.headers["Retry-After"] = str(seconds)
+    return response, status
+
+# Identify the client's session from the X-Session-ID header or the session cookie
+@app.before_request
+def load_session():
+    g.session_id = session_id_from(request)
+    g.new_session = g.session_id is None
+    if g.new_session:
+        g.session_id = new_session_id()
+
+# Hand a newly created session ID back to the client
+@app.after_request
+def save_session(response):
+    if g.get("new_session"):
+        set_session_cookie(response, g.session_id)
+    return response
+
+# Tag the request's logs with the client's X-Request-ID, or a new one, and echo it back
+@app.before_request
+def assign_request_id():
+    g.request_id = bind_request_id(request.headers.get(REQUEST_ID_HEADER))
+
+@app.after_request
+def send_request_id(response):
+    if "request_id" in g:
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+# Time every request and count it as in flight, streamed responses until their last event
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    IN_FLIGHT.inc()
+
+@app.after_request
+def record_status(response):
+    g.status = response.status_code
+    return response
+
+# With stream_with_context, teardown runs once when the headers are sent and again
+# when the stream ends; only the last one counts. chat_stream() marks its streams as
+# pending, other responses (including error pages) are observed right away.
+@app.teardown_request
+def observe_request(error=None):
+    if g.pop("stream_pending", False) or "request_start" not in g:
+        return
+    IN_FLIGHT.dec()
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed, status = time.perf_counter() - g.pop("request_start"), g.get("status", 500)
+    REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=request.method, status=status)
+    log_event(log, "http.request", endpoint=endpoint, method=request.method, status=status,
+              duration_ms=round(elapsed * 1000, 1))
+
+# Trace a route as the request's root span, continuing the caller's trace if it sent a traceparent
+def traced(route):
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        name = f"{request.method} {request.url_rule.rule}"
+        attributes = {"http.route": request.url_rule.rule, "session.id": g.session_id, "request.id": g.request_id}
+        with tracer.span(name, traceparent=request.headers.get("traceparent"), **attributes):
+            return route(*args, **kwargs)
+    return wrapper
 
 # Home route to render chat interface
 @app.route("/")
@@ -32,65 +107,111 @@ def home():
 
 # API endpoint for chat
 @app.route("/api/chat", methods=["POST"])
+@traced
 def chat():
     try:
         # Get the user input from the request
         data = request.json
         user_input = data.get("message", "")
-        print(user_input)
-
-        if not user_input:
-            return jsonify({"status": "error", "message": "No input provided."}), 400
-
-        # Generate a response using the Groq client
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": "you are a helpful assistant. " + user_input + " give all the response in short form and in bullet points",
-                }
-            ],
-            model="llama-3.3-70b-versatile",  # Ensure this model is correct
-        )
-
-        # Get the current timestamp
-        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    except Exception as e:
+        return json_response(*pipeline.error_response(g.session_id, e))
 
-        # Check if the response has valid choices and content
-        if chat_completion and chat_completion.choices:
-            response_content = chat_completion.choices[0].message.content
+    if not user_input:
+        return jsonify({"status": "error", "message": "No input provided."}), 400
 
-            # Split the response into bullet points
-            response_list = response_content.split("\n")
+    # Serve repeated questions from the cache, otherwise ask the Groq client with the session's context
+    return json_response(*pipeline.answer(g.session_id, user_input))
 
-            # Ensure that empty responses are not included
-            response_list = [line.strip() for line in response_list if line.strip()]
 
-            # Format the response for the front end
+# Streaming API endpoint for chat: forwards tokens as Server-Sent Events
+@app.route("/api/chat/stream", methods=["POST"])
+@traced
+def chat_stream():
+    data = request.json or {}
+    user_input = data.get("message", "")
 
-            print(response_list)
-            formatted_response = {
-                "status": "success",
-                "response": response_list,  # Send the response as a list for bullet points
-                "suggestions": ["Translate", "Ask a question", "Get help"],  # Example suggestions
-            }
+    if not user_input:
+        return jsonify({"status": "error", "message": "No input provided."}), 400
 
-            # Add to chat history with date, user input, and bot response
-            chat_history.append({'date': current_date, 'user': user_input, 'bot': response_content})
-            print(chat_history)
+    # Turn the request away before opening the stream if the upstream queue is full
+    if pipeline.dispatcher.saturated():
+        return json_response(*pipeline.error_response(g.session_id, Overloaded(QUEUE_FULL)))
 
-            return jsonify(formatted_response)
-        else:
-            return jsonify({"status": "error", "message": "No valid response from the AI."}), 500
+    # The stream outlives the handler's span, so its spans name their parent
+    events = pipeline.stream(g.session_id, user_input, root=tracer.current_span())
 
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"An error occurred: {e}"}), 500
+    # Disable proxy buffering so tokens reach the browser immediately
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    g.stream_pending = True
+    return Response(stream_with_context(events), mimetype="text/event-stream", headers=headers)
 
 
-# API endpoint for getting chat history
+# API endpoint for getting the session's chat history. Supports `limit`, `since`/`before` entry ID
+# cursors and ETag/If-None-Match, so clients only fetch what changed.
 @app.route("/api/history", methods=["GET"])
 def history():
-    return jsonify(chat_history)
+    try:
+        page = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    last_id = pipeline.history_store.last_id(g.session_id)
+    etag = history_etag(last_id, page.get("since"), page.get("before"), page.get("limit"))
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(pipeline.history_store.list(g.session_id, **page))
+    response.set_etag(etag)
+    return response
+
+# API endpoint for full-text search over the session's chat history, best matches first.
+# `q` is the search text (a trailing * matches word prefixes); `limit` and `offset` page
+# through the results.
+@app.route("/api/history/search", methods=["GET"])
+def history_search():
+    try:
+        search = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return jsonify(pipeline.search_history(g.session_id, search["q"], search["limit"], search["offset"]))
+
+# API endpoint for cache hit/miss counters, semantic cache hit rate and lookup latency,
+# and how many requests were coalesced into another in-flight call
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(pipeline.cache_stats())
+
+# API endpoint for upstream connection pool usage (active, idle, queued, waits)
+@app.route("/api/pool/stats", methods=["GET"])
+def upstream_pool_stats():
+    return jsonify(pool_stats())
+
+# API endpoint for the upstream dispatch queue (queued, in flight, rejected, timeouts)
+@app.route("/api/dispatch/stats", methods=["GET"])
+def dispatch_stats():
+    return jsonify(pipeline.dispatcher.stats())
+
+# API endpoint for upstream call outcomes per model: retries, timeouts, hedging and circuit breaker state
+@app.route("/api/policy/stats", methods=["GET"])
+def policy_stats():
+    return jsonify(pipeline.router.policy_stats())
+
+# API endpoint for how requests were routed to models, and how often they fell back
+@app.route("/api/router/stats", methods=["GET"])
+def router_stats():
+    return jsonify(pipeline.router.stats())
+
+# API endpoint for upstream rate limit budgets and how often calls were throttled
+@app.route("/api/ratelimit/stats", methods=["GET"])
+def upstream_rate_limit_stats():
+    return jsonify(rate_limit_stats())
+
+# Prometheus metrics: request, upstream, post-processing and serialization latency histograms,
+# cache, error and token counters, and history size and in-flight gauges, across all workers
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
 
 # Run the Flask app
 if __name__ == "__main__": 
@@ -138,21 +138,53 @@
 import streamlit as st
 import os
 import uuid
-from groq import Groq
+from groq import RateLimitError
+from backends import get_backend, needs_api_key
+from ratelimit import retry_after
 from dotenv import load_dotenv
 from datetime import datetime
+from context import update_summary
+from llm import summary_messages
+from transcript import STREAMING, completion_tokens, render_stream
 
 # Load environment variables
 load_dotenv()
 
 # Retrieve API key
 api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
+if not api_key and needs_api_key():
     st.error("GROQ_API_KEY is not set in environment variables. Please check your .env file.")
     st.stop()
 
-# Initialize Groq API client
-client = Groq(api_key=api_key)
+# LLM backend (the shared Groq client by default): one per process, so its connection pool survives reruns
+client = get_backend(api_key)
+
+# Fold new turns into a running summary of the session
+def summarize_turns(summary, turns):
+    summary_completion = client.chat.completions.create(
+        messages=summary_messages(summary, turns),
+        model="llama-3.3-70b-versatile",
+    )
+    return summary_completion.choices[0].message.content
+
+# Tokens of the answer from the Groq client, as they arrive
+def stream_tokens(messages):
+    stream = client.chat.completions.create(
+        messages=messages,
+        model="llama-3.3-70b-versatile",
+        stream=True,
+    )
+    yield from completion_tokens(stream)
+
+# The whole answer at once, behind a spinner (STREAMLIT_STREAMING=off)
+def fetch_tokens(messages):
+    with st.spinner("🤖 Analyzing... Please wait..."):  # Show loading indicator
+        chat_completion = client.chat.completions.create(
+            messages=messages,
+            model="llama-3.3-70b-versatile",
+        )
+    if chat_completion and chat_completion.choices:
+        yield chat_completion.choices[0].message.content
 
 # Initialize session state
 if "session_id" not in st.session_state:
@@ -178,25 +210,24 @@ with st.sidebar:
     # Clear Chat Button
     if st.button("🗑️ Clear Chat"):
         st.session_state.chat_history = []
+        st.session_state.session_summary = None
+        st.session_state.summary_covered = 0
 
     # Summarize All Chats Button
     if st.button("📌 Summarize Session"):
         if st.session_state.chat_history:
-            all_chats_text = "\n".join(
-                [f"User: {chat['user']}\nBot: {' '.join(chat['bot'])}" for chat in st.session_state.chat_history]
-            )
-            
             try:
-                summary_response = client.chat.completions.create(
-                    messages=[
-                        {"role": "user", "content": f"Summarize this chat session with key points:\n{all_chats_text}"}
-                    ],
-                    model="llama-3.3-70b-versatile",
+                # Only the previous summary and the turns added since are sent upstream;
+                # a repeat click with no new turns reuses the stored summary
+                summary, covered = update_summary(
+                    summarize_turns,
+                    st.session_state.get("session_summary"),
+                    st.session_state.get("summary_covered", 0),
+                    st.session_state.chat_history,
                 )
-
-                if summary_response and summary_response.choices:
-                    st.session_state.session_summary = summary_response.choices[0].message.content
-                    st.success("Session summary generated!")
+                st.session_state.session_summary = summary
+                st.session_state.summary_covered = covered
+                st.success("Session summary generated!")
 
             except Exception as e:
                 st.error(f"An error occurred while summarizing: {e}")
@@ -263,34 +294,36 @@ for chat in st.session_state.chat_history:
         # Display bot's message with a background and aligned left
         st.markdown(f"<div class='bot-message'><b>Bot:</b> {'<br>'.join(chat['bot'])}</div>", unsafe_allow_html=True)
 
-# Chat Input with Enter to Send & Loading Spinner
+# Chat Input with Enter to Send: queue the question, it is answered further down so the
+# answer can stream into the chat container
 def process_input():
     user_input = st.session_state.chat_input.strip()
-    
     if user_input:
-        with st.spinner("🤖 Analyzing... Please wait..."):  # Show loading indicator
-            try:
-                chat_completion = client.chat.completions.create(
-                    messages=[
-                        {"role": "user", "content": f"You are a helpful assistant. {user_input} Give a short, bullet-pointed response."}
-                    ],
-                    model="llama-3.3-70b-versatile",
-                )
+        st.session_state.pending_input = user_input
+        st.session_state.chat_input = ""  # Clear input after sending
 
-                current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+# Answer a question, writing the answer into the chat container as it arrives
+def answer(user_input):
+    try:
+        messages = [
+            {"role": "user", "content": f"You are a helpful assistant. {user_input} Give a short, bullet-pointed response."}
+        ]
+        tokens = stream_tokens(messages) if STREAMING else fetch_tokens(messages)
+        response_content = render_stream(user_input, tokens, style="bubbles")
 
-                if chat_completion and chat_completion.choices:
-                    response_content = chat_completion.choices[0].message.content
-                    response_list = [line.strip() for line in response_content.split("\n") if line.strip()]
+        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-                    new_chat = {"date": current_date, "user": user_input, "bot": response_list}
-                    st.session_state.chat_history.append(new_chat)
-                    st.session_state.selected_chat = new_chat
+        if response_content.strip():
+            response_list = [line.strip() for line in response_content.split("\n") if line.strip()]
 
-                    st.session_state.chat_input = ""  # Clear input after sending
+            new_chat = {"date": current_date, "user": user_input, "bot": response_list}
+            st.session_state.chat_history.append(new_chat)
+            st.session_state.selected_chat = new_chat
 
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
+    except RateLimitError as e:
+        st.warning(f"The AI is rate limited. Please retry in {retry_after(e)} seconds.")
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
 
 # Chat Input
 user_input = st.text_input(
@@ -299,3 +332,8 @@ user_input = st.text_input(
     placeholder="Ask me anything...",
     on_change=process_input  # Calls the function when Enter is pressed
 )
+
+# Answer the queued question below the chat messages
+if st.session_state.get("pending_input"):
+    with chat_container:
+        answer(st.session_state.pop("pending_input"))
@@ -1,7 +1,9 @@
 import streamlit as st
 import os
 import uuid
-from groq import Groq
+from groq import RateLimitError
+from backends import get_backend, needs_api_key
+from ratelimit import retry_after
 from dotenv import load_dotenv
 from datetime import datetime
 
@@ -10,12 +12,12 @@ load_dotenv()
 
 # Retrieve API key
 api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
+if not api_key and needs_api_key():
     st.error("GROQ_API_KEY is not set in environment variables. Please check your .env file.")
     st.stop()
 
-# Initialize Groq API client
-client = Groq(api_key=api_key)
+# LLM backend (the shared Groq client by default): one per process, so its connection pool survives reruns
+client = get_backend(api_key)
 
 # Initialize session state
 if "session_id" not in st.session_state:
@@ -173,6 +175,8 @@ def process_input():
 
                     st.session_state.chat_input = ""  # Clear input after sending
 
+            except RateLimitError as e:
+                st.warning(f"The AI is rate limited. Please retry in {retry_after(e)} seconds.")
             except Exception as e:
                 st.error(f"An error occurred: {e}")
 
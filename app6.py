@@ -170,32 +170,58 @@
 import streamlit as st
 import os
 import uuid
-from groq import Groq
-from dotenv import load_dotenv
-from datetime import datetime
-
-# Load environment variables
-load_dotenv()
+from backends import needs_api_key
+from context import update_summary
+from session_store import make_session_store
+from streamlit_chat import answer, get_config, get_response_cache, summarize_turns
+from transcript import render_transcript, reset_transcript
 
 # Retrieve API key
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
+api_key = get_config()["api_key"]
+if not api_key and needs_api_key():
     st.error("GROQ_API_KEY is not set in environment variables. Please check your .env file.")
     st.stop()
 
-# Initialize Groq API client
-client = Groq(api_key=api_key)
+response_cache = get_response_cache()
+
+# Chat sessions persisted on disk, shared across reruns and browser sessions. Only the
+# open session's turns are kept in st.session_state.
+@st.cache_resource
+def get_session_store():
+    return make_session_store()
+
+session_store = get_session_store()
+
+# Sessions listed in the sidebar, most recently used first
+SESSION_LIST_LIMIT = int(os.getenv("SESSION_LIST_LIMIT", 50))
+
+# Search results shown per page
+SEARCH_PAGE_SIZE = 5
+
+# Make a stored session the active chat, loading its turns
+def open_session(session_key):
+    st.session_state.chat_history = session_store.transcript(session_key)
+    st.session_state.session_id = session_key  # Continue the opened session
+    st.session_state.selected_session = session_key
+    st.session_state.session_summary, st.session_state.summary_covered = session_store.summary(session_key)
+    reset_transcript()
+
+# Move through the search results; a new query starts at the first page
+def page_search(step=None):
+    st.session_state.search_offset = st.session_state.get("search_offset", 0) + step if step else 0
+
+# Initialize session state. The owner ID, kept in the page URL, tells this browser's
+# stored sessions from other people's; a new one is made on the first visit.
+if "owner" not in st.query_params:
+    st.query_params["owner"] = str(uuid.uuid4())
+owner = st.query_params["owner"]
 
-# Initialize session state
 if "session_id" not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
 
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
-if "session_history" not in st.session_state:
-    st.session_state.session_history = {}
-
 # Set layout
 st.set_page_config(page_title="AI Chatbot", page_icon="💬", layout="wide")
 
@@ -203,13 +229,34 @@ st.set_page_config(page_title="AI Chatbot", page_icon="💬", layout="wide")
 with st.sidebar:
     st.title("📝 Chat History")
 
-    # Display history of different chat sessions
-    for session_key, session_data in st.session_state.session_history.items():
-        session_label = f"Chat Session {session_key}"
-        if st.button(session_label):
-            st.session_state.chat_history = session_data['history']
-            st.session_state.selected_session = session_key
-            st.session_state.session_summary = session_data.get('summary', None)
+    # Search past chats, best matches first
+    query = st.text_input("🔍 Search chats", key="search_query", on_change=page_search)
+    if query.strip():
+        this_chat = st.checkbox("This chat only", key="search_this_chat", on_change=page_search)
+        offset = st.session_state.get("search_offset", 0)
+        # One extra result tells whether there is a next page
+        results = session_store.search(query, owner, st.session_state.session_id if this_chat else None,
+                                       limit=SEARCH_PAGE_SIZE + 1, offset=offset)
+        if not results:
+            st.caption("No matching chats.")
+        if results.truncated:
+            st.caption("Too many matches: only the most recent ones are ranked. Add words to narrow the search.")
+        for result in results[:SEARCH_PAGE_SIZE]:
+            st.markdown(f"{result['snippet'].replace(chr(10), ' ')}  \n*{result['date']}*")
+            if st.button("Open chat", key=f"search_{result['id']}"):
+                open_session(result['session_id'])
+        previous_page, next_page = st.columns(2)
+        if offset:
+            previous_page.button("◀ Previous", key="search_previous", on_click=page_search, args=(-SEARCH_PAGE_SIZE,))
+        if len(results) > SEARCH_PAGE_SIZE:
+            next_page.button("Next ▶", key="search_next", on_click=page_search, args=(SEARCH_PAGE_SIZE,))
+        st.markdown("---")
+
+    # Display history of different chat sessions; only IDs and titles are read here,
+    # a session's turns are loaded when it is opened
+    for session_key, title in session_store.sessions(owner, SESSION_LIST_LIMIT):
+        if st.button(title, key=f"session_{session_key}"):
+            open_session(session_key)
 
     # New Chat Button (clears the current chat history and starts a new one)
     if st.button("🆕 New Chat"):
@@ -218,36 +265,43 @@ with st.sidebar:
         st.session_state.session_id = new_session_id
         st.session_state.selected_session = None
         st.session_state.session_summary = None
+        st.session_state.summary_covered = 0
+        reset_transcript()
 
-    # Clear All Chats Button
+    # Clear All Chats Button (this browser's chats only)
     if st.button("🗑️ Clear All Chats"):
-        st.session_state.session_history = {}
+        session_store.clear(owner)
+        st.rerun()  # Redraw the session list above
+
+    # Response cache hit/miss counters
+    cache_stats = response_cache.stats()
+    st.caption(f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
 
     # Summarize All Chats Button
     if st.button("📌 Summarize Session"):
         if st.session_state.chat_history:
-            all_chats_text = "\n".join(
-                [f"User: {chat['user']}\nBot: {' '.join(chat['bot'])}" for chat in st.session_state.chat_history]
-            )
-            
             try:
-                summary_response = client.chat.completions.create(
-                    messages=[
-                        {"role": "user", "content": f"Summarize this chat session with key points:\n{all_chats_text}"}
-                    ],
-                    model="llama-3.3-70b-versatile",
+                # Only the previous summary and the turns added since are sent upstream;
+                # a repeat click with no new turns reuses the stored summary
+                summary, covered = update_summary(
+                    summarize_turns,
+                    st.session_state.get("session_summary"),
+                    st.session_state.get("summary_covered", 0),
+                    st.session_state.chat_history,
                 )
+                st.session_state.session_summary = summary
+                st.session_state.summary_covered = covered
 
-                if summary_response and summary_response.choices:
-                    st.session_state.session_summary = summary_response.choices[0].message.content
-                    st.success("Session summary generated!")
+                # Keep the summary with the chat it belongs to, so it survives switching sessions
+                session_store.set_summary(st.session_state.session_id, summary, covered)
+                st.success("Session summary generated!")
 
             except Exception as e:
                 st.error(f"An error occurred while summarizing: {e}")
 
 # Main Chat Window
 st.title("💬 AI Chatbot")
-st.write(f"Session ID: `{st.session_state.session_id}` (Active until refresh)")
+st.write(f"Session ID: `{st.session_state.session_id}`")
 
 # Display Session Summary
 if "session_summary" in st.session_state and st.session_state.session_summary:
@@ -257,16 +311,6 @@ if "session_summary" in st.session_state and st.session_state.session_summary:
     highlighted_summary = summary.replace("key points", "**key points**").replace("summary", "**summary**")
     st.markdown(highlighted_summary)
 
-# Display selected chat if exists
-if "selected_session" in st.session_state and st.session_state.selected_session:
-    selected_session = st.session_state.selected_session
-    if selected_session in st.session_state.session_history:
-        chat_history = st.session_state.session_history[selected_session]['history']
-        st.subheader("Previous Conversation")
-        for chat in chat_history:
-            st.write(f"**You:** {chat['user']}")
-            st.write(f"**Bot:** {' '.join(chat['bot'])}")
-
 # Chat UI
 st.markdown("---")
 st.write("### 💬 Chat with AI")
@@ -300,47 +344,22 @@ st.markdown("""
 # Chat Message Container
 chat_container = st.container()
 
-# Display chat messages with custom CSS (User's message right-aligned, Bot's left-aligned)
-for chat in st.session_state.chat_history:
-    with chat_container:
-        # Display user's message with a background and aligned right
-        st.markdown(f"<div class='user-message'><b>You:</b> {chat['user']}</div>", unsafe_allow_html=True)
-        # Display bot's message with a background and aligned left
-        st.markdown(f"<div class='bot-message'><b>Bot:</b> {'<br>'.join(chat['bot'])}</div>", unsafe_allow_html=True)
+# Display chat messages with custom CSS (User's message right-aligned, Bot's left-aligned),
+# the latest pages only
+with chat_container:
+    render_transcript(st.session_state.chat_history)
 
-# Chat Input with Enter to Send & Loading Spinner
+# Chat Input with Enter to Send: queue the question, it is answered further down so the
+# answer can stream into the chat container
 def process_input():
     user_input = st.session_state.chat_input.strip()
-    
     if user_input:
-        with st.spinner("🤖 Analyzing... Please wait..."):  # Show loading indicator
-            try:
-                chat_completion = client.chat.completions.create(
-                    messages=[
-                        {"role": "user", "content": f"You are a helpful assistant. {user_input} Give a short, bullet-pointed response."}
-                    ],
-                    model="llama-3.3-70b-versatile",
-                )
-
-                current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-                if chat_completion and chat_completion.choices:
-                    response_content = chat_completion.choices[0].message.content
-                    response_list = [line.strip() for line in response_content.split("\n") if line.strip()]
+        st.session_state.pending_input = user_input
+        st.session_state.chat_input = ""  # Clear input after sending
 
-                    new_chat = {"date": current_date, "user": user_input, "bot": response_list}
-                    st.session_state.chat_history.append(new_chat)
-
-                    # Store the chat history in the session's history
-                    if st.session_state.session_id not in st.session_state.session_history:
-                        st.session_state.session_history[st.session_state.session_id] = {'history': [], 'summary': None}
-                    st.session_state.session_history[st.session_state.session_id]['history'].append(new_chat)
-
-                    st.session_state.selected_session = st.session_state.session_id  # Set active session
-                    st.session_state.chat_input = ""  # Clear input after sending
-
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
+# Store a finished turn in the session's persisted history
+def save_turn(turn):
+    session_store.append(st.session_state.session_id, turn, owner)
 
 # Chat Input
 user_input = st.text_input(
@@ -350,3 +369,7 @@ user_input = st.text_input(
     on_change=process_input  # Calls the function when Enter is pressed
 )
 
+# Answer the queued question below the transcript
+if st.session_state.get("pending_input"):
+    with chat_container:
+        answer(st.session_state.pop("pending_input"), save_turn)
@@ -0,0 +1,244 @@
+from quart import Quart, render_template, request, jsonify, g
+from quart_cors import cors
+from dotenv import load_dotenv
+import os
+import functools
+import time
+import asyncio
+from clients import pool_stats, rate_limit_stats
+from dispatcher import Overloaded, QUEUE_FULL
+from pipeline import make_async_pipeline
+from history_store import history_etag, parse_page_args, parse_search_args
+from sessions import SESSION_HEADER, new_session_id, session_id_from, set_session_cookie
+from metrics import CONTENT_TYPE, IN_FLIGHT, REQUEST_LATENCY, SERIALIZE_LATENCY, registry
+from logs import REQUEST_ID_HEADER, bind_request_id, get_logger, log_event, setup_logging
+from tracing import tracer
+
+# Async (ASGI) version of app.py. Serve it with an ASGI server, e.g.
+#   uvicorn asgi:app --port 8000
+# Each pending completion is an awaiting coroutine instead of a blocked worker,
+# so one process can hold many in-flight upstream calls.
+
+# Load the .env file
+load_dotenv()
+
+# Structured JSON logs, written by a background thread (see logs.py)
+setup_logging()
+log = get_logger("app")
+
+# The chat pipeline, awaiting upstream calls (see pipeline.py)
+pipeline = make_async_pipeline()
+
+# Initialize Quart app (Flask-compatible API)
+app = Quart(__name__)
+
+# Allow CORS for all domains (for development purposes)
+app = cors(app, allow_origin="*", expose_headers=[SESSION_HEADER, REQUEST_ID_HEADER])
+
+# JSON response for a pipeline result, with Retry-After when the client should come back later
+def json_response(status, body, seconds=None):
+    if status == 200:
+        with SERIALIZE_LATENCY.time(), tracer.span("chat.serialize"):
+            return jsonify(body)
+    response = jsonify(body)
+    if seconds is not None:
+        response.headers["Retry-After"] = str(seconds)
+    return response, status
+
+# Identify the client's session from the X-Session-ID header or the session cookie
+@app.before_request
+async def load_session():
+    g.session_id = session_id_from(request)
+    g.new_session = g.session_id is None
+    if g.new_session:
+        g.session_id = new_session_id()
+
+# Hand a newly created session ID back to the client
+@app.after_request
+async def save_session(response):
+    if g.get("new_session"):
+        set_session_cookie(response, g.session_id)
+    return response
+
+# Tag the request's logs with the client's X-Request-ID, or a new one, and echo it back
+@app.before_request
+async def assign_request_id():
+    g.request_id = bind_request_id(request.headers.get(REQUEST_ID_HEADER))
+
+@app.after_request
+async def send_request_id(response):
+    if "request_id" in g:
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+# Time every request and count it as in flight, streamed responses until their last event
+@app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+    IN_FLIGHT.inc()
+
+@app.after_request
+async def record_status(response):
+    g.status = response.status_code
+    return response
+
+# Teardown runs once the headers are sent, so streams are observed by observe_stream()
+@app.teardown_request
+async def observe_request(error=None):
+    if g.get("stream_pending") or "request_start" not in g:
+        return
+    IN_FLIGHT.dec()
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed, status = time.perf_counter() - g.request_start, g.get("status", 500)
+    REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=request.method, status=status)
+    log_event(log, "http.request", endpoint=endpoint, method=request.method, status=status,
+              duration_ms=round(elapsed * 1000, 1))
+
+# Encode a stream of events, observing the request when the stream ends
+def observe_stream(events):
+    g.stream_pending = True
+    start, endpoint, method = g.request_start, request.url_rule.rule, request.method
+
+    async def observed():
+        try:
+            async for event in events:
+                yield event.encode()
+        finally:
+            IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - start
+            REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=method, status=200)
+            log_event(log, "http.request", endpoint=endpoint, method=method, status=200,
+                      duration_ms=round(elapsed * 1000, 1))
+    return observed()
+
+# Trace a route as the request's root span, continuing the caller's trace if it sent a traceparent
+def traced(route):
+    @functools.wraps(route)
+    async def wrapper(*args, **kwargs):
+        name = f"{request.method} {request.url_rule.rule}"
+        attributes = {"http.route": request.url_rule.rule, "session.id": g.session_id, "request.id": g.request_id}
+        with tracer.span(name, traceparent=request.headers.get("traceparent"), **attributes):
+            return await route(*args, **kwargs)
+    return wrapper
+
+# Home route to render chat interface
+@app.route("/")
+async def home():
+    return await render_template("index.html")
+
+# API endpoint for chat
+@app.route("/api/chat", methods=["POST"])
+@traced
+async def chat():
+    try:
+        # Get the user input from the request
+        data = await request.get_json()
+        user_input = data.get("message", "")
+    except Exception as e:
+        return json_response(*pipeline.error_response(g.session_id, e))
+
+    if not user_input:
+        return jsonify({"status": "error", "message": "No input provided."}), 400
+
+    # Serve repeated questions from the cache, otherwise ask the Groq client with the session's context
+    return json_response(*await pipeline.answer(g.session_id, user_input))
+
+
+# Streaming API endpoint for chat: forwards tokens as Server-Sent Events
+@app.route("/api/chat/stream", methods=["POST"])
+@traced
+async def chat_stream():
+    data = await request.get_json() or {}
+    user_input = data.get("message", "")
+
+    if not user_input:
+        return jsonify({"status": "error", "message": "No input provided."}), 400
+
+    # Turn the request away before opening the stream if the upstream queue is full
+    if pipeline.dispatcher.saturated():
+        return json_response(*pipeline.error_response(g.session_id, Overloaded(QUEUE_FULL)))
+
+    # The stream outlives the handler's span, so its spans name their parent
+    events = pipeline.stream(g.session_id, user_input, root=tracer.current_span())
+
+    # Disable proxy buffering so tokens reach the browser immediately
+    headers = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return observe_stream(events), 200, headers
+
+
+# API endpoint for getting the session's chat history. Supports `limit`, `since`/`before` entry ID
+# cursors and ETag/If-None-Match, so clients only fetch what changed.
+@app.route("/api/history", methods=["GET"])
+async def history():
+    try:
+        page = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    # Reading SQLite blocks, so keep it off the event loop
+    last_id = await asyncio.to_thread(pipeline.history_store.last_id, g.session_id)
+    etag = history_etag(last_id, page.get("since"), page.get("before"), page.get("limit"))
+    if request.if_none_match.contains(etag):
+        response = app.response_class("", status=304)
+    else:
+        response = jsonify(await asyncio.to_thread(pipeline.history_store.list, g.session_id, **page))
+    response.set_etag(etag)
+    return response
+
+# API endpoint for full-text search over the session's chat history, best matches first.
+# `q` is the search text (a trailing * matches word prefixes); `limit` and `offset` page
+# through the results.
+@app.route("/api/history/search", methods=["GET"])
+async def history_search():
+    try:
+        search = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    # Reading SQLite blocks, so keep it off the event loop
+    return jsonify(await asyncio.to_thread(pipeline.search_history, g.session_id, search["q"],
+                                           search["limit"], search["offset"]))
+
+# API endpoint for cache hit/miss counters, semantic cache hit rate and lookup latency,
+# and how many requests were coalesced into another in-flight call
+@app.route("/api/cache/stats", methods=["GET"])
+async def cache_stats():
+    return jsonify(pipeline.cache_stats())
+
+# API endpoint for upstream connection pool usage (active, idle, queued, waits)
+@app.route("/api/pool/stats", methods=["GET"])
+async def upstream_pool_stats():
+    return jsonify(pool_stats())
+
+# API endpoint for the upstream dispatch queue (queued, in flight, rejected, timeouts)
+@app.route("/api/dispatch/stats", methods=["GET"])
+async def dispatch_stats():
+    return jsonify(pipeline.dispatcher.stats())
+
+# API endpoint for upstream call outcomes per model: retries, timeouts, hedging and circuit breaker state
+@app.route("/api/policy/stats", methods=["GET"])
+async def policy_stats():
+    return jsonify(pipeline.router.policy_stats())
+
+# API endpoint for how requests were routed to models, and how often they fell back
+@app.route("/api/router/stats", methods=["GET"])
+async def router_stats():
+    return jsonify(pipeline.router.stats())
+
+# API endpoint for upstream rate limit budgets and how often calls were throttled
+@app.route("/api/ratelimit/stats", methods=["GET"])
+async def upstream_rate_limit_stats():
+    return jsonify(rate_limit_stats())
+
+# Prometheus metrics: request, upstream, post-processing and serialization latency histograms,
+# cache, error and token counters, and history size and in-flight gauges, across all workers
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    # Reads the other workers' snapshots and counts SQLite rows, so keep it off the event loop
+    body = await asyncio.to_thread(registry.render)
+    return body, 200, {"Content-Type": CONTENT_TYPE}
+
+# Run the Quart app
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", 8000))  # Use environment variable for port
+    app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,163 @@
+import os
+import threading
+import types
+import uuid
+
+from stub_llm import RESPONSE_TEXT, ReplayStore, chunk_body, completion_body, stream_tokens
+
+# Pluggable LLM backends. Each one offers the part of the Groq client interface
+# the apps use (client.chat.completions.create and client.with_options), so app
+# code doesn't change with the backend. Pick one with LLM_BACKEND:
+#   groq    the Groq API (default)
+#   stub    the Groq client pointed at a local stub_llm server
+#   replay  recorded answers from LLM_REPLAY_FILE, in process, without any network
+#   record  the Groq API, appending every answer to LLM_REPLAY_FILE for later replay
+# The Groq SDK is only imported once a backend is built, so importing this module
+# (e.g. for needs_api_key() at Streamlit startup) stays cheap.
+
+
+def backend_name():
+    return os.getenv("LLM_BACKEND", "groq")
+
+# Only the backends that talk to the real API need GROQ_API_KEY
+def needs_api_key():
+    return backend_name() in ("groq", "record")
+
+
+# Answers from a ReplayStore, shaped like the Groq SDK's responses
+class ReplayBackend:
+    def __init__(self, store, miss="default"):
+        self.store = store
+        self.miss = miss
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def with_options(self, **options):
+        return self
+
+    def _content(self, model, messages):
+        content = self.store.get(model, messages)
+        if content is None:
+            if self.miss == "error":
+                raise LookupError("No recorded response for this prompt.")
+            content = RESPONSE_TEXT
+        return content
+
+    def _chunks(self, model, content):
+        from groq.types.chat import ChatCompletionChunk
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        chunks = [chunk_body(completion_id, model, {"content": token}) for token in stream_tokens(content)]
+        chunks.append(chunk_body(completion_id, model, {}, finish_reason="stop"))
+        return [ChatCompletionChunk.model_validate(chunk) for chunk in chunks]
+
+    def _completion(self, model, content):
+        from groq.types.chat import ChatCompletion
+
+        return ChatCompletion.model_validate(completion_body(model, content))
+
+    def create(self, model, messages, stream=False, **kwargs):
+        content = self._content(model, messages)
+        if stream:
+            return iter(self._chunks(model, content))
+        return self._completion(model, content)
+
+
+class AsyncReplayBackend(ReplayBackend):
+    async def create(self, model, messages, stream=False, **kwargs):
+        content = self._content(model, messages)
+        if stream:
+            return _aiter(self._chunks(model, content))
+        return self._completion(model, content)
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+# Wraps a Groq client and records every successful answer into a ReplayStore
+class RecordingBackend:
+    def __init__(self, client, store):
+        self.client = client
+        self.store = store
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def with_options(self, **options):
+        return type(self)(self.client.with_options(**options), self.store)
+
+    def _record_stream(self, stream, model, messages):
+        parts = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        self.store.record(model, messages, "".join(parts))
+
+    def create(self, model, messages, stream=False, **kwargs):
+        result = self.client.chat.completions.create(model=model, messages=messages, stream=stream, **kwargs)
+        if stream:
+            return self._record_stream(result, model, messages)
+        self.store.record(model, messages, result.choices[0].message.content)
+        return result
+
+
+class AsyncRecordingBackend(RecordingBackend):
+    async def _record_stream(self, stream, model, messages):
+        parts = []
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        self.store.record(model, messages, "".join(parts))
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        result = await self.client.chat.completions.create(model=model, messages=messages, stream=stream, **kwargs)
+        if stream:
+            return self._record_stream(result, model, messages)
+        self.store.record(model, messages, result.choices[0].message.content)
+        return result
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+# One replay store per file in this process
+def replay_store():
+    path = os.getenv("LLM_REPLAY_FILE", "replay.jsonl")
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ReplayStore(path)
+        return _stores[path]
+
+def _stub_url():
+    return os.getenv("LLM_STUB_URL", "http://127.0.0.1:9000")
+
+# The configured backend for sync code (Flask, Streamlit)
+def get_backend(api_key=None):
+    from clients import get_client
+
+    backend = backend_name()
+    if backend == "groq":
+        return get_client(api_key)
+    if backend == "stub":
+        return get_client(api_key or "stub", base_url=_stub_url())
+    if backend == "replay":
+        return ReplayBackend(replay_store(), os.getenv("LLM_REPLAY_MISS", "default"))
+    if backend == "record":
+        return RecordingBackend(get_client(api_key), replay_store())
+    raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+
+# The configured backend for asyncio code (the ASGI app)
+def get_async_backend(api_key=None):
+    from clients import get_async_client
+
+    backend = backend_name()
+    if backend == "groq":
+        return get_async_client(api_key)
+    if backend == "stub":
+        return get_async_client(api_key or "stub", base_url=_stub_url())
+    if backend == "replay":
+        return AsyncReplayBackend(replay_store(), os.getenv("LLM_REPLAY_MISS", "default"))
+    if backend == "record":
+        return AsyncRecordingBackend(get_async_client(api_key), replay_store())
+    raise ValueError(f"Unknown LLM_BACKEND: {backend}")
@@ -0,0 +1,121 @@
+"""Compare the sync (gunicorn + app.py) and async (uvicorn + asgi.py) serving paths
+against the local stub LLM server, at several concurrency levels. The response and
+semantic caches are off and every request asks a different question, so each one
+waits on the upstream instead of being answered from a cache or coalesced.
+
+    python benchmarks/bench_async.py --clients 50 200 1000 --duration 20
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Start a server process and wait until its port accepts connections
+def start_server(cmd, port, env):
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"Server did not start: {' '.join(cmd)}")
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+# Each client sends /api/chat requests back to back until the duration is over
+async def run_load(url, clients, duration):
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as http:
+        stop_at = time.perf_counter() + duration
+        numbers = itertools.count()
+
+        async def client_loop():
+            nonlocal errors
+            while time.perf_counter() < stop_at:
+                question = f"What is Python? (request {next(numbers)})"
+                start = time.perf_counter()
+                try:
+                    response = await http.post(f"{url}/api/chat", json={"message": question})
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--latency-ms", type=float, default=500, help="stub upstream latency")
+    parser.add_argument("--sync-workers", type=int, default=4, help="gunicorn sync workers")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, LLM_BACKEND="stub", LLM_STUB_URL="http://127.0.0.1:9100",
+               STUB_LATENCY_MS=str(args.latency_ms), CACHE_BACKEND="off", SEMANTIC_CACHE="off")
+    servers = {
+        "sync": ([sys.executable, "-m", "gunicorn", "app:app", "--bind=127.0.0.1:9101",
+                  f"--workers={args.sync_workers}", "--timeout=300"], 9101),
+        "async": ([sys.executable, "-m", "uvicorn", "asgi:app", "--port=9102",
+                   "--log-level=warning"], 9102),
+    }
+
+    stub = start_server([sys.executable, "-m", "uvicorn", "stub_llm:app", "--port=9100",
+                         "--log-level=warning"], 9100, env)
+    results = []
+    try:
+        for mode, (cmd, port) in servers.items():
+            proc = start_server(cmd, port, env)
+            try:
+                for clients in args.clients:
+                    result = asyncio.run(run_load(f"http://127.0.0.1:{port}", clients, args.duration))
+                    result["mode"] = mode
+                    results.append(result)
+                    print(f"{mode:>5} clients={clients:<5} rps={result['rps']:<8} "
+                          f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms errors={result['errors']}")
+            finally:
+                proc.terminate()
+                proc.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
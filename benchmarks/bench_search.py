@@ -0,0 +1,80 @@
+"""Latency of /api/history/search's store query at a large history size.
+
+Fills a SQLite history store with --turns synthetic turns spread over --sessions
+sessions (once; the file is reused while it has at least that many turns), then
+times searches for a rare word, a common word, two words, a prefix, a common word
+within one session and a later page of a common word.
+
+    python benchmarks/bench_search.py --turns 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ("python function class decorator generator async await thread process socket "
+         "database index query cache request response server client token stream error "
+         "exception import module package install version memory garbage list dict set tuple").split()
+
+
+def fill(store, turns, sessions, batch=50000):
+    conn = store._connect()
+    present = conn.execute("SELECT COUNT(*) FROM chat_history").fetchone()[0]
+    rng = random.Random(present)
+    for start in range(present, turns, batch):
+        rows = []
+        for i in range(start, min(turns, start + batch)):
+            user = " ".join(rng.choices(WORDS, k=8)) + f" item{i}?"
+            bot = "\n".join("- " + " ".join(rng.choices(WORDS, k=12)) for _ in range(3))
+            rows.append((f"session-{i % sessions}", "2024-01-01 00:00:00", user, bot, time.time()))
+        with conn:
+            conn.executemany("INSERT INTO chat_history (session_id, date, user, bot, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+        print(f"  {min(turns, start + batch)} turns", file=sys.stderr)
+
+
+def timed(store, samples, query, **kwargs):
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        results = store.search(query, **kwargs)
+        times.append((time.perf_counter() - start) * 1000)
+    return times, len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=1000000)
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "bench-search.db"))
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from bench_async import percentile
+    from history_store import SQLiteHistoryStore
+
+    store = SQLiteHistoryStore(args.db)
+    fill(store, args.turns, args.sessions)
+    cases = [
+        ("rare word", f"item{args.turns // 2}", {}),
+        ("common word", "python", {}),
+        ("two words", "async socket", {}),
+        ("prefix", "decor*", {}),
+        ("one session", "python", {"session_id": "session-7"}),
+        ("page 11", "python", {"offset": 200}),
+    ]
+    print(f"{args.turns} turns in {args.sessions} sessions")
+    for name, query, kwargs in cases:
+        times, count = timed(store, args.samples, query, **kwargs)
+        print(f"{name:<12} {query!r:<16} results={count:<3} p50={percentile(times, 50):.2f}ms "
+              f"p95={percentile(times, 95):.2f}ms mean={statistics.mean(times):.2f}ms")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
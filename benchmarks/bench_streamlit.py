@@ -0,0 +1,154 @@
+"""Startup and rerun latency of the Streamlit apps, measured with streamlit.testing.
+
+  cold start  a fresh Python process per sample runs the app's first script run:
+              its imports, resource construction and first render (importing
+              Streamlit itself is left out, it is the same for every app)
+  rerun       one session reruns the script over and over, as every widget
+              interaction does, with a transcript of --turns turns
+
+Runs against LLM_BACKEND=replay, so nothing is sent upstream, and writes the
+results as JSON tagged with the git commit.
+
+    python benchmarks/bench_streamlit.py --apps final.py app6.py --turns 200
+    python benchmarks/bench_streamlit.py --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Not imported from bench_async: that pulls in httpx, which would then already be
+# loaded when a cold start is measured
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def environment():
+    replay_file = os.path.join(tempfile.gettempdir(), "bench-streamlit-replay.jsonl")
+    return dict(os.environ, LLM_BACKEND="replay", LLM_REPLAY_FILE=replay_file)
+
+
+# One cold start, run in a fresh process by cold_start(); prints the first run's time in ms
+def cold_sample(app):
+    from streamlit.testing.v1 import AppTest
+
+    start = time.perf_counter()
+    at = AppTest.from_file(os.path.join(ROOT, app), default_timeout=60).run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise SystemExit(f"{app} failed: {at.exception[0].message}")
+    print(json.dumps({"first_run_ms": round(elapsed * 1000, 2)}))
+
+def cold_start(app, samples):
+    times = []
+    for _ in range(samples):
+        output = subprocess.check_output([sys.executable, __file__, "--cold-sample", app], cwd=ROOT,
+                                         env=environment(), stderr=subprocess.DEVNULL, text=True)
+        times.append(json.loads(output.strip().splitlines()[-1])["first_run_ms"])
+    return times
+
+
+def transcript(turns):
+    return [{"date": "2024-01-01 00:00:00", "user": f"Question {i}: what is item {i}?",
+             "bot": [f"- Item {i} is an example", "- It has a second bullet point", "- And a third one"]}
+            for i in range(turns)]
+
+def reruns(app, samples, turns):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, app), default_timeout=60).run()
+    at.session_state["chat_history"] = transcript(turns)
+    for _ in range(3):
+        at.run()
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        at.run()
+        times.append((time.perf_counter() - start) * 1000)
+        if at.exception:
+            raise SystemExit(f"{app} failed: {at.exception[0].message}")
+    return times
+
+
+def summarize(times):
+    from bench_async import percentile
+
+    return {"samples": len(times), "p50_ms": round(percentile(times, 50), 2), "p95_ms": round(percentile(times, 95), 2),
+            "mean_ms": round(statistics.mean(times), 2)}
+
+
+def print_report(report):
+    print(f"commit {report['commit']}  turns {report['config']['turns']}")
+    for app, stats in report["apps"].items():
+        cold, rerun = stats["cold_start"], stats["rerun"]
+        print(f"{app:<10} cold start p50={cold['p50_ms']}ms p95={cold['p95_ms']}ms   "
+              f"rerun p50={rerun['p50_ms']}ms p95={rerun['p95_ms']}ms")
+
+
+# Print latency changes against an earlier run
+def compare(report, baseline):
+    print(f"compared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+    for app, stats in report["apps"].items():
+        old_stats = baseline.get("apps", {}).get(app)
+        if not old_stats:
+            continue
+        deltas = []
+        for kind in ("cold_start", "rerun"):
+            for key in ("p50_ms", "p95_ms"):
+                old, new = old_stats[kind][key], stats[kind][key]
+                change = (new - old) / old * 100 if old else 0.0
+                deltas.append(f"{kind} {key} {old} -> {new} ({change:+.1f}%)")
+        print(f"{app:<10} " + ", ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apps", nargs="+", default=["final.py", "app6.py"])
+    parser.add_argument("--cold-samples", type=int, default=5, help="fresh processes per app")
+    parser.add_argument("--reruns", type=int, default=50, help="timed reruns per app")
+    parser.add_argument("--turns", type=int, default=200, help="turns in the transcript during reruns")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results"),
+                        help="JSON file, or directory to write a file named after the commit")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--cold-sample", metavar="APP", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    if args.cold_sample:
+        cold_sample(args.cold_sample)
+        return
+
+    from load_test import git_commit
+
+    os.environ.update(environment())
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"cold_samples": args.cold_samples, "reruns": args.reruns, "turns": args.turns},
+        "apps": {},
+    }
+    for app in args.apps:
+        report["apps"][app] = {
+            "cold_start": summarize(cold_start(app, args.cold_samples)),
+            "rerun": summarize(reruns(app, args.reruns, args.turns)),
+        }
+    print_report(report)
+
+    output = args.output
+    if os.path.isdir(output) or not output.endswith(".json"):
+        os.makedirs(output, exist_ok=True)
+        output = os.path.join(output, f"streamlit-{report['commit'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""Load test for the chat API (/api/chat and /api/history) against the local stub LLM.
+
+Virtual users arrive in phases (a Poisson process whose rate ramps linearly within
+each phase) and each runs one scenario, pausing for a think time between steps:
+
+  new_session   one question from a new session
+  follow_up     a question and two follow-ups in the same session
+  history_poll  a question, then polling /api/history with since/ETag
+
+Reports throughput, p50/p95/p99 latency, error rate and worker saturation per
+endpoint and phase, and writes the results as JSON tagged with the git commit.
+
+    python benchmarks/load_test.py --phases 30:1-10 60:10 30:10-30
+    python benchmarks/load_test.py --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+from bench_async import ROOT, percentile, start_server
+
+QUESTIONS = [
+    "What is Python?", "How do I reverse a list in Python?", "Explain how HTTP caching works",
+    "What is a REST API?", "Compare SQL and NoSQL databases", "What is Docker used for?",
+    "How does garbage collection work?", "What is the difference between a process and a thread?",
+    "Give me tips for writing clean code", "What is machine learning?", "How do I center a div?",
+    "What is the capital of Australia?", "Explain recursion with an example", "What is a hash table?",
+    "How do I read a CSV file in Python?", "What are microservices?", "What is Kubernetes?",
+    "Explain Big O notation", "What is a closure in JavaScript?", "How does TLS work?",
+]
+FOLLOW_UPS = ["Tell me more.", "Can you give an example?", "Why does that matter?", "Summarize that in one line."]
+SCENARIOS = {"new_session": 0.4, "follow_up": 0.4, "history_poll": 0.2}
+
+
+# Parse a phase like "60:10" (60 s at 10 users/s) or "30:1-20" (ramp from 1 to 20 users/s)
+def parse_phase(value):
+    duration, _, rates = value.partition(":")
+    start, _, end = rates.partition("-")
+    return {"duration": float(duration), "start_rate": float(start), "end_rate": float(end or start)}
+
+
+# Collects one sample per request and tracks how many are in flight
+class Recorder:
+    def __init__(self):
+        self.samples = []  # (phase, endpoint, seconds, status)
+        self.in_flight = 0
+        self.saturation = []  # (client requests in flight, server-side dispatch stats)
+
+    async def request(self, http, phase, endpoint, method, url, **kwargs):
+        self.in_flight += 1
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await http.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = "error"
+        finally:
+            self.in_flight -= 1
+        self.samples.append((phase, endpoint, time.perf_counter() - start, status))
+        return response
+
+
+def is_error(status):
+    return status == "error" or status >= 400
+
+
+class VirtualUser:
+    def __init__(self, http, recorder, phase, rng, think_time):
+        self.http = http
+        self.recorder = recorder
+        self.phase = phase
+        self.rng = rng
+        self.think_time = think_time
+        # Each user brings its own session; the shared client's cookie jar would mix them up
+        self.headers = {"X-Session-ID": str(uuid.UUID(int=rng.getrandbits(128), version=4))}
+
+    async def think(self):
+        await asyncio.sleep(self.rng.uniform(*self.think_time))
+
+    async def chat(self, message):
+        await self.recorder.request(self.http, self.phase, "/api/chat", "POST", "/api/chat",
+                                    json={"message": message}, headers=self.headers)
+
+    async def new_session(self):
+        await self.chat(self.rng.choice(QUESTIONS))
+
+    async def follow_up(self):
+        await self.chat(self.rng.choice(QUESTIONS))
+        for message in self.rng.sample(FOLLOW_UPS, 2):
+            await self.think()
+            await self.chat(message)
+
+    async def history_poll(self):
+        await self.chat(self.rng.choice(QUESTIONS))
+        since, etag = 0, None
+        for _ in range(3):
+            await self.think()
+            headers = dict(self.headers, **({"If-None-Match": etag} if etag else {}))
+            response = await self.recorder.request(self.http, self.phase, "/api/history", "GET", "/api/history",
+                                                   params={"since": since, "limit": 50}, headers=headers)
+            if response is not None and response.status_code == 200:
+                entries = response.json()
+                since = entries[-1]["id"] if entries else since
+                etag = response.headers.get("ETag")
+
+
+# Sample client-side concurrency and the server's dispatcher once a second
+async def sample_saturation(http, recorder, stop):
+    while not stop.is_set():
+        try:
+            dispatch = (await http.get("/api/dispatch/stats", timeout=5)).json()
+        except (httpx.HTTPError, ValueError):
+            dispatch = None
+        recorder.saturation.append((recorder.in_flight, dispatch))
+        try:
+            await asyncio.wait_for(stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_phases(url, phases, think_time, seed):
+    rng = random.Random(seed)
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as http:
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_saturation(http, recorder, stop))
+        users = []
+        started = time.perf_counter()
+        for index, phase in enumerate(phases):
+            name = f"{index + 1}:{phase['start_rate']:g}-{phase['end_rate']:g}/s"
+            phase_start = time.perf_counter()
+            while (elapsed := time.perf_counter() - phase_start) < phase["duration"]:
+                rate = phase["start_rate"] + (phase["end_rate"] - phase["start_rate"]) * elapsed / phase["duration"]
+                scenario = rng.choices(list(SCENARIOS), weights=list(SCENARIOS.values()))[0]
+                user = VirtualUser(http, recorder, name, random.Random(rng.random()), think_time)
+                users.append(asyncio.create_task(getattr(user, scenario)()))
+                await asyncio.sleep(rng.expovariate(rate) if rate > 0 else phase["duration"])
+        # Let users that are still running finish their scenario
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+    return recorder, elapsed
+
+
+def summarize(samples, elapsed):
+    latencies = [seconds for _, _, seconds, status in samples if not is_error(status)]
+    errors = sum(1 for _, _, _, status in samples if is_error(status))
+    statuses = defaultdict(int)
+    for _, _, _, status in samples:
+        statuses[str(status)] += 1
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "statuses": dict(statuses),
+    }
+
+
+def saturation_report(recorder, capacity):
+    concurrency = [in_flight for in_flight, _ in recorder.saturation]
+    dispatch = [stats for _, stats in recorder.saturation if stats]
+    report = {
+        "capacity": capacity,
+        "peak_in_flight": max(concurrency, default=0),
+        "mean_in_flight": round(sum(concurrency) / len(concurrency), 2) if concurrency else 0.0,
+    }
+    if capacity:
+        # Share of samples with more requests in flight than the server has worker slots
+        report["saturated_share"] = round(sum(1 for n in concurrency if n >= capacity) / len(concurrency), 4) if concurrency else 0.0
+    if dispatch:
+        report["peak_upstream_queued"] = max(stats["queued"] for stats in dispatch)
+        report["peak_upstream_in_flight"] = max(stats["in_flight"] for stats in dispatch)
+        report["upstream_rejected"] = max(stats["rejected"] for stats in dispatch)
+    return report
+
+
+def build_report(recorder, elapsed, args, phases, capacity):
+    endpoints = defaultdict(list)
+    by_phase = defaultdict(list)
+    for sample in recorder.samples:
+        endpoints[sample[1]].append(sample)
+        by_phase[sample[0]].append(sample)
+    phase_seconds = {f"{i + 1}:{p['start_rate']:g}-{p['end_rate']:g}/s": p["duration"] for i, p in enumerate(phases)}
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"server": args.server, "workers": args.workers, "threads": args.threads,
+                   "latency_ms": args.latency_ms, "latency_dist": args.latency_dist,
+                   "think_time": args.think_time, "seed": args.seed, "phases": phases},
+        "duration_s": round(elapsed, 1),
+        "overall": summarize(recorder.samples, elapsed),
+        "endpoints": {name: summarize(samples, elapsed) for name, samples in endpoints.items()},
+        "phases": {name: summarize(samples, phase_seconds.get(name, elapsed)) for name, samples in by_phase.items()},
+        "saturation": saturation_report(recorder, capacity),
+    }
+    if args.slo_p95_ms:
+        report["slo"] = {name: {"p95_ms": stats["p95_ms"], "target_ms": args.slo_p95_ms, "met": stats["p95_ms"] <= args.slo_p95_ms}
+                         for name, stats in report["endpoints"].items()}
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    print(f"commit {report['commit']}  duration {report['duration_s']}s")
+    rows = [("overall", report["overall"])] + sorted(report["endpoints"].items()) + sorted(report["phases"].items())
+    for name, stats in rows:
+        print(f"{name:<16} req={stats['requests']:<6} rps={stats['rps']:<7} err={stats['error_rate']:<7} "
+              f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    print("saturation", json.dumps(report["saturation"]))
+    for name, slo in report.get("slo", {}).items():
+        print(f"SLO {name}: p95 {slo['p95_ms']}ms / {slo['target_ms']}ms {'met' if slo['met'] else 'MISSED'}")
+
+
+# Print throughput and latency changes against an earlier run
+def compare(report, baseline):
+    print(f"compared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+    for name in ["overall"] + sorted(report["endpoints"]):
+        new = report["overall"] if name == "overall" else report["endpoints"][name]
+        old = baseline["overall"] if name == "overall" else baseline.get("endpoints", {}).get(name)
+        if not old:
+            continue
+        deltas = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms", "error_rate"):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            deltas.append(f"{key} {old[key]} -> {new[key]} ({change:+.1f}%)")
+        print(f"{name:<14} " + ", ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--phases", nargs="+", default=["20:1-10", "40:10", "20:10-25"],
+                        help="duration:rate or duration:start-end in arriving users per second")
+    parser.add_argument("--think-time", type=float, nargs=2, default=[0.5, 2.0], metavar=("MIN", "MAX"))
+    parser.add_argument("--server", choices=["sync", "async"], default="sync",
+                        help="app.py on gunicorn threads (sync) or asgi.py on uvicorn (async)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="threads per sync worker")
+    parser.add_argument("--url", help="test an already running app instead of starting one")
+    parser.add_argument("--latency-ms", type=float, default=500, help="median stub upstream latency")
+    parser.add_argument("--latency-dist", default="lognormal", help="stub latency distribution")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--slo-p95-ms", type=float, help="p95 latency target per endpoint")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results"),
+                        help="JSON file, or directory to write a file named after the commit")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+    phases = [parse_phase(phase) for phase in args.phases]
+
+    processes = []
+    capacity = None
+    try:
+        if args.url:
+            url = args.url
+        else:
+            data_dir = tempfile.mkdtemp(prefix="load-test-")
+            env = dict(os.environ, LLM_BACKEND="stub", LLM_STUB_URL="http://127.0.0.1:9200",
+                       STUB_LATENCY_MS=str(args.latency_ms), STUB_LATENCY_DIST=args.latency_dist,
+                       STUB_LATENCY_SPREAD_MS=str(args.latency_ms / 2), STUB_SEED=str(args.seed),
+                       HISTORY_DB=os.path.join(data_dir, "chat_history.db"))
+            processes.append(start_server([sys.executable, "-m", "uvicorn", "stub_llm:app", "--port=9200",
+                                           "--log-level=warning"], 9200, env))
+            if args.server == "sync":
+                cmd = [sys.executable, "-m", "gunicorn", "app:app", "--bind=127.0.0.1:9201", "--worker-class=gthread",
+                       f"--workers={args.workers}", f"--threads={args.threads}", "--timeout=300"]
+                capacity = args.workers * args.threads
+            else:
+                cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port=9201", f"--workers={args.workers}",
+                       "--log-level=warning"]
+            processes.append(start_server(cmd, 9201, env))
+            url = "http://127.0.0.1:9201"
+
+        recorder, elapsed = asyncio.run(run_phases(url, phases, args.think_time, args.seed))
+    finally:
+        for proc in reversed(processes):
+            proc.terminate()
+            proc.wait()
+
+    report = build_report(recorder, elapsed, args, phases, capacity)
+    print_report(report)
+
+    output = args.output
+    if os.path.isdir(output) or not output.endswith(".json"):
+        os.makedirs(output, exist_ok=True)
+        output = os.path.join(output, f"load-{report['commit'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+    # Non-zero exit when an SLO was missed, for use in CI
+    if not all(slo["met"] for slo in report.get("slo", {}).values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
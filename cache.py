@@ -0,0 +1,104 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Response cache for chat completions, keyed on model + normalized prompt.
+# Two backends: an in-process LRU store and a Redis-compatible store that can be
+# shared between gunicorn workers. Pick one with the CACHE_BACKEND env var.
+
+# Fold case and collapse whitespace so trivially different prompts share a key
+def normalize_prompt(text):
+    return " ".join(text.casefold().split())
+
+# Build the cache key for a model and a list of chat messages
+def cache_key(model, messages):
+    prompt = "\n".join(f"{m['role']}:{normalize_prompt(m['content'])}" for m in messages)
+    return hashlib.sha256(f"{model}\n{prompt}".encode()).hexdigest()
+
+
+# In-process cache with LRU eviction and a per-entry TTL
+class MemoryCache:
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+# Cache stored in Redis (or any Redis-compatible server). Entries expire through the
+# Redis TTL; LRU eviction is left to the server's maxmemory-policy (allkeys-lru).
+# Hit/miss counters live in Redis too, so they cover every worker.
+class RedisCache:
+    def __init__(self, url="redis://localhost:6379/0", ttl=3600, prefix="chatcache"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("CACHE_BACKEND=redis requires the 'redis' package (pip install redis).")
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.redis.get(f"{self.prefix}:{key}")
+        self.redis.incr(f"{self.prefix}:stats:{'misses' if value is None else 'hits'}")
+        return None if value is None else value.decode()
+
+    def set(self, key, value):
+        self.redis.set(f"{self.prefix}:{key}", value, ex=self.ttl)
+
+    def stats(self):
+        hits, misses = self.redis.mget(f"{self.prefix}:stats:hits", f"{self.prefix}:stats:misses")
+        return {"backend": "redis", "hits": int(hits or 0), "misses": int(misses or 0)}
+
+
+# Cache that stores nothing, used when caching is switched off
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def stats(self):
+        return {"backend": "off", "hits": 0, "misses": 0}
+
+
+# Build the response cache configured through environment variables
+def make_cache():
+    backend = os.getenv("CACHE_BACKEND", "memory")
+    ttl = int(os.getenv("CACHE_TTL", 3600))
+
+    if backend == "memory":
+        return MemoryCache(max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 1024)), ttl=ttl)
+    if backend == "redis":
+        return RedisCache(url=os.getenv("REDIS_URL", "redis://localhost:6379/0"), ttl=ttl)
+    if backend == "off":
+        return NullCache()
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+from groq import AsyncGroq, DefaultAsyncHttpxClient, DefaultHttpxClient, Groq
+
+from ratelimit import RateLimited, make_rate_limiter, rate_limited_response
+
+# Shared Groq clients. Every app gets one client per process, so connections are
+# reused across requests (and Streamlit reruns) instead of being re-established.
+# Pool size, keep-alive, HTTP/2 and timeouts are configured through env vars, and
+# every chat completion is paced by the rate limiter in ratelimit.py.
+
+# HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# Pool and timeout settings from the environment
+def pool_config():
+    http2 = os.getenv("GROQ_HTTP2", "auto")
+    return {
+        "max_connections": int(os.getenv("GROQ_POOL_MAX_CONNECTIONS", 100)),
+        "max_keepalive_connections": int(os.getenv("GROQ_POOL_MAX_KEEPALIVE", 20)),
+        "keepalive_expiry": float(os.getenv("GROQ_KEEPALIVE_EXPIRY", 30)),
+        "http2": http2_available() if http2 == "auto" else http2 == "1",
+        "connect_timeout": float(os.getenv("GROQ_CONNECT_TIMEOUT", 5)),
+        "read_timeout": float(os.getenv("GROQ_READ_TIMEOUT", 60)),
+        "max_retries": int(os.getenv("GROQ_MAX_RETRIES", 2)),
+    }
+
+
+# Counts requests in flight (until their response is closed), and requests that
+# found every pooled connection busy. Requests beyond max_connections wait in the pool
+# (over HTTP/2 they share connections instead).
+class _PoolCounters:
+    def _init_counters(self, max_connections):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.waits = 0
+        self.in_flight = 0
+        self._counter_lock = threading.Lock()
+
+    def _started(self):
+        with self._counter_lock:
+            self.requests += 1
+            if self.in_flight >= self.max_connections:
+                self.waits += 1
+            self.in_flight += 1
+
+    def _finished(self):
+        with self._counter_lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        # httpx keeps its pool private; `connections` is httpcore's public pool API
+        connections = self._pool.connections
+        active = sum(1 for connection in connections if not connection.is_idle())
+        with self._counter_lock:
+            in_flight, requests, waits = self.in_flight, self.requests, self.waits
+        return {
+            "active": active,
+            "idle": len(connections) - active,
+            "queued": max(in_flight - self.max_connections, 0),
+            "requests": requests,
+            "waits": waits,
+            "max_connections": self.max_connections,
+        }
+
+
+# Response body that reports when it is closed
+class _ObservedStream(httpx.SyncByteStream):
+    def __init__(self, stream, closed):
+        self._stream = stream
+        self._closed = closed
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._closed()
+
+
+class _AsyncObservedStream(httpx.AsyncByteStream):
+    def __init__(self, stream, closed):
+        self._stream = stream
+        self._closed = closed
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._closed()
+
+
+class PooledTransport(_PoolCounters, httpx.HTTPTransport):
+    def __init__(self, limits, limiter=None, **kwargs):
+        super().__init__(limits=limits, **kwargs)
+        self._init_counters(limits.max_connections)
+        self.limiter = limiter
+
+    def handle_request(self, request):
+        if self.limiter:
+            try:
+                delay = self.limiter.before_request(request)
+            except RateLimited as e:
+                return rate_limited_response(request, e)
+            if delay:
+                time.sleep(delay)
+        self._started()
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            self._finished()
+            raise
+        response.stream = _ObservedStream(response.stream, self._finished)
+        if self.limiter:
+            self.limiter.update(response.status_code, response.headers)
+        return response
+
+
+class AsyncPooledTransport(_PoolCounters, httpx.AsyncHTTPTransport):
+    def __init__(self, limits, limiter=None, **kwargs):
+        super().__init__(limits=limits, **kwargs)
+        self._init_counters(limits.max_connections)
+        self.limiter = limiter
+
+    async def handle_async_request(self, request):
+        if self.limiter:
+            try:
+                delay = self.limiter.before_request(request)
+            except RateLimited as e:
+                return rate_limited_response(request, e)
+            if delay:
+                await asyncio.sleep(delay)
+        self._started()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self._finished()
+            raise
+        response.stream = _AsyncObservedStream(response.stream, self._finished)
+        if self.limiter:
+            self.limiter.update(response.status_code, response.headers)
+        return response
+
+
+def _client_options(config):
+    limits = httpx.Limits(
+        max_connections=config["max_connections"],
+        max_keepalive_connections=config["max_keepalive_connections"],
+        keepalive_expiry=config["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"])
+    return limits, timeout
+
+# Build a new Groq client with a pooled transport; returns the client and its transport
+# `base_url` defaults to GROQ_BASE_URL or the Groq API
+def _build_client(api_key=None, base_url=None):
+    config = pool_config()
+    limits, timeout = _client_options(config)
+    transport = PooledTransport(limits, make_rate_limiter(), http2=config["http2"])
+    http_client = DefaultHttpxClient(transport=transport, timeout=timeout)
+    client = Groq(api_key=api_key, base_url=base_url, http_client=http_client, timeout=timeout, max_retries=config["max_retries"])
+    return client, transport
+
+def _build_async_client(api_key=None, base_url=None):
+    config = pool_config()
+    limits, timeout = _client_options(config)
+    transport = AsyncPooledTransport(limits, make_rate_limiter(), http2=config["http2"])
+    http_client = DefaultAsyncHttpxClient(transport=transport, timeout=timeout)
+    client = AsyncGroq(api_key=api_key, base_url=base_url, http_client=http_client, timeout=timeout, max_retries=config["max_retries"])
+    return client, transport
+
+_clients = {}  # (kind, api_key, base_url) -> (pid, client, transport)
+_clients_lock = threading.Lock()
+
+# Process-wide client per API key and base URL, rebuilt if the process was forked since it was made
+def _shared(kind, build, api_key, base_url):
+    key = (kind, api_key, base_url)
+    with _clients_lock:
+        pid, client, _ = _clients.get(key, (None, None, None))
+        if client is None or pid != os.getpid():
+            client, transport = build(api_key, base_url)
+            _clients[key] = (os.getpid(), client, transport)
+        return client
+
+def get_client(api_key=None, base_url=None):
+    return _shared("sync", _build_client, api_key, base_url)
+
+def get_async_client(api_key=None, base_url=None):
+    return _shared("async", _build_async_client, api_key, base_url)
+
+# Rate limiter of a shared client, or None
+def rate_limiter_for(client):
+    with _clients_lock:
+        for _, shared, transport in _clients.values():
+            if shared is client:
+                return transport.limiter
+    return None
+
+# Transports of the shared clients in this process, labelled "sync" or "async" plus the
+# base URL if it isn't the default; clients that differ only in API key are numbered
+def _transports():
+    with _clients_lock:
+        entries = [(key, transport) for key, (pid, _, transport) in _clients.items() if pid == os.getpid()]
+    labelled, seen = [], {}
+    for (kind, _, base_url), transport in entries:
+        label = kind if base_url is None else f"{kind} {base_url}"
+        seen[label] = seen.get(label, 0) + 1
+        labelled.append((label if seen[label] == 1 else f"{label} #{seen[label]}", transport))
+    return labelled
+
+# Pool usage of the shared clients in this process
+def pool_stats():
+    return {label: transport.stats() for label, transport in _transports()}
+
+# Rate limiter state and throttling counters of the shared clients in this process
+def rate_limit_stats():
+    return {label: transport.limiter.stats() for label, transport in _transports() if transport.limiter}
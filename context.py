@@ -0,0 +1,127 @@
+import os
+import threading
+from collections import OrderedDict
+
+from llm import bot_text
+
+# Multi-turn context for upstream calls. Recent turns of the session are sent as
+# chat messages up to a token budget; older turns are folded into a rolling summary
+# that is cached per session, so prompt size stays bounded however long the
+# conversation runs.
+
+# Rough token count (about 4 characters per token for English text). Good enough
+# for budgeting and far cheaper than running a real tokenizer.
+def estimate_tokens(text):
+    return (len(text) + 3) // 4 if text else 0
+
+def turn_tokens(turn):
+    return estimate_tokens(turn['user']) + estimate_tokens(bot_text(turn['bot'])) + 8
+
+def messages_tokens(messages):
+    return sum(estimate_tokens(message['content']) + 4 for message in messages)
+
+
+class ContextBuilder:
+    # `summarize(summary, turns)` returns the summary updated with the given turns;
+    # it may be a coroutine function when the builder is used through abuild().
+    def __init__(self, summarize, token_budget=1500, max_turns=50, max_sessions=10000):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self._summaries = OrderedDict()  # session_id -> (ID of last summarized turn, summary)
+        self._lock = threading.Lock()
+
+    def summary(self, session_id):
+        with self._lock:
+            return self._summaries.get(session_id, (0, None))
+
+    def _store(self, session_id, covered_id, summary):
+        with self._lock:
+            self._summaries[session_id] = (covered_id, summary)
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+
+    # Turns not yet covered by the summary, oldest first. Turns without an ID
+    # (Streamlit history) are numbered by position.
+    def _recent(self, session_id, turns):
+        turns = [turn if 'id' in turn else dict(turn, id=i + 1) for i, turn in enumerate(turns)]
+        covered_id, summary = self.summary(session_id)
+        return [turn for turn in turns if turn['id'] > covered_id], summary
+
+    # Turns that no longer fit the budget and must be folded into the summary. When
+    # over budget, the window shrinks to half the budget so the summary is only
+    # refreshed every few turns rather than on every request.
+    def _overflow(self, session_id, turns, messages):
+        recent, summary = self._recent(session_id, turns)
+        budget = self.token_budget - messages_tokens(messages) - estimate_tokens(summary)
+        if sum(turn_tokens(turn) for turn in recent) <= budget:
+            return []
+
+        kept, used = 0, 0
+        for turn in reversed(recent):
+            used += turn_tokens(turn)
+            if used > budget // 2:
+                break
+            kept += 1
+        return recent[:len(recent) - kept]
+
+    def _assemble(self, session_id, turns, messages):
+        recent, summary = self._recent(session_id, turns)
+        context = []
+        if summary:
+            context.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        for turn in recent:
+            context.append({"role": "user", "content": turn['user']})
+            context.append({"role": "assistant", "content": bot_text(turn['bot'])})
+        return context + messages
+
+    # Keep the old summary if summarizing fails; the dropped turns are then lost
+    # from the context, but the chat request itself still goes through
+    def _fold(self, session_id, dropped, summary):
+        self._store(session_id, dropped[-1]['id'], summary if summary is not None else self.summary(session_id)[1])
+
+    # Prefix `messages` with the session's earlier turns, oldest first
+    def build(self, session_id, turns, messages):
+        dropped = self._overflow(session_id, turns, messages)
+        if dropped:
+            try:
+                summary = self.summarize(self.summary(session_id)[1], dropped)
+            except Exception:
+                summary = None
+            self._fold(session_id, dropped, summary)
+        return self._assemble(session_id, turns, messages)
+
+    # Same as build(), for a coroutine `summarize`
+    async def abuild(self, session_id, turns, messages):
+        dropped = self._overflow(session_id, turns, messages)
+        if dropped:
+            try:
+                summary = await self.summarize(self.summary(session_id)[1], dropped)
+            except Exception:
+                summary = None
+            self._fold(session_id, dropped, summary)
+        return self._assemble(session_id, turns, messages)
+
+
+# Build the context builder configured through environment variables, or None when
+# multi-turn context is switched off (CONTEXT_TOKEN_BUDGET=0)
+def make_context_builder(summarize):
+    token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+    if token_budget <= 0:
+        return None
+    return ContextBuilder(summarize, token_budget=token_budget, max_turns=int(os.getenv("CONTEXT_MAX_TURNS", 50)))
+
+
+# Bring a session summary up to date with the turns added since it was made.
+# `covered` is how many turns of `turns` the summary already includes. Only the old
+# summary and the new turns are sent upstream, and nothing at all when there are no
+# new turns. Returns the new (summary, covered) pair.
+def update_summary(summarize, summary, covered, turns):
+    if covered > len(turns):
+        # History was replaced or cleared since the summary was made
+        summary, covered = None, 0
+    if summary is not None and covered == len(turns):
+        return summary, covered
+    return summarize(summary, turns[covered:]), len(turns)
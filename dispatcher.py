@@ -0,0 +1,221 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+# Admission control for upstream calls. Requests wait in a bounded queue for one of
+# a limited number of upstream slots (overall and per model). Slots are handed out
+# round-robin between sessions, so one busy session can't starve the others. When
+# the queue is full, or a request waits too long, Overloaded is raised right away
+# so the app can answer 503 instead of piling up blocked workers.
+
+
+class Overloaded(Exception):
+    pass
+
+
+QUEUE_FULL = "Too many requests are waiting for the AI. Please retry shortly."
+
+
+class _Job:
+    __slots__ = ("session_id", "model", "waiter")
+
+    def __init__(self, session_id, model, waiter):
+        self.session_id = session_id
+        self.model = model
+        self.waiter = waiter
+
+
+# Queue bookkeeping shared by the thread and asyncio dispatchers. Not thread-safe
+# on its own; callers hold their lock.
+class _Scheduler:
+    def __init__(self, max_in_flight=32, max_queue=128, model_limits=None, queue_timeout=30):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.model_limits = model_limits or {}
+        self.queue_timeout = queue_timeout
+        self.dispatched = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._queues = OrderedDict()  # session_id -> deque of jobs, in round-robin order
+        self._queued = 0
+        self._in_flight = 0
+        self._model_in_flight = defaultdict(int)
+
+    def _has_capacity(self, model):
+        limit = self.model_limits.get(model)
+        return self._in_flight < self.max_in_flight and (limit is None or self._model_in_flight[model] < limit)
+
+    def _start(self, job):
+        self._in_flight += 1
+        self._model_in_flight[job.model] += 1
+        self.dispatched += 1
+
+    # Queue a job and return the jobs that can start now (possibly including it)
+    def _enqueue(self, job):
+        # Nobody is waiting and there is room: skip the queue
+        if not self._queued and self._has_capacity(job.model):
+            self._start(job)
+            return [job]
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(QUEUE_FULL)
+        self._queues.setdefault(job.session_id, deque()).append(job)
+        self._queued += 1
+        return self._schedule()
+
+    # Take the next job from each session in turn while there is capacity
+    def _schedule(self):
+        granted = []
+        progress = True
+        while progress and self._queued and self._in_flight < self.max_in_flight:
+            progress = False
+            for session_id in list(self._queues):
+                queue = self._queues[session_id]
+                job = queue[0]
+                if not self._has_capacity(job.model):
+                    continue
+                queue.popleft()
+                self._queued -= 1
+                # Served sessions go to the back of the ring
+                if queue:
+                    self._queues.move_to_end(session_id)
+                else:
+                    del self._queues[session_id]
+                self._start(job)
+                granted.append(job)
+                progress = True
+                if self._in_flight >= self.max_in_flight:
+                    break
+        return granted
+
+    # Start a job only if nobody is waiting and there is room
+    def _try_start(self, job):
+        if self._queued or not self._has_capacity(job.model):
+            return False
+        self._start(job)
+        return True
+
+    def _release(self, model):
+        self._in_flight -= 1
+        self._model_in_flight[model] -= 1
+        return self._schedule()
+
+    # Remove a job that gave up waiting; False if it was already granted a slot
+    def _cancel(self, job):
+        queue = self._queues.get(job.session_id)
+        if queue is None or job not in queue:
+            return False
+        queue.remove(job)
+        self._queued -= 1
+        if not queue:
+            del self._queues[job.session_id]
+        return True
+
+    # New requests would be rejected right now
+    def saturated(self):
+        return self._queued >= self.max_queue and self._in_flight >= self.max_in_flight
+
+    def stats(self):
+        return {
+            "queued": self._queued,
+            "in_flight": self._in_flight,
+            "in_flight_by_model": {model: n for model, n in self._model_in_flight.items() if n},
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+
+# Dispatcher for threaded servers (Flask under gunicorn)
+class Dispatcher(_Scheduler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    # Hold one upstream slot for the duration of the block. With wait=False, raise
+    # Overloaded instead of queueing (for optional calls such as hedges).
+    @contextmanager
+    def slot(self, session_id, model, wait=True):
+        job = _Job(session_id, model, threading.Event())
+        with self._lock:
+            if not wait and not self._try_start(job):
+                raise Overloaded(QUEUE_FULL)
+            granted = self._enqueue(job) if wait else [job]
+        for other in granted:
+            other.waiter.set()
+
+        if not job.waiter.wait(self.queue_timeout):
+            with self._lock:
+                if self._cancel(job):
+                    self.timeouts += 1
+                    raise Overloaded("Timed out waiting for the AI. Please retry shortly.")
+            # Granted right as the wait timed out: use the slot
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                granted = self._release(model)
+            for other in granted:
+                other.waiter.set()
+
+    def saturated(self):
+        with self._lock:
+            return super().saturated()
+
+    def stats(self):
+        with self._lock:
+            return super().stats()
+
+
+# Dispatcher for the asyncio (ASGI) app; everything runs on the event loop thread
+class AsyncDispatcher(_Scheduler):
+    @asynccontextmanager
+    async def slot(self, session_id, model, wait=True):
+        job = _Job(session_id, model, asyncio.get_running_loop().create_future())
+        if not wait and not self._try_start(job):
+            raise Overloaded(QUEUE_FULL)
+        for other in self._enqueue(job) if wait else [job]:
+            other.waiter.set_result(None)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(job.waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if self._cancel(job):
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.timeouts += 1
+                raise Overloaded("Timed out waiting for the AI. Please retry shortly.")
+            if isinstance(e, asyncio.CancelledError):
+                # Granted but no longer wanted: hand the slot on
+                for other in self._release(model):
+                    other.waiter.set_result(None)
+                raise
+
+        try:
+            yield
+        finally:
+            for other in self._release(model):
+                other.waiter.set_result(None)
+
+
+# Read DISPATCH_MODEL_LIMITS, e.g. "llama-3.3-70b-versatile=8,llama-3.1-8b-instant=32"
+def parse_model_limits(value):
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        model, _, limit = item.partition("=")
+        limits[model.strip()] = int(limit)
+    return limits
+
+# Build a dispatcher configured through environment variables
+def make_dispatcher(cls=Dispatcher):
+    return cls(
+        max_in_flight=int(os.getenv("DISPATCH_MAX_IN_FLIGHT", 32)),
+        max_queue=int(os.getenv("DISPATCH_MAX_QUEUE", 128)),
+        model_limits=parse_model_limits(os.getenv("DISPATCH_MODEL_LIMITS", "")),
+        queue_timeout=float(os.getenv("DISPATCH_QUEUE_TIMEOUT", 30)),
+    )
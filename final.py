@@ -1,21 +1,25 @@
 import streamlit as st
 import os
 import uuid
-from groq import Groq
-from dotenv import load_dotenv
-from datetime import datetime
-
-# Load environment variables
-load_dotenv()
+from backends import needs_api_key
+from streamlit_chat import answer, get_config, get_response_cache, summarize_turns
+from transcript import render_transcript, reset_transcript
+from context import make_context_builder, update_summary
 
 # Retrieve API key
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
+api_key = get_config()["api_key"]
+if not api_key and needs_api_key():
     st.error("GROQ_API_KEY is not set in environment variables. Please check your .env file.")
     st.stop()
 
-# Initialize Groq API client
-client = Groq(api_key=api_key)
+response_cache = get_response_cache()
+
+# Share one context builder (and its cached summaries) across reruns and sessions
+@st.cache_resource
+def get_context_builder():
+    return make_context_builder(summarize_turns)
+
+context_builder = get_context_builder()
 
 # Initialize session state
 if "session_id" not in st.session_state:
@@ -38,9 +42,13 @@ with st.sidebar:
     for session_key, session_data in st.session_state.session_history.items():
         session_label = session_data['title']  # Use the first input as the session title
         if st.button(session_label):
-            st.session_state.chat_history = session_data['history']
+            # A copy: new turns are appended to both lists
+            st.session_state.chat_history = list(session_data['history'])
+            st.session_state.session_id = session_key  # Continue the opened session
             st.session_state.selected_session = session_key
             st.session_state.session_summary = session_data.get('summary', None)
+            st.session_state.summary_covered = session_data.get('summary_covered', 0)
+            reset_transcript()
 
     # New Chat Button (clears the current chat history and starts a new one)
     if st.button("🆕 New Chat"):
@@ -49,29 +57,39 @@ with st.sidebar:
         st.session_state.session_id = new_session_id
         st.session_state.selected_session = None
         st.session_state.session_summary = None
+        st.session_state.summary_covered = 0
+        reset_transcript()
 
     # Clear All Chats Button
     if st.button("🗑️ Clear All Chats"):
         st.session_state.session_history = {}
 
+    # Response cache hit/miss counters
+    cache_stats = response_cache.stats()
+    st.caption(f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+
     # Summarize All Chats Button
     if st.button("📌 Summarize Session"):
         if st.session_state.chat_history:
-            all_chats_text = "\n".join(
-                [f"User: {chat['user']}\nBot: {' '.join(chat['bot'])}" for chat in st.session_state.chat_history]
-            )
-            
             try:
-                summary_response = client.chat.completions.create(
-                    messages=[
-                        {"role": "user", "content": f"Summarize this chat session with key points:\n{all_chats_text}"}
-                    ],
-                    model="llama-3.3-70b-versatile",
+                # Only the previous summary and the turns added since are sent upstream;
+                # a repeat click with no new turns reuses the stored summary
+                summary, covered = update_summary(
+                    summarize_turns,
+                    st.session_state.get("session_summary"),
+                    st.session_state.get("summary_covered", 0),
+                    st.session_state.chat_history,
                 )
+                st.session_state.session_summary = summary
+                st.session_state.summary_covered = covered
 
-                if summary_response and summary_response.choices:
-                    st.session_state.session_summary = summary_response.choices[0].message.content
-                    st.success("Session summary generated!")
+                # Keep the summary with the chat it belongs to, so it survives switching sessions
+                selected_session = st.session_state.get("selected_session")
+                if selected_session in st.session_state.session_history:
+                    session_data = st.session_state.session_history[selected_session]
+                    session_data['summary'] = summary
+                    session_data['summary_covered'] = covered
+                st.success("Session summary generated!")
 
             except Exception as e:
                 st.error(f"An error occurred while summarizing: {e}")
@@ -93,10 +111,10 @@ if "selected_session" in st.session_state and st.session_state.selected_session:
     selected_session = st.session_state.selected_session
     if selected_session in st.session_state.session_history:
         chat_history = st.session_state.session_history[selected_session]['history']
-        st.subheader("Previous Conversation")
-        for chat in chat_history:
-            st.write(f"**You:** {chat['user']}")
-            st.write(f"**Bot:** {' '.join(chat['bot'])}")
+        # Skip it when it is the chat shown below anyway
+        if chat_history != st.session_state.chat_history:
+            st.subheader("Previous Conversation")
+            render_transcript(chat_history, key="previous_pages", style="plain")
 
 # Chat UI
 st.markdown("---")
@@ -131,47 +149,30 @@ st.markdown("""
 # Chat Message Container
 chat_container = st.container()
 
-# Display chat messages with custom CSS (User's message right-aligned, Bot's left-aligned)
-for chat in st.session_state.chat_history:
-    with chat_container:
-        # Display user's message with a background and aligned right
-        st.markdown(f"<div class='user-message'><b>You:</b> {chat['user']}</div>", unsafe_allow_html=True)
-        # Display bot's message with a background and aligned left
-        st.markdown(f"<div class='bot-message'><b>Bot:</b> {'<br>'.join(chat['bot'])}</div>", unsafe_allow_html=True)
+# Display chat messages with custom CSS (User's message right-aligned, Bot's left-aligned),
+# the latest pages only
+with chat_container:
+    render_transcript(st.session_state.chat_history)
 
-# Chat Input with Enter to Send & Loading Spinner
+# Chat Input with Enter to Send: queue the question, it is answered further down so the
+# answer can stream into the chat container
 def process_input():
     user_input = st.session_state.chat_input.strip()
-    
     if user_input:
-        with st.spinner("🤖 Analyzing... Please wait..."):  # Show loading indicator
-            try:
-                chat_completion = client.chat.completions.create(
-                    messages=[
-                        {"role": "user", "content": f"You are a helpful assistant. {user_input} Give a short, bullet-pointed response."}
-                    ],
-                    model="llama-3.3-70b-versatile",
-                )
+        st.session_state.pending_input = user_input
+        st.session_state.chat_input = ""  # Clear input after sending
 
-                current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+# Keep a finished turn with the session's other turns
+def save_turn(turn):
+    if st.session_state.session_id not in st.session_state.session_history:
+        st.session_state.session_history[st.session_state.session_id] = {'history': [], 'summary': None, 'title': turn['user']}
+    st.session_state.session_history[st.session_state.session_id]['history'].append(turn)
 
-                if chat_completion and chat_completion.choices:
-                    response_content = chat_completion.choices[0].message.content
-                    response_list = [line.strip() for line in response_content.split("\n") if line.strip()]
-
-                    new_chat = {"date": current_date, "user": user_input, "bot": response_list}
-                    st.session_state.chat_history.append(new_chat)
-
-                    # Store the chat history in the session's history
-                    if st.session_state.session_id not in st.session_state.session_history:
-                        st.session_state.session_history[st.session_state.session_id] = {'history': [], 'summary': None, 'title': user_input}
-                    st.session_state.session_history[st.session_state.session_id]['history'].append(new_chat)
-
-                    st.session_state.selected_session = st.session_state.session_id  # Set active session
-                    st.session_state.chat_input = ""  # Clear input after sending
-
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
+# Send earlier turns of this chat along, within the context token budget
+def add_context(messages):
+    if not context_builder:
+        return messages
+    return context_builder.build(st.session_state.session_id, st.session_state.chat_history, messages)
 
 # Chat Input
 user_input = st.text_input(
@@ -180,3 +181,8 @@ user_input = st.text_input(
     placeholder="Ask me anything...",
     on_change=process_input  # Calls the function when Enter is pressed
 )
+
+# Answer the queued question below the transcript
+if st.session_state.get("pending_input"):
+    with chat_container:
+        answer(st.session_state.pop("pending_input"), save_turn, add_context)
@@ -0,0 +1,507 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from heapq import merge
+
+from logs import get_logger, log_event
+
+# Chat history backends. The SQLite store is append-only, indexed by session and
+# time, and shared by every worker that opens the same file. Writes are queued and
+# committed in batches by a background thread, so the request path never waits on disk.
+# A read only waits for the queued entries of its own session, and has the writer
+# commit them right away rather than at the end of its batch window.
+# Questions and answers are also in a full-text index (SQLite FTS5), updated by
+# triggers in the same transaction as each batch, for search.
+
+# Session used when a caller doesn't pass one
+DEFAULT_SESSION = "default"
+
+# A search ranks at most this many of the most recent matching entries, so its
+# pages stop there
+SEARCH_CANDIDATES = 1000
+
+INSERT_ENTRY = "INSERT INTO chat_history (session_id, created_at, date, user, bot) VALUES (?, ?, ?, ?, ?)"
+
+# Queued by a waiting reader to end the writer's current batch early
+COMMIT_NOW = object()
+
+log = get_logger("history")
+
+
+# Entity tag for a history query. History is append-only, so the newest entry ID
+# together with the query parameters identifies the response body.
+def history_etag(last_id, *params):
+    return hashlib.sha1(repr((last_id,) + params).encode()).hexdigest()
+
+# Apply the since/before cursors and the limit to entries sorted by ID. Without
+# `since`, the limit keeps the most recent entries; with it, the oldest new ones.
+def page_entries(entries, since=None, before=None, limit=None):
+    if since is not None:
+        entries = [entry for entry in entries if entry['id'] > since]
+    if before is not None:
+        entries = [entry for entry in entries if entry['id'] < before]
+    if limit is not None:
+        entries = entries[:limit] if since is not None else entries[-limit:]
+    return entries
+
+# Search terms of a query: words, lowercased. A trailing * makes the last one a prefix.
+def search_terms(text):
+    terms = re.findall(r"\w+", text.lower())
+    prefix = bool(terms) and text.rstrip().endswith("*")
+    return terms, prefix
+
+# FTS5 query matching every term in the question or the answer
+def fts_query(terms, prefix=False):
+    query = " ".join(f'"{term}"' for term in terms) + ("*" if prefix else "")
+    return "{user bot} : (" + query + ")"
+
+# Mark where `terms` occur in `text` and cut it down to the part around the first match
+def highlight(text, terms, prefix=False, width=120):
+    words = [re.escape(term) for term in terms]
+    if prefix:
+        words[-1] += r"\w*"
+    pattern = re.compile(r"\b(" + "|".join(words) + r")\b", re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, match.start() - width // 3) if match else 0
+    snippet = ("…" if start else "") + text[start:start + width] + ("…" if start + width < len(text) else "")
+    return pattern.sub(r"**\1**", snippet)
+
+# Results of a search. `truncated` is set when more entries matched than were
+# ranked (SEARCH_CANDIDATES): the best of the older ones are missing.
+class SearchResults(list):
+    truncated = False
+
+# Rank (session ID, entry) pairs by how often the terms occur, in the question
+# counting double, newest first among equals, and return one page of them. Entries
+# missing a term are left out, unless `matched` says the index already checked them.
+def rank_matches(candidates, terms, prefix=False, limit=20, offset=0, matched=False):
+    patterns = [re.compile(r"\b" + re.escape(term) + (r"\w*" if prefix and i == len(terms) - 1 else r"\b"))
+                for i, term in enumerate(terms)]
+    scored = []
+    for session_id, entry in candidates:
+        user, bot = entry['user'].lower(), entry['bot'].lower()
+        counts = [2 * len(pattern.findall(user)) + len(pattern.findall(bot)) for pattern in patterns]
+        if matched or all(counts):
+            scored.append((sum(counts), entry['id'], session_id, entry))
+    scored.sort(key=lambda item: (-item[0], -item[1]))
+    return SearchResults(dict(entry, session_id=session_id, score=score, snippet=highlight(entry['user'] + " — " + entry['bot'], terms, prefix))
+                         for score, _, session_id, entry in scored[offset:offset + limit])
+
+# Read the since/before/limit query parameters of /api/history
+def parse_page_args(args):
+    page = {}
+    for name in ("since", "before", "limit"):
+        value = args.get(name)
+        if value is None:
+            continue
+        if not value.isdigit() or (name == "limit" and int(value) == 0):
+            raise ValueError(f"Invalid {name}: {value}")
+        page[name] = int(value)
+    return page
+
+# Read the q/limit/offset query parameters of /api/history/search
+def parse_search_args(args, max_limit=100):
+    query = args.get("q", "")
+    if not search_terms(query)[0]:
+        raise ValueError("Missing search text: q")
+    search = {"q": query, "limit": 20, "offset": 0}
+    for name in ("limit", "offset"):
+        value = args.get(name)
+        if value is None:
+            continue
+        if not value.isdigit() or (name == "limit" and not 0 < int(value) <= max_limit):
+            raise ValueError(f"Invalid {name}: {value}")
+        if name == "offset" and int(value) >= SEARCH_CANDIDATES:
+            raise ValueError(f"Invalid offset: {value} (only the best {SEARCH_CANDIDATES} matches can be paged through)")
+        search[name] = int(value)
+    return search
+
+
+# In-process history, partitioned per session: a dict of per-session deques kept in
+# least-recently-used order, so lookups are O(1) and idle sessions expire from the
+# front. Memory is bounded by active sessions times the per-session cap.
+class MemoryHistoryStore:
+    def __init__(self, max_entries_per_session=None, session_ttl=None):
+        self.max_entries_per_session = max_entries_per_session
+        self.session_ttl = session_ttl
+        self._sessions = OrderedDict()  # session_id -> (last_used, deque of entries)
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    # Drop sessions that have been idle longer than the TTL
+    def _expire(self, now):
+        if self.session_ttl is None:
+            return
+        while self._sessions:
+            session_id, (last_used, _) = next(iter(self._sessions.items()))
+            if now - last_used < self.session_ttl:
+                break
+            del self._sessions[session_id]
+
+    # Entries of one session, marking it as used
+    def _touch(self, session_id, create=False):
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = (now, deque(maxlen=self.max_entries_per_session))
+        self._sessions[session_id] = (now, session[1])
+        self._sessions.move_to_end(session_id)
+        return session[1]
+
+    def append(self, entry, session_id=DEFAULT_SESSION):
+        with self._lock:
+            self._touch(session_id, create=True).append(dict(entry, id=self._next_id))
+            self._next_id += 1
+
+    def last_id(self, session_id=None):
+        with self._lock:
+            if session_id is None:
+                return max((entries[-1]['id'] for _, entries in self._sessions.values() if entries), default=0)
+            entries = self._touch(session_id)
+            return entries[-1]['id'] if entries else 0
+
+    def list(self, session_id=None, since=None, before=None, limit=None):
+        with self._lock:
+            if session_id is None:
+                entries = list(merge(*(entries for _, entries in self._sessions.values()), key=lambda e: e['id']))
+            else:
+                entries = list(self._touch(session_id) or [])
+        return page_entries(entries, since, before, limit)
+
+    # Number of sessions and of entries across them
+    def size(self):
+        with self._lock:
+            return len(self._sessions), sum(len(entries) for _, entries in self._sessions.values())
+
+    # Entries matching every term of `query`, best first (see rank_matches), optionally
+    # within one session or a list of them. A scan, which is fine for the bounded
+    # in-memory store.
+    def search(self, query, session_id=None, limit=20, offset=0, sessions=None):
+        terms, prefix = search_terms(query)
+        if not terms:
+            return SearchResults()
+        with self._lock:
+            if session_id is None:
+                found = [(key, list(entries)) for key, (_, entries) in self._sessions.items()
+                         if sessions is None or key in sessions]
+            elif sessions is None or session_id in sessions:
+                found = [(session_id, list(self._touch(session_id) or []))]
+            else:
+                found = []
+        candidates = ((key, entry) for key, entries in found for entry in entries)
+        return rank_matches(candidates, terms, prefix, limit, offset)
+
+    # Delete one session's entries, or every session's
+    def delete(self, session_id=None):
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(session_id, None)
+
+    def flush(self, session_id=None):
+        pass
+
+    def close(self):
+        pass
+
+
+# History persisted in SQLite with write-ahead logging
+class SQLiteHistoryStore:
+    def __init__(self, path="chat_history.db", batch_size=100, flush_interval=0.05,
+                 max_entries_per_session=None, session_ttl=None, expire_interval=60):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_entries_per_session = max_entries_per_session
+        self.session_ttl = session_ttl
+        self.expire_interval = expire_interval
+        self._last_expire = 0.0
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._closed = False
+        # Entries are numbered as they are queued, and the writer handles them in that
+        # order, so "entry N is done" means every earlier one is too
+        self._queued = 0  # entries queued so far
+        self._done = 0  # entries the writer has committed or dropped
+        self._session_last = {}  # session_id -> number of its newest entry still pending
+        self._progress = threading.Condition()
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        indexed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_history_fts'").fetchone()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                date TEXT NOT NULL,
+                user TEXT NOT NULL,
+                bot TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chat_history_session_time
+                ON chat_history (session_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_chat_history_time
+                ON chat_history (created_at);
+            CREATE INDEX IF NOT EXISTS idx_chat_history_session_id
+                ON chat_history (session_id, id);
+
+            -- Full-text index over the rows of chat_history. The session ID is indexed
+            -- too, so a search within one session only looks at that session's postings.
+            CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+                user, bot, session_id, content='chat_history', content_rowid='id'
+            );
+            CREATE TRIGGER IF NOT EXISTS chat_history_fts_insert AFTER INSERT ON chat_history BEGIN
+                INSERT INTO chat_history_fts (rowid, user, bot, session_id)
+                    VALUES (new.id, new.user, new.bot, new.session_id);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chat_history_fts_delete AFTER DELETE ON chat_history BEGIN
+                INSERT INTO chat_history_fts (chat_history_fts, rowid, user, bot, session_id)
+                    VALUES ('delete', old.id, old.user, old.bot, old.session_id);
+            END;
+        """)
+        if not indexed:
+            # New index: add the entries written before it existed
+            with conn:
+                conn.execute("INSERT INTO chat_history_fts (chat_history_fts) VALUES ('rebuild')")
+
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # One connection per thread; sqlite3 connections can't be shared across threads
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Queue an entry for the background writer
+    def append(self, entry, session_id=DEFAULT_SESSION):
+        row = (session_id, time.time(), entry['date'], entry['user'], entry['bot'])
+        if self._closed:
+            # Writer already stopped (interpreter shutdown): write directly
+            with self._connect() as conn:
+                conn.execute(INSERT_ENTRY, row)
+            return
+        with self._progress:
+            self._queued += 1
+            self._session_last[session_id] = self._queued
+            self._queue.put(row)
+
+    # Drain the queue in batches, one transaction per batch
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not COMMIT_NOW and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            rows = [item for item in batch if isinstance(item, tuple)]
+            try:
+                if rows:
+                    self._write(conn, rows)
+            finally:
+                # Readers wait on these, so they count as done whatever happened
+                self._mark_done(rows)
+            if None in batch:
+                return
+
+    def _mark_done(self, rows):
+        with self._progress:
+            self._done += len(rows)
+            for row in rows:
+                if self._session_last.get(row[0], 0) <= self._done:
+                    self._session_last.pop(row[0], None)
+            self._progress.notify_all()
+
+    # Commit `rows` in one transaction. If that fails, write them one by one so only
+    # the rows that can't be stored are dropped (and logged); the writer keeps running.
+    def _write(self, conn, rows):
+        try:
+            with conn:
+                conn.executemany(INSERT_ENTRY, rows)
+                self._prune(conn, {row[0] for row in rows})
+            return
+        except Exception as e:
+            log_event(log, "history.batch_failed", logging.WARNING, rows=len(rows), error=str(e))
+
+        written = set()
+        for row in rows:
+            try:
+                with conn:
+                    conn.execute(INSERT_ENTRY, row)
+                written.add(row[0])
+            except Exception as e:
+                log_event(log, "history.write_failed", logging.ERROR, exc_info=e, session_id=row[0])
+        try:
+            with conn:
+                self._prune(conn, written)
+        except Exception as e:
+            log_event(log, "history.prune_failed", logging.ERROR, exc_info=e)
+
+    # Enforce the per-session cap on the sessions just written to, and periodically
+    # delete sessions that have been idle longer than the TTL
+    def _prune(self, conn, session_ids):
+        if self.max_entries_per_session is not None:
+            for session_id in session_ids:
+                conn.execute(
+                    """DELETE FROM chat_history WHERE session_id = ? AND id <= (
+                        SELECT id FROM chat_history WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )""",
+                    (session_id, session_id, self.max_entries_per_session),
+                )
+
+        now = time.time()
+        if self.session_ttl is not None and now - self._last_expire >= self.expire_interval:
+            self._last_expire = now
+            conn.execute(
+                """DELETE FROM chat_history WHERE session_id IN (
+                    SELECT session_id FROM chat_history GROUP BY session_id HAVING MAX(created_at) < ?
+                )""",
+                (now - self.session_ttl,),
+            )
+
+    # Wait until the entries queued so far are committed: every session's, or only
+    # `session_id`'s. Entries queued while waiting aren't waited for.
+    def flush(self, session_id=None):
+        with self._progress:
+            target = self._queued if session_id is None else self._session_last.get(session_id, 0)
+            if self._done >= target:
+                return
+            self._queue.put(COMMIT_NOW)
+            self._progress.wait_for(lambda: self._done >= target)
+
+    # ID of the newest entry (0 when empty), for cheap change detection
+    def last_id(self, session_id=None):
+        self.flush(session_id)
+        conn = self._connect()
+        if session_id is None:
+            row = conn.execute("SELECT MAX(id) FROM chat_history").fetchone()
+        else:
+            row = conn.execute("SELECT MAX(id) FROM chat_history WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] or 0
+
+    # Entries in ID order. `since` and `before` are entry ID cursors; without
+    # `since`, the limit keeps the most recent entries.
+    def list(self, session_id=None, since=None, before=None, limit=None):
+        # Read-your-writes within this worker: commit what is queued for the session first
+        self.flush(session_id)
+        conn = self._connect()
+
+        where, params = [], []
+        if session_id is not None:
+            where.append("session_id = ?")
+            params.append(session_id)
+        if since is not None:
+            where.append("id > ?")
+            params.append(since)
+        if before is not None:
+            where.append("id < ?")
+            params.append(before)
+        sql = "SELECT id, date, user, bot FROM chat_history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+
+        if limit is None:
+            rows = conn.execute(sql + " ORDER BY id", params).fetchall()
+        elif since is not None:
+            rows = conn.execute(sql + " ORDER BY id LIMIT ?", params + [limit]).fetchall()
+        else:
+            rows = conn.execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+            rows.reverse()
+        return [{'id': id, 'date': date, 'user': user, 'bot': bot} for id, date, user, bot in rows]
+
+    # Entries matching every term of `query` in the question or the answer, best
+    # first, optionally within one session or a list of them. The index yields the most recent
+    # SEARCH_CANDIDATES matches without scoring them, which stays fast however common
+    # the terms are (SQLite's bm25() reads every match); those are then ranked here,
+    # and the results say when older matches were left out.
+    def search(self, query, session_id=None, limit=20, offset=0, sessions=None):
+        terms, prefix = search_terms(query)
+        if not terms or sessions is not None and not sessions:
+            return SearchResults()
+        self.flush(session_id)
+        match = fts_query(terms, prefix)
+        if session_id is not None:
+            match = 'session_id : "' + session_id.replace('"', '""') + '" AND ' + match
+        params = [match]
+        within = ""
+        if sessions is not None:
+            within = "AND rowid IN (SELECT id FROM chat_history WHERE session_id IN (SELECT value FROM json_each(?)))"
+            params.append(json.dumps(list(sessions)))
+        rows = self._connect().execute(
+            f"""SELECT h.id, h.session_id, h.date, h.user, h.bot FROM (
+                   SELECT rowid FROM chat_history_fts WHERE chat_history_fts MATCH ? {within}
+                   ORDER BY rowid DESC LIMIT ?
+               ) AS f JOIN chat_history AS h ON h.id = f.rowid""",
+            params + [SEARCH_CANDIDATES + 1],
+        ).fetchall()
+        truncated = len(rows) > SEARCH_CANDIDATES
+        if truncated:
+            rows.remove(min(rows))  # The extra row, the oldest match
+        candidates = ((session_id, {'id': id, 'date': date, 'user': user, 'bot': bot})
+                      for id, session_id, date, user, bot in rows)
+        results = rank_matches(candidates, terms, prefix, limit, offset, matched=True)
+        results.truncated = truncated
+        return results
+
+    # Number of sessions and of entries across them (committed entries only)
+    def size(self):
+        sessions, entries = self._connect().execute(
+            "SELECT COUNT(DISTINCT session_id), COUNT(*) FROM chat_history"
+        ).fetchone()
+        return sessions, entries
+
+    # Delete one session's entries, or every session's (queued entries included)
+    def delete(self, session_id=None):
+        self.flush(session_id)
+        with self._connect() as conn:
+            if session_id is None:
+                conn.execute("DELETE FROM chat_history")
+            else:
+                conn.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,))
+
+    # Commit queued entries and stop the writer
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+
+# Build the history store configured through environment variables. Per-session caps
+# and idle expiry are on by default for the in-memory store only.
+def make_history_store():
+    backend = os.getenv("HISTORY_BACKEND", "sqlite")
+    if backend == "sqlite":
+        max_entries, ttl = os.getenv("HISTORY_SESSION_MAX_ENTRIES"), os.getenv("HISTORY_SESSION_TTL")
+        return SQLiteHistoryStore(
+            os.getenv("HISTORY_DB", "chat_history.db"),
+            max_entries_per_session=int(max_entries) if max_entries else None,
+            session_ttl=float(ttl) if ttl else None,
+        )
+    if backend == "memory":
+        return MemoryHistoryStore(
+            max_entries_per_session=int(os.getenv("HISTORY_SESSION_MAX_ENTRIES", 1000)),
+            session_ttl=float(os.getenv("HISTORY_SESSION_TTL", 86400)),
+        )
+    raise ValueError(f"Unknown HISTORY_BACKEND: {backend}")
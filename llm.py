@@ -0,0 +1,41 @@
+import json
+
+# Model used for every chat completion
+MODEL = "llama-3.3-70b-versatile"
+
+# Example follow-up suggestions returned with every answer
+SUGGESTIONS = ["Translate", "Ask a question", "Get help"]
+
+# Build the upstream messages for a user question
+def build_messages(user_input):
+    return [
+        {
+            "role": "user",
+            "content": "you are a helpful assistant. " + user_input + " give all the response in short form and in bullet points",
+        }
+    ]
+
+# Split a model response into non-empty bullet points
+def split_response(response_content):
+    return [line.strip() for line in response_content.split("\n") if line.strip()]
+
+# Format a single Server-Sent Event
+def sse_event(payload, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+# Bot answers are stored as text (Flask apps) or as a list of bullets (Streamlit apps)
+def bot_text(bot):
+    return bot if isinstance(bot, str) else "\n".join(bot)
+
+# Render chat turns as plain text
+def format_turns(turns):
+    return "\n".join(f"User: {turn['user']}\nBot: {bot_text(turn['bot'])}" for turn in turns)
+
+# Build the upstream messages that fold new turns into a running summary
+def summary_messages(summary, turns):
+    content = "Summarize this chat session with key points, in a few short bullet points."
+    if summary:
+        content += f"\nSummary of the earlier conversation:\n{summary}\nNew messages:"
+    content += f"\n{format_turns(turns)}"
+    return [{"role": "user", "content": content}]
@@ -0,0 +1,184 @@
+import atexit
+import contextvars
+import copy
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+
+from metrics import LOG_RECORDS_DROPPED
+
+# Structured logging for the chat API. Log calls only put a record on a bounded
+# queue; a background thread formats each record as one JSON line and writes it, so
+# a request never waits on stdout. When the queue is full, records are dropped and
+# counted rather than blocking. High-volume events can be sampled per event name,
+# every record carries the request ID, and user content is redacted unless
+# configured otherwise.
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+# Request ID sent by the client (if it is a sane token) or a new one, set for this request's logs
+def bind_request_id(value=None):
+    if not value or len(value) > 128 or not value.isprintable():
+        value = new_request_id()
+    _request_id.set(value)
+    return value
+
+
+# Wraps user or model text in a log field; how it appears depends on LOG_CONTENT:
+#   redact  only its length (default)
+#   hash    its length and a short SHA-256, to correlate repeats without the text
+#   full    the text itself
+class Content:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def render(self, mode):
+        text = self.text if isinstance(self.text, str) else json.dumps(self.text)
+        if mode == "full":
+            return text
+        if mode == "hash":
+            return {"chars": len(text), "sha256": hashlib.sha256(text.encode()).hexdigest()[:16]}
+        return {"chars": len(text)}
+
+
+# Keeps `rate` of the records of each sampled event name. Warnings and errors are always kept.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._random = random.Random()
+
+    def filter(self, record):
+        rate = self.rates.get(record.msg)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return self._random.random() < rate
+
+
+# Stamps the request ID while the record is still on the request's thread or task
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+# Enqueues without ever blocking; a full queue drops the record
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Only resolve the message and traceback here; JSON formatting happens on the listener thread
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, content_mode="redact"):
+        super().__init__()
+        self.content_mode = content_mode
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for name, value in getattr(record, "fields", {}).items():
+            entry[name] = value.render(self.content_mode) if isinstance(value, Content) else value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+# Plain text for reading logs in a terminal during development
+class TextFormatter(JSONFormatter):
+    def format(self, record):
+        entry = json.loads(super().format(record))
+        head = f"{entry.pop('ts')} {entry.pop('level').upper():<7} {entry.pop('event')}"
+        exception = entry.pop("exception", None)
+        entry.pop("logger")
+        text = head + "".join(f" {name}={json.dumps(value)}" for name, value in entry.items())
+        return text + ("\n" + exception if exception else "")
+
+
+# Read LOG_SAMPLE, e.g. "http.request=0.1,history.poll=0.01"
+def parse_sample_rates(value):
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+# Send the "chat" loggers' records through the queue, configured through environment
+# variables. Safe to call more than once.
+def setup_logging():
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is not None:
+            return _handler
+        content_mode = os.getenv("LOG_CONTENT", "redact")
+        formatter = TextFormatter(content_mode) if os.getenv("LOG_FORMAT", "json") == "text" else JSONFormatter(content_mode)
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(formatter)
+
+        _handler = DroppingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000))))
+        _handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv("LOG_SAMPLE", ""))))
+        _handler.addFilter(RequestIdFilter())
+        _listener = logging.handlers.QueueListener(_handler.queue, output)
+        _listener.start()
+        atexit.register(_stop_listener)
+
+        logger = logging.getLogger("chat")
+        logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        logger.addHandler(_handler)
+        logger.propagate = False
+        return _handler
+
+# Write out what is still queued on shutdown
+def _stop_listener():
+    try:
+        _listener.stop()
+    except queue.Full:
+        # No room for the stop sentinel; the daemon thread ends with the process
+        pass
+
+def get_logger(name):
+    return logging.getLogger(f"chat.{name}")
+
+# Log `event` with structured fields; wrap user or model text in Content()
+def log_event(logger, event, level=logging.INFO, exc_info=None, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
@@ -0,0 +1,294 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from context import estimate_tokens, messages_tokens
+
+# Prometheus metrics for the chat API, without extra dependencies. An update is a
+# dict operation under a lock in process memory. With several gunicorn workers, set
+# METRICS_DIR to a directory shared by the workers (emptied at deploy time): each
+# worker writes a snapshot of its metrics there every METRICS_FLUSH_INTERVAL seconds
+# and before each scrape, and /metrics adds up the snapshots of all workers, so the
+# totals don't depend on which worker answers the scrape.
+
+# Upper bounds in seconds: request-sized latencies, and sub-millisecond work
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self):
+        with self._lock:
+            # Copy histogram counts, which keep changing after the lock is released
+            return [[list(key), [list(value[0]), value[1]] if isinstance(value, list) else value]
+                    for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+# `multiprocess` says how the values of several workers combine: "sum" adds up the
+# live workers (e.g. requests in flight), "local" reports the scraping worker's own
+# value (for gauges computed at scrape time from shared state)
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), multiprocess="sum"):
+        super().__init__(name, help, labels)
+        self.multiprocess = multiprocess
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            value_counts = self._values.get(key)
+            if value_counts is None:
+                # Per-bucket counts (the last one is +Inf) and the sum of observations
+                value_counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            value_counts[0][index] += 1
+            value_counts[1] += value
+
+    # Observe how long the block takes
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.directory = None
+        self._collectors = []
+        self._flusher = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # Run `collect()` before each scrape, to set gauges computed from shared state
+    def collector(self, collect):
+        self._collectors.append(collect)
+
+    # Share metrics with the other workers through snapshot files in `directory`
+    def configure(self, directory, flush_interval=5):
+        self.directory = directory
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,), name="metrics-flush",
+                                             daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+    def _snapshot(self):
+        return {metric.name: metric.samples() for metric in self.metrics}
+
+    # Write this worker's snapshot atomically, so readers never see a partial file
+    def flush(self):
+        if not self.directory:
+            return
+        pid = os.getpid()
+        path = os.path.join(self.directory, f"metrics-{pid}.json")
+        with self._lock:
+            with open(f"{path}.tmp", "w") as f:
+                json.dump({"pid": pid, "metrics": self._snapshot()}, f)
+            os.replace(f"{path}.tmp", path)
+
+    # Snapshots of every worker, this one first. Finished workers still count
+    # towards counters and histograms, but not towards gauges.
+    def _snapshots(self):
+        own = {"pid": os.getpid(), "metrics": self._snapshot()}
+        if not self.directory:
+            return [own]
+        self.flush()
+        snapshots = [own]
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot["pid"] != own["pid"]:
+                snapshot["alive"] = _pid_alive(snapshot["pid"])
+                snapshots.append(snapshot)
+        return snapshots
+
+    def _merge(self, metric, snapshots):
+        merged = {}
+        for i, snapshot in enumerate(snapshots):
+            if metric.kind == "gauge" and i > 0 and (metric.multiprocess == "local" or not snapshot["alive"]):
+                continue
+            for key, value in snapshot["metrics"].get(metric.name, []):
+                key = tuple(key)
+                if metric.kind == "histogram":
+                    counts, total = merged.get(key, ([0] * len(value[0]), 0.0))
+                    merged[key] = ([a + b for a, b in zip(counts, value[0])], total + value[1])
+                else:
+                    merged[key] = merged.get(key, 0) + value
+        return merged
+
+    # All metrics in the Prometheus text exposition format
+    def render(self):
+        for collect in self._collectors:
+            collect()
+        snapshots = self._snapshots()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, value in sorted(self._merge(metric, snapshots).items()):
+                if metric.kind != "histogram":
+                    lines.append(f"{metric.name}{_labels(metric.labels, key)} {_number(value)}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(float(bound))
+                    lines.append(f"{metric.name}_bucket{_labels(metric.labels + ('le',), key + (le,))} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(metric.labels, key)} {_number(total)}")
+                lines.append(f"{metric.name}_count{_labels(metric.labels, key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
+registry.configure(os.getenv("METRICS_DIR"), float(os.getenv("METRICS_FLUSH_INTERVAL", 5)))
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to handle an API request, until a streamed response ends.",
+    ("endpoint", "method", "status"),
+))
+UPSTREAM_LATENCY = registry.register(Histogram(
+    "llm_upstream_duration_seconds",
+    "Time of an upstream completion call including retries; for streams, until the stream opens.",
+    ("model", "outcome"),
+))
+POSTPROCESS_LATENCY = registry.register(Histogram(
+    "chat_postprocess_duration_seconds", "Time to split an answer into bullet points and store it in the history.",
+    buckets=FAST_BUCKETS,
+))
+SERIALIZE_LATENCY = registry.register(Histogram(
+    "chat_serialize_duration_seconds", "Time to serialize a chat response to JSON.", buckets=FAST_BUCKETS,
+))
+CACHE_LOOKUPS = registry.register(Counter(
+    "chat_cache_lookups_total", "Answer cache lookups by cache (exact, semantic) and result (hit, miss).",
+    ("cache", "result"),
+))
+ERRORS = registry.register(Counter("chat_errors_total", "Failed chat requests by error type.", ("type",)))
+TOKENS = registry.register(Counter(
+    "llm_tokens_total", "Tokens sent to (in) and received from (out) the model, estimated for streams.",
+    ("model", "direction"),
+))
+IN_FLIGHT = registry.register(Gauge("http_requests_in_flight", "API requests being handled."))
+LOG_RECORDS_DROPPED = registry.register(Counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full.",
+))
+HISTORY_SESSIONS = registry.register(Gauge(
+    "chat_history_sessions", "Sessions in the chat history.", multiprocess="local",
+))
+HISTORY_ENTRIES = registry.register(Gauge(
+    "chat_history_entries", "Entries in the chat history.", multiprocess="local",
+))
+
+
+def count_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+# Tokens reported in a completion's usage
+def count_usage(model, completion):
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        TOKENS.inc(usage.prompt_tokens, model=model, direction="in")
+        TOKENS.inc(usage.completion_tokens, model=model, direction="out")
+
+# Streams carry no usage, so their tokens are estimated
+def count_stream_tokens(model, messages, content):
+    TOKENS.inc(messages_tokens(messages), model=model, direction="in")
+    TOKENS.inc(estimate_tokens(content), model=model, direction="out")
+
+# Report the size of `history_store` at each scrape
+def watch_history(history_store):
+    def collect():
+        sessions, entries = history_store.size()
+        HISTORY_SESSIONS.set(sessions)
+        HISTORY_ENTRIES.set(entries)
+    registry.collector(collect)
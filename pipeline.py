@@ -0,0 +1,435 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime
+
+from groq import APITimeoutError, RateLimitError
+
+from backends import get_async_backend, get_backend, needs_api_key
+from cache import cache_key, make_cache
+from context import estimate_tokens, make_context_builder, messages_tokens
+from dispatcher import AsyncDispatcher, Overloaded, make_dispatcher
+from history_store import make_history_store
+from llm import SUGGESTIONS, build_messages, split_response, sse_event, summary_messages
+from logs import Content, get_logger, log_event
+from metrics import ERRORS, POSTPROCESS_LATENCY, SERIALIZE_LATENCY, count_cache_lookup, count_stream_tokens, watch_history
+from policy import TIMEOUT_MESSAGE, CircuitOpen, DeadlineExceeded
+from ratelimit import retry_after
+from router import make_router
+from semantic_cache import make_semantic_cache
+from singleflight import AsyncSingleFlight, SingleFlight, make_lock_store
+from tracing import tracer
+
+# The chat pipeline behind /api/chat and /api/chat/stream, shared by app.py (Flask)
+# and asgi.py (Quart): the question is prefixed with the session's context, answered
+# from the caches or by one upstream call per identical question (through the router
+# and the dispatcher), stored in the history and logged; failures become error
+# responses. The apps only adapt requests and responses to their framework.
+# ChatPipeline blocks on upstream calls, AsyncChatPipeline awaits them.
+
+log = get_logger("app")
+
+EMPTY_RESPONSE = "No valid response from the AI."
+
+
+# One question on its way through the pipeline
+class Turn:
+    def __init__(self, session_id, user_input, root=None):
+        self.session_id = session_id
+        self.user_input = user_input
+        # Parent of the turn's spans; streams outlive the handler's span, so they name it
+        self.root = root
+        self.messages = None
+        self.model = None
+        self.key = None
+        self.standalone = False
+        self.source = "upstream"
+
+
+# Tokens of a streamed answer as they arrive, with the first one noted on the upstream span
+class StreamedAnswer:
+    def __init__(self, span):
+        self.span = span
+        self.parts = []
+        self.start = time.perf_counter()
+
+    # Text of a chunk, or None
+    def add(self, chunk):
+        if not chunk.choices:
+            return None
+        token = chunk.choices[0].delta.content
+        if token:
+            if not self.parts:
+                self.span.add_event("first_token")
+                self.span.set_attribute("llm.time_to_first_token_ms", round((time.perf_counter() - self.start) * 1000, 1))
+            self.parts.append(token)
+        return token
+
+    def text(self):
+        return "".join(self.parts)
+
+    # Streams carry no usage, so token counts are estimates
+    def end(self, messages):
+        self.span.set_attributes({"gen_ai.usage.input_tokens": messages_tokens(messages),
+                                  "gen_ai.usage.output_tokens": estimate_tokens(self.text())})
+
+
+class ChatPipeline:
+    def __init__(self, client, dispatcher, flight):
+        self.client = client
+        # Pick a model per request (small model for easy prompts and summaries), with fallbacks and
+        # per-model deadlines, retries, circuit breaking and optional hedging (see router.py, policy.py)
+        self.router = make_router()
+        # Store chat history per session (SQLite by default, so it survives restarts and is shared by workers)
+        self.history_store = make_history_store()
+        watch_history(self.history_store)
+        # Cache responses for repeated questions, and optionally for paraphrased ones
+        self.response_cache = make_cache()
+        self.semantic_cache = make_semantic_cache()
+        # Send earlier turns of the session along with each question, within a token budget
+        self.context_builder = make_context_builder(self.summarize_turns)
+        # Bound concurrent upstream calls; excess requests wait in a fair per-session queue
+        # and are turned away with 503 once it is full (see dispatcher.py)
+        self.dispatcher = dispatcher
+        # Coalesce identical concurrent questions into one upstream call
+        self.flight = flight
+
+    # Fold turns that no longer fit the context window into the session's running summary
+    def summarize_turns(self, summary, turns):
+        messages = summary_messages(summary, turns)
+        summary_completion = self.router.complete(
+            self.client,
+            self.router.choose("summarize", messages[-1]['content']),
+            messages=messages,
+        )
+        return summary_completion.choices[0].message.content
+
+    # Build the upstream messages for a question, prefixed with the session's context
+    def build_chat_messages(self, session_id, user_input):
+        messages = build_messages(user_input)
+        if self.context_builder is None:
+            return messages
+        turns = self.history_store.list(session_id, limit=self.context_builder.max_turns)
+        return self.context_builder.build(session_id, turns, messages)
+
+    # Build the prompt and pick the model; returns a cached answer, or None
+    def prepare(self, turn):
+        with tracer.span("chat.build_prompt", parent=turn.root) as span:
+            turn.messages = self.build_chat_messages(turn.session_id, turn.user_input)
+            self._route(turn, span)
+        return self.lookup(turn)
+
+    def _route(self, turn, span):
+        turn.model = self.router.choose("chat", turn.user_input)
+        span.set_attributes({"gen_ai.request.model": turn.model, "chat.messages": len(turn.messages)})
+
+    # Serve repeated questions from the cache
+    def lookup(self, turn):
+        with tracer.span("chat.cache_lookup", parent=turn.root) as span:
+            turn.key = cache_key(turn.model, turn.messages)
+            response_content = self.response_cache.get(turn.key)
+            count_cache_lookup("exact", response_content is not None)
+
+            # Paraphrase matches are only safe for questions asked without earlier context
+            turn.standalone = len(turn.messages) == 1
+            if response_content is None and self.semantic_cache and turn.standalone:
+                response_content = self.semantic_cache.get(turn.model, turn.user_input)
+                count_cache_lookup("semantic", response_content is not None)
+            turn.source = "cache" if response_content is not None else "upstream"
+            span.set_attribute("chat.cache_hit", turn.source == "cache")
+        return response_content
+
+    # Remember an answer in the exact-match cache and, for standalone questions, the semantic cache
+    def remember_answer(self, turn, response_content):
+        self.response_cache.set(turn.key, response_content)
+        if self.semantic_cache and turn.standalone:
+            self.semantic_cache.set(turn.model, turn.user_input, response_content)
+
+    # Ask the Groq client for an answer and cache it. A hedged second request needs a
+    # dispatcher slot of its own, and is skipped if none is free.
+    def fetch_answer(self, turn):
+        with self.dispatcher.slot(turn.session_id, turn.model):
+            tracer.current_span().add_event("dispatched")
+            chat_completion = self.router.complete(
+                self.client,
+                turn.model,
+                messages=turn.messages,
+                hedge_slot=lambda model: self.dispatcher.slot(turn.session_id, model, wait=False),
+            )
+        return self._fetched(turn, chat_completion)
+
+    def _fetched(self, turn, chat_completion):
+        if chat_completion and chat_completion.choices:
+            response_content = chat_completion.choices[0].message.content
+            self.remember_answer(turn, response_content)
+            return response_content
+        return None
+
+    # The leader's streamed answer is complete: count and cache it, and hand it to the followers
+    def _streamed(self, turn, call, answer):
+        response_content = answer.text()
+        count_stream_tokens(turn.model, turn.messages, response_content)
+        if response_content.strip():
+            self.remember_answer(turn, response_content)
+        self.flight.finish(turn.key, call, response_content)
+        return response_content
+
+    # Release the waiting requests even if the client went away
+    def _abandoned(self, turn, call, error):
+        self.flight.finish(turn.key, call, error=error if isinstance(error, Exception) else RuntimeError("Stream was closed."))
+
+    # Count, log and trace a failed chat request
+    def failed(self, session_id, error_type, status, exc_info=None):
+        ERRORS.inc(type=error_type)
+        tracer.current_span().set_attributes({"error.type": error_type, "http.response.status_code": status})
+        log_event(log, "chat.error", logging.ERROR if exc_info else logging.WARNING, exc_info=exc_info,
+                  session_id=session_id, type=error_type, status=status)
+
+    # Response for a failed request as (status, body, seconds for Retry-After or None)
+    def error_response(self, session_id, error):
+        seconds = None
+        if isinstance(error, Overloaded):
+            # Fast 503 telling the client to retry, instead of tying up a worker
+            status, message, seconds = 503, str(error), 1
+        elif isinstance(error, CircuitOpen):
+            status, message, seconds = 503, str(error), math.ceil(error.retry_after)
+        elif isinstance(error, RateLimitError):
+            # Passed on to the client when the upstream quota is exhausted
+            seconds = retry_after(error)
+            status, message = 429, f"The AI is rate limited. Please retry in {seconds} seconds."
+        elif isinstance(error, (DeadlineExceeded, APITimeoutError)):
+            status, message = 504, TIMEOUT_MESSAGE
+        else:
+            status, message = 500, f"An error occurred: {error}"
+        self.failed(session_id, type(error).__name__, status, exc_info=error if status == 500 else None)
+        return status, {"status": "error", "message": message}, seconds
+
+    # Stream event for a failed request
+    def error_event(self, session_id, error):
+        status, body, seconds = self.error_response(session_id, error)
+        if status == 429:
+            body["retry_after"] = seconds
+        return sse_event(body, event="error")
+
+    # Store an answer in the history and build the response body, as error_response() does
+    def finish(self, turn, response_content, stream=False):
+        if not (response_content or "").strip():
+            self.failed(turn.session_id, "EmptyResponse", 500)
+            return 500, {"status": "error", "message": EMPTY_RESPONSE}, None
+
+        with POSTPROCESS_LATENCY.time(), tracer.span("chat.postprocess", parent=turn.root):
+            current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.history_store.append({'date': current_date, 'user': turn.user_input, 'bot': response_content},
+                                      turn.session_id)
+            # Split the response into bullet points, skipping empty lines
+            response_list = split_response(response_content)
+
+        log_event(log, "chat.answer", session_id=turn.session_id, model=turn.model, source=turn.source, stream=stream,
+                  question=Content(turn.user_input), answer=Content(response_content), bullets=len(response_list))
+        return 200, {"status": "success", "response": response_list, "suggestions": SUGGESTIONS}, None
+
+    # Final stream event, carrying the same payload as /api/chat
+    def final_event(self, turn, response_content):
+        status, body, _ = self.finish(turn, response_content, stream=True)
+        if status != 200:
+            return sse_event(body, event="error")
+        with SERIALIZE_LATENCY.time(), tracer.span("chat.serialize", parent=turn.root):
+            return sse_event(body, event="done")
+
+    # Answer a question: (status, body, seconds for Retry-After or None)
+    def answer(self, session_id, user_input):
+        turn = Turn(session_id, user_input)
+        try:
+            response_content = self.prepare(turn)
+            if response_content is None:
+                # Identical concurrent questions share one upstream call
+                with tracer.span("chat.upstream"):
+                    response_content = self.flight.do(
+                        turn.key,
+                        lambda: self.fetch_answer(turn),
+                        lookup=lambda: self.response_cache.get(turn.key),
+                    )
+            return self.finish(turn, response_content)
+        except Exception as e:
+            return self.error_response(session_id, e)
+
+    # Answer a question as Server-Sent Events: each token as it arrives, then a "done"
+    # event with the same payload as answer(), or an "error" event
+    def stream(self, session_id, user_input, root=None):
+        turn = Turn(session_id, user_input, root)
+        try:
+            response_content = self.prepare(turn)
+            if response_content is not None:
+                # Cached answer: send it as a single token
+                yield sse_event({"token": response_content})
+            else:
+                # Identical concurrent questions share one upstream call; the others
+                # get the finished answer as a single token
+                call, leader = self.flight.join(turn.key)
+                if not leader:
+                    response_content = call.wait() or ""
+                    if response_content:
+                        yield sse_event({"token": response_content})
+                else:
+                    try:
+                        with tracer.span("chat.upstream", parent=root, **{"llm.stream": True}) as span:
+                            answer = StreamedAnswer(span)
+                            with self.dispatcher.slot(session_id, turn.model):
+                                span.add_event("dispatched")
+                                stream = self.router.complete(self.client, turn.model, messages=turn.messages, stream=True)
+                                # Forward each token delta as soon as it arrives
+                                for chunk in stream:
+                                    token = answer.add(chunk)
+                                    if token:
+                                        yield sse_event({"token": token})
+                            answer.end(turn.messages)
+                    except BaseException as e:
+                        self._abandoned(turn, call, e)
+                        raise
+                    response_content = self._streamed(turn, call, answer)
+
+            yield self.final_event(turn, response_content)
+        except Exception as e:
+            yield self.error_event(session_id, e)
+
+    # One page of search results, the offset of the next page (None on the last one) and
+    # whether older matches were left out of the ranking
+    def search_history(self, session_id, query, limit, offset):
+        # One extra result tells whether there is a next page
+        results = self.history_store.search(query, session_id, limit=limit + 1, offset=offset)
+        return {"results": results[:limit], "next_offset": offset + limit if len(results) > limit else None,
+                "truncated": results.truncated}
+
+    # Cache hit/miss counters, semantic cache hit rate and lookup latency, and how many
+    # requests were coalesced into another in-flight call
+    def cache_stats(self):
+        stats = self.response_cache.stats()
+        if self.semantic_cache:
+            stats["semantic"] = self.semantic_cache.stats()
+        stats["singleflight"] = self.flight.stats()
+        return stats
+
+
+# asyncio version for the ASGI app. Blocking SQLite reads and cache calls (Redis, the
+# semantic cache's embeddings) run in worker threads.
+class AsyncChatPipeline(ChatPipeline):
+    async def summarize_turns(self, summary, turns):
+        messages = summary_messages(summary, turns)
+        summary_completion = await self.router.acomplete(
+            self.client,
+            self.router.choose("summarize", messages[-1]['content']),
+            messages=messages,
+        )
+        return summary_completion.choices[0].message.content
+
+    async def build_chat_messages(self, session_id, user_input):
+        messages = build_messages(user_input)
+        if self.context_builder is None:
+            return messages
+        turns = await asyncio.to_thread(self.history_store.list, session_id, limit=self.context_builder.max_turns)
+        return await self.context_builder.abuild(session_id, turns, messages)
+
+    async def prepare(self, turn):
+        with tracer.span("chat.build_prompt", parent=turn.root) as span:
+            turn.messages = await self.build_chat_messages(turn.session_id, turn.user_input)
+            self._route(turn, span)
+        return await self.lookup(turn)
+
+    async def lookup(self, turn):
+        return await asyncio.to_thread(super().lookup, turn)
+
+    async def remember_answer(self, turn, response_content):
+        await asyncio.to_thread(super().remember_answer, turn, response_content)
+
+    async def fetch_answer(self, turn):
+        async with self.dispatcher.slot(turn.session_id, turn.model):
+            tracer.current_span().add_event("dispatched")
+            chat_completion = await self.router.acomplete(
+                self.client,
+                turn.model,
+                messages=turn.messages,
+                hedge_slot=lambda model: self.dispatcher.slot(turn.session_id, model, wait=False),
+            )
+        return await self._fetched(turn, chat_completion)
+
+    async def _fetched(self, turn, chat_completion):
+        if chat_completion and chat_completion.choices:
+            response_content = chat_completion.choices[0].message.content
+            await self.remember_answer(turn, response_content)
+            return response_content
+        return None
+
+    async def _streamed(self, turn, call, answer):
+        response_content = answer.text()
+        count_stream_tokens(turn.model, turn.messages, response_content)
+        if response_content.strip():
+            await self.remember_answer(turn, response_content)
+        self.flight.finish(turn.key, call, response_content)
+        return response_content
+
+    async def answer(self, session_id, user_input):
+        turn = Turn(session_id, user_input)
+        try:
+            response_content = await self.prepare(turn)
+            if response_content is None:
+                with tracer.span("chat.upstream"):
+                    response_content = await self.flight.do(
+                        turn.key,
+                        lambda: self.fetch_answer(turn),
+                        lookup=lambda: asyncio.to_thread(self.response_cache.get, turn.key),
+                    )
+            return self.finish(turn, response_content)
+        except Exception as e:
+            return self.error_response(session_id, e)
+
+    async def stream(self, session_id, user_input, root=None):
+        turn = Turn(session_id, user_input, root)
+        try:
+            response_content = await self.prepare(turn)
+            if response_content is not None:
+                yield sse_event({"token": response_content})
+            else:
+                call, leader = self.flight.join(turn.key)
+                if not leader:
+                    response_content = await self.flight.wait(call) or ""
+                    if response_content:
+                        yield sse_event({"token": response_content})
+                else:
+                    try:
+                        with tracer.span("chat.upstream", parent=root, **{"llm.stream": True}) as span:
+                            answer = StreamedAnswer(span)
+                            async with self.dispatcher.slot(session_id, turn.model):
+                                span.add_event("dispatched")
+                                stream = await self.router.acomplete(self.client, turn.model, messages=turn.messages,
+                                                                     stream=True)
+                                async for chunk in stream:
+                                    token = answer.add(chunk)
+                                    if token:
+                                        yield sse_event({"token": token})
+                            answer.end(turn.messages)
+                    except BaseException as e:
+                        self._abandoned(turn, call, e)
+                        raise
+                    response_content = await self._streamed(turn, call, answer)
+
+            yield self.final_event(turn, response_content)
+        except Exception as e:
+            yield self.error_event(session_id, e)
+
+
+def _api_key():
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key and needs_api_key():
+        raise ValueError("GROQ_API_KEY is not set in the environment variables.")
+    return api_key
+
+# Build the chat pipeline configured through environment variables. The LLM backend is
+# the shared Groq client with a tuned connection pool by default (see backends.py, clients.py).
+def make_pipeline():
+    return ChatPipeline(get_backend(_api_key()), make_dispatcher(), SingleFlight(make_lock_store()))
+
+def make_async_pipeline():
+    return AsyncChatPipeline(get_async_backend(_api_key()), make_dispatcher(AsyncDispatcher),
+                             AsyncSingleFlight(make_lock_store()))
@@ -0,0 +1,373 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import AsyncExitStack, ExitStack
+
+import groq
+
+from clients import rate_limiter_for
+from dispatcher import Overloaded
+from ratelimit import retry_after
+
+# Timeouts, retries, circuit breaking and hedging for upstream completions. Each
+# call gets an overall deadline; retryable failures are retried with exponential
+# backoff and full jitter while the deadline allows. Repeated failures open a
+# circuit breaker so later calls fail fast until upstream recovers. Optionally, a
+# non-streaming call that takes longer than the recent p95 latency is raced
+# against a second, identical request and the first answer wins. Hedges are paid
+# from a budget that earns a fraction of a hedge per call, and are skipped while
+# upstream is recovering or the rate limits are tight, or when no dispatcher slot
+# is free for the second request.
+
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_after):
+        super().__init__("The AI service is temporarily unavailable. Please retry shortly.")
+        self.retry_after = retry_after
+
+
+TIMEOUT_MESSAGE = "The AI took too long to respond. Please retry."
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__(TIMEOUT_MESSAGE)
+
+
+# Connection problems, timeouts, 408/409/429 and 5xx are worth retrying, unless the
+# response says otherwise (e.g. our own rate limiter rejecting a call)
+def is_retryable(error):
+    if isinstance(error, groq.APIConnectionError):
+        return True
+    if isinstance(error, groq.APIStatusError):
+        if error.response.headers.get("x-should-retry") == "false":
+            return False
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+# Opens after `failure_threshold` consecutive failures and rejects calls for
+# `reset_timeout` seconds; then lets one probe call through to decide whether to close
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    # Raise CircuitOpen unless a call may go ahead
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed" or (state == "half-open" and not self._probing):
+                self._probing = state == "half-open"
+                return
+            self.rejected += 1
+            wait_for = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise CircuitOpen(max(wait_for, 1))
+
+    def record(self, success):
+        with self._lock:
+            self._probing = False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.opens += 1
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "opens": self.opens, "rejected": self.rejected}
+
+
+class CallPolicy:
+    def __init__(self, deadline=30, max_retries=2, backoff_base=0.5, backoff_max=8,
+                 breaker=None, hedge=False, hedge_quantile=0.95, hedge_min_samples=20, hedge_budget=0.05,
+                 hedge_burst=10, latency_window=200, latency_max_age=300):
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_budget = hedge_budget
+        self.hedge_burst = hedge_burst
+        self._hedge_tokens = 0.0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+        self.latency_max_age = latency_max_age
+        self._latencies = deque(maxlen=latency_window)  # (finished at, seconds)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    # Full jitter: a random sleep up to the exponential backoff, but never shorter
+    # than the server's Retry-After
+    def backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if isinstance(error, groq.RateLimitError):
+            delay = max(delay, retry_after(error, default=0))
+        return delay
+
+    # Latency quantile of recent successful calls, once enough calls have been seen.
+    # Old samples age out, so a model that got no traffic for a while starts fresh.
+    def latency_quantile(self, quantile):
+        cutoff = time.monotonic() - self.latency_max_age
+        with self._lock:
+            while self._latencies and self._latencies[0][0] < cutoff:
+                self._latencies.popleft()
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(elapsed for _, elapsed in self._latencies)
+        return latencies[int(quantile * (len(latencies) - 1))]
+
+    # Delay after which a call is hedged
+    def hedge_delay(self):
+        return self.latency_quantile(self.hedge_quantile) if self.hedge else None
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    # Every call earns a fraction of a hedge, up to a small burst
+    def _started(self):
+        with self._lock:
+            self.calls += 1
+            self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.hedge_budget)
+
+    # Take a hedge from the budget, unless upstream is recovering or calls are being throttled
+    def _take_hedge(self, limiter):
+        if self.breaker.state == "closed" and not (limiter and limiter.constrained()):
+            with self._lock:
+                if self._hedge_tokens >= 1:
+                    self._hedge_tokens -= 1
+                    self.hedged += 1
+                    return True
+        self._count("hedges_skipped")
+        return False
+
+    def _give_back_hedge(self):
+        with self._lock:
+            self._hedge_tokens += 1
+            self.hedged -= 1
+            self.hedges_skipped += 1
+
+    def _succeeded(self, elapsed, record_latency):
+        self.breaker.record(True)
+        if record_latency:
+            with self._lock:
+                self._latencies.append((time.monotonic(), elapsed))
+
+    # Record a failed attempt and return how long to wait before retrying,
+    # or None if the error should be raised
+    def _failed(self, error, attempt, deadline):
+        retryable = is_retryable(error)
+        # Only failures that point at upstream trouble count towards the breaker
+        self.breaker.record(not retryable)
+        if not retryable or attempt >= self.max_retries:
+            self._count("failures")
+            return None
+        delay = self.backoff(attempt, error)
+        if time.monotonic() + delay >= deadline:
+            self._count("failures")
+            return None
+        self._count("retries")
+        return delay
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded()
+        return remaining
+
+    # Run `attempt(timeout)` in a worker thread and, if it is slower than `delay`,
+    # race it against a second attempt holding a `hedge_slot()`, if one is free
+    def _hedged(self, attempt, timeout, delay, hedge_slot=None, limiter=None):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+        primary = self._executor.submit(attempt, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge(limiter):
+            return primary.result()
+
+        slot = ExitStack()
+        if hedge_slot:
+            try:
+                slot.enter_context(hedge_slot())
+            except Overloaded:
+                self._give_back_hedge()
+                return primary.result()
+        backup = self._executor.submit(attempt, max(timeout - delay, 0.001))
+        backup.add_done_callback(lambda _: slot.close())
+        pending = {primary, backup}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [future for future in done if future.exception() is None]
+            if succeeded:
+                if backup in succeeded:
+                    self._count("hedge_wins")
+                # The slower attempt finishes in the background and is discarded
+                return succeeded[0].result()
+            if not pending:
+                return primary.result()
+
+    # Call `attempt(timeout)` under the policy. Streaming calls are retried only
+    # while opening the stream, and are never hedged. `hedge_slot()` returns the
+    # dispatcher slot a hedge must hold, raising Overloaded when none is free;
+    # `limiter` is the client's rate limiter.
+    def call(self, attempt, stream=False, hedge_slot=None, limiter=None):
+        self._started()
+        deadline = time.monotonic() + self.deadline
+        for retry in range(self.max_retries + 1):
+            self.breaker.allow()
+            timeout = self._remaining(deadline)
+            delay = None if stream else self.hedge_delay()
+            start = time.monotonic()
+            try:
+                if delay is not None and delay < timeout:
+                    result = self._hedged(attempt, timeout, delay, hedge_slot, limiter)
+                else:
+                    result = attempt(timeout)
+            except Exception as e:
+                backoff = self._failed(e, retry, deadline)
+                if backoff is None:
+                    raise
+                time.sleep(backoff)
+                continue
+            self._succeeded(time.monotonic() - start, not stream)
+            return result
+
+    # asyncio version of call(); `attempt(timeout)` returns an awaitable
+    async def acall(self, attempt, stream=False, hedge_slot=None, limiter=None):
+        self._started()
+        deadline = time.monotonic() + self.deadline
+        for retry in range(self.max_retries + 1):
+            self.breaker.allow()
+            timeout = self._remaining(deadline)
+            delay = None if stream else self.hedge_delay()
+            start = time.monotonic()
+            try:
+                if delay is not None and delay < timeout:
+                    result = await self._ahedged(attempt, timeout, delay, hedge_slot, limiter)
+                else:
+                    result = await attempt(timeout)
+            except Exception as e:
+                backoff = self._failed(e, retry, deadline)
+                if backoff is None:
+                    raise
+                await asyncio.sleep(backoff)
+                continue
+            self._succeeded(time.monotonic() - start, not stream)
+            return result
+
+    async def _ahedged(self, attempt, timeout, delay, hedge_slot=None, limiter=None):
+        primary = asyncio.ensure_future(attempt(timeout))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self._take_hedge(limiter):
+            return await primary
+
+        slot = AsyncExitStack()
+        if hedge_slot:
+            try:
+                await slot.enter_async_context(hedge_slot())
+            except Overloaded:
+                self._give_back_hedge()
+                return await primary
+        backup = asyncio.ensure_future(attempt(max(timeout - delay, 0.001)))
+        # Release the slot when the backup is done, even if it is cancelled before it starts
+        backup.add_done_callback(lambda _: asyncio.ensure_future(slot.aclose()))
+        pending = {primary, backup}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    if backup in succeeded:
+                        self._count("hedge_wins")
+                    return succeeded[0].result()
+                if not pending:
+                    return primary.result()
+        finally:
+            # Unlike threads, the slower attempt can be cancelled
+            for task in pending:
+                task.cancel()
+
+    # Chat completion through `client` under the policy. The SDK's own retries are
+    # turned off so attempts aren't multiplied. `hedge_slot(model)` returns the
+    # dispatcher slot for a hedge.
+    def complete(self, client, hedge_slot=None, **kwargs):
+        return self.call(
+            lambda timeout: client.with_options(max_retries=0, timeout=timeout).chat.completions.create(**kwargs),
+            stream=kwargs.get("stream", False),
+            hedge_slot=hedge_slot and (lambda: hedge_slot(kwargs["model"])),
+            limiter=rate_limiter_for(client),
+        )
+
+    async def acomplete(self, client, hedge_slot=None, **kwargs):
+        return await self.acall(
+            lambda timeout: client.with_options(max_retries=0, timeout=timeout).chat.completions.create(**kwargs),
+            stream=kwargs.get("stream", False),
+            hedge_slot=hedge_slot and (lambda: hedge_slot(kwargs["model"])),
+            limiter=rate_limiter_for(client),
+        )
+
+    def stats(self):
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "deadline_exceeded": self.deadline_exceeded,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "hedges_skipped": self.hedges_skipped,
+                "hedge_budget": round(self._hedge_tokens, 2),
+                "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+                "breaker": self.breaker.stats(),
+            }
+
+
+# Build the call policy configured through environment variables
+def make_call_policy():
+    return CallPolicy(
+        deadline=float(os.getenv("CALL_DEADLINE", 30)),
+        max_retries=int(os.getenv("CALL_MAX_RETRIES", 2)),
+        backoff_base=float(os.getenv("CALL_BACKOFF_BASE", 0.5)),
+        backoff_max=float(os.getenv("CALL_BACKOFF_MAX", 8)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("BREAKER_FAILURES", 5)),
+            reset_timeout=float(os.getenv("BREAKER_RESET_TIMEOUT", 30)),
+        ),
+        hedge=os.getenv("HEDGE", "off") == "on",
+        hedge_quantile=float(os.getenv("HEDGE_QUANTILE", 0.95)),
+        hedge_min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", 20)),
+        hedge_budget=float(os.getenv("HEDGE_BUDGET", 0.05)),
+    )
@@ -0,0 +1,259 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from context import messages_tokens
+
+# Client-side pacing for Groq's request and token quotas. Every chat completion
+# reserves one request and its estimated tokens from a pair of token buckets before
+# it is sent; if the buckets are short, the call waits until they refill. The
+# buckets are corrected from the x-ratelimit-* headers of each response, and a 429
+# pauses every caller for the Retry-After period. State can live in a local file
+# so all workers on the host draw from the same budget.
+
+# Buckets reported in the x-ratelimit-*-<name> headers (Groq: requests per day,
+# tokens per minute), plus an optional local requests-per-minute cap
+HEADER_BUCKETS = ("requests", "tokens")
+BUCKETS = HEADER_BUCKETS + ("requests_per_minute",)
+
+# Share of a budget below which optional calls (hedges) are held back
+LOW_BUDGET = 0.1
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit reached. Please retry in {math.ceil(retry_after)} seconds.")
+        self.retry_after = retry_after
+
+
+# Parse Groq's reset durations such as "7.66s", "2m59.56s" or "120ms"
+def parse_duration(value):
+    if not value:
+        return None
+    total = 0.0
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+# A finite, non-negative number from a header, or None if it is missing or malformed
+def header_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) and number >= 0 else None
+
+
+# Longest of a request's httpx timeouts, or None without any
+def request_timeout(request):
+    timeouts = [value for value in (request.extensions.get("timeout") or {}).values() if value is not None]
+    return max(timeouts, default=None)
+
+
+# Seconds to wait before retrying after a rate limit error, from our own exception
+# or the Retry-After header of a groq.RateLimitError
+def retry_after(error, default=1):
+    if isinstance(error, RateLimited):
+        return math.ceil(error.retry_after)
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    seconds = header_number(headers.get("retry-after")) if headers is not None else None
+    return math.ceil(seconds) if seconds is not None else default
+
+
+# Bucket state of this process only
+class MemoryStateStore:
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self._state
+
+
+# Bucket state in a JSON file, updated under an exclusive lock so every worker
+# on the host shares one budget
+class FileStateStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        import fcntl
+
+        with self._lock, open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    # `rpm` caps requests per minute; `tpm` is the tokens-per-minute limit used until
+    # the first response reports the real one (None: no token pacing until then)
+    def __init__(self, store=None, rpm=None, tpm=None, max_wait=10, completion_tokens=256):
+        self.store = store or MemoryStateStore()
+        self.initial = {"requests": None, "tokens": tpm, "requests_per_minute": rpm}
+        self.max_wait = max_wait
+        self.completion_tokens = completion_tokens
+        self.throttled = 0
+        self.rejected = 0
+        self.upstream_429 = 0
+        self.wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _bucket(self, state, name, now):
+        bucket = state.setdefault("buckets", {}).get(name)
+        if bucket is None and self.initial[name]:
+            limit = self.initial[name]
+            bucket = state["buckets"][name] = {"capacity": limit, "level": limit, "rate": limit / 60, "updated": now}
+        if bucket is not None:
+            bucket["level"] = min(bucket["capacity"], bucket["level"] + (now - bucket["updated"]) * bucket["rate"])
+            bucket["updated"] = now
+        return bucket
+
+    # Tokens a request will count against the quota: the prompt plus the completion
+    def estimate(self, body):
+        try:
+            messages = body.get("messages") or []
+            prompt = messages_tokens([{"content": m.get("content") or ""} for m in messages])
+        except AttributeError:
+            prompt = 0
+        return prompt + (body.get("max_tokens") or body.get("max_completion_tokens") or self.completion_tokens)
+
+    # Take one request and `tokens` from the buckets and return how long to wait
+    # before sending. Raises RateLimited, taking nothing, if that exceeds max_wait
+    # or the time the caller has left (`time_left` seconds).
+    def reserve(self, tokens, time_left=None):
+        costs = {"requests": 1, "tokens": tokens, "requests_per_minute": 1}
+        now = time.time()
+        with self.store.transaction() as state:
+            delay = max(state.get("blocked_until", 0) - now, 0)
+            buckets = {name: self._bucket(state, name, now) for name in BUCKETS}
+            for name, bucket in buckets.items():
+                if bucket is not None and bucket["level"] < costs[name]:
+                    delay = max(delay, (costs[name] - bucket["level"]) / bucket["rate"] if bucket["rate"] else math.inf)
+            if delay > self.max_wait or time_left is not None and delay >= time_left:
+                with self._stats_lock:
+                    self.rejected += 1
+                raise RateLimited(delay if delay != math.inf else 60)
+            # Debit now, even if it goes negative, so later callers queue up behind this one
+            for name, bucket in buckets.items():
+                if bucket is not None:
+                    bucket["level"] -= costs[name]
+
+        if delay:
+            with self._stats_lock:
+                self.throttled += 1
+                self.wait_seconds += delay
+        return delay
+
+    # Correct the buckets from a response's x-ratelimit-* headers, and pause
+    # everyone after a 429. Missing or malformed headers leave the state as it was.
+    def update(self, status_code, headers):
+        now = time.time()
+        with self.store.transaction() as state:
+            for name in HEADER_BUCKETS:
+                limit = header_number(headers.get(f"x-ratelimit-limit-{name}"))
+                remaining = header_number(headers.get(f"x-ratelimit-remaining-{name}"))
+                if not limit or remaining is None:
+                    continue
+                remaining = min(remaining, limit)
+                bucket = self._bucket(state, name, now) or {"rate": limit / 60}
+                # The bucket refills continuously, so the time until it is full gives the rate
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{name}"))
+                if reset and remaining < limit:
+                    bucket["rate"] = (limit - remaining) / reset
+                bucket.update(capacity=limit, level=remaining, updated=now)
+                state["buckets"][name] = bucket
+
+            if status_code == 429:
+                pause = header_number(headers.get("retry-after"))
+                if pause is None:
+                    pause = 1.0
+                state["blocked_until"] = max(state.get("blocked_until", 0), now + pause)
+                with self._stats_lock:
+                    self.upstream_429 += 1
+
+    # Calls are being held back: paused after a 429, or a budget is nearly spent
+    def constrained(self):
+        now = time.time()
+        with self.store.transaction() as state:
+            if state.get("blocked_until", 0) > now:
+                return True
+            buckets = [self._bucket(state, name, now) for name in BUCKETS]
+        return any(bucket is not None and bucket["level"] < bucket["capacity"] * LOW_BUDGET for bucket in buckets)
+
+    # Reservation for an outgoing chat completion, or None for other requests. The
+    # request can't wait past its timeout, which the call policy sets to the time left
+    # before the attempt's deadline.
+    def before_request(self, request):
+        if not request.url.path.endswith("/chat/completions"):
+            return None
+        try:
+            body = json.loads(request.content or b"{}")
+        except ValueError:
+            body = {}
+        return self.reserve(self.estimate(body if isinstance(body, dict) else {}), request_timeout(request))
+
+    def stats(self):
+        now = time.time()
+        with self.store.transaction() as state:
+            buckets = {name: self._bucket(state, name, now) for name in BUCKETS}
+            blocked = max(state.get("blocked_until", 0) - now, 0)
+        with self._stats_lock:
+            return {
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "upstream_429": self.upstream_429,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "blocked_seconds": round(blocked, 3),
+                "buckets": {
+                    name: {"capacity": bucket["capacity"], "available": round(bucket["level"], 1)}
+                    for name, bucket in buckets.items() if bucket is not None
+                },
+            }
+
+
+# A 429 answered locally, so the Groq SDK raises RateLimitError without retrying
+def rate_limited_response(request, error):
+    return httpx.Response(
+        429,
+        headers={"retry-after": str(math.ceil(error.retry_after)), "x-should-retry": "false"},
+        json={"error": {"message": str(error), "type": "rate_limit_exceeded", "code": "rate_limit_exceeded"}},
+        request=request,
+    )
+
+
+# Build the rate limiter configured through environment variables, or None when off
+def make_rate_limiter():
+    if os.getenv("RATE_LIMIT", "on") == "off":
+        return None
+    path = os.getenv("RATE_LIMIT_STATE")
+    rpm, tpm = os.getenv("RATE_LIMIT_RPM"), os.getenv("RATE_LIMIT_TPM")
+    return RateLimiter(
+        FileStateStore(path) if path else MemoryStateStore(),
+        rpm=int(rpm) if rpm else None,
+        tpm=int(tpm) if tpm else None,
+        max_wait=float(os.getenv("RATE_LIMIT_MAX_WAIT", 10)),
+        completion_tokens=int(os.getenv("RATE_LIMIT_COMPLETION_TOKENS", 256)),
+    )
@@ -0,0 +1,192 @@
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from cache import normalize_prompt
+from context import estimate_tokens
+from llm import MODEL
+from metrics import UPSTREAM_LATENCY, count_usage
+from policy import CircuitOpen, DeadlineExceeded, is_retryable, make_call_policy
+from tracing import tracer
+
+# Per-request model choice. Greetings, short simple questions and session summaries
+# go to a small, fast model; everything else to the large one. Each model has its
+# own call policy (breaker, latency window), and a call that fails upstream, or a
+# model whose recent p95 latency breaks the SLO, falls back to the next model.
+
+SMALL_MODEL = "llama-3.1-8b-instant"
+
+# Keyword rules of the local intent classifier
+GREETING = re.compile(r"^(hi|hello|hey|yo|thanks|thank you|thx|good (morning|afternoon|evening|night)|bye|goodbye|ok|okay|cool|nice)\b")
+COMPLEX = re.compile(
+    r"\b(explain|why|how (do|does|can|to|would)|compare|comparison|difference|analy[sz]e|design|architecture"
+    r"|code|program|debug|implement|algorithm|write|essay|plan|strategy|step by step|pros and cons|prove|calculate)\b"
+)
+
+
+# Classify a prompt as "greeting", "complex" or "simple"
+def classify_intent(text):
+    text = normalize_prompt(text)
+    if GREETING.match(text) and len(text.split()) <= 6:
+        return "greeting"
+    if COMPLEX.search(text):
+        return "complex"
+    return "simple"
+
+
+class Router:
+    # `fallbacks` maps a model to the one tried when it fails or breaks the SLO
+    def __init__(self, large=MODEL, small=SMALL_MODEL, short_prompt_tokens=32, summary_model=None,
+                 fallbacks=None, slo_ms=None, slo_quantile=0.95, enabled=True):
+        self.large = large
+        self.small = small
+        self.short_prompt_tokens = short_prompt_tokens
+        self.summary_model = summary_model or small
+        self.fallbacks = fallbacks if fallbacks is not None else {large: small, small: large}
+        self.slo_ms = slo_ms
+        self.slo_quantile = slo_quantile
+        self.enabled = enabled
+        self.routed = Counter()  # (reason, model) -> requests
+        self.fallen_back = Counter()  # (from model, cause) -> requests
+        self._policies = {}
+        self._lock = threading.Lock()
+
+    def policy(self, model):
+        with self._lock:
+            policy = self._policies.get(model)
+            if policy is None:
+                policy = self._policies[model] = make_call_policy()
+            return policy
+
+    # Pick the model for a request to `endpoint` ("chat" or "summarize")
+    def choose(self, endpoint, text):
+        if not self.enabled:
+            reason, model = "fixed", self.large
+        elif endpoint == "summarize":
+            reason, model = "summarize", self.summary_model
+        else:
+            intent = classify_intent(text)
+            if intent == "greeting":
+                reason, model = "greeting", self.small
+            elif intent == "simple" and estimate_tokens(text) <= self.short_prompt_tokens:
+                reason, model = "short", self.small
+            else:
+                reason, model = intent, self.large
+        with self._lock:
+            self.routed[reason, model] += 1
+        return model
+
+    def _breaches_slo(self, model):
+        if not self.slo_ms:
+            return False
+        latency = self.policy(model).latency_quantile(self.slo_quantile)
+        return latency is not None and latency * 1000 > self.slo_ms
+
+    # Models to try for a request routed to `model`, in order. A model breaking the
+    # SLO moves behind its fallback.
+    def _chain(self, model):
+        chain = [model]
+        while self.fallbacks.get(chain[-1]) and self.fallbacks[chain[-1]] not in chain:
+            chain.append(self.fallbacks[chain[-1]])
+        if len(chain) > 1 and self._breaches_slo(model):
+            with self._lock:
+                self.fallen_back[model, "slo"] += 1
+            chain.append(chain.pop(0))
+        return chain
+
+    def _fall_back(self, model, error, last):
+        upstream = isinstance(error, (CircuitOpen, DeadlineExceeded)) or is_retryable(error)
+        if last or not upstream:
+            return False
+        with self._lock:
+            self.fallen_back[model, "error"] += 1
+        return True
+
+    # Record the latency of one model's call and, for non-streaming calls, its token usage
+    def _observe(self, model, start, span, result=None, error=None, stream=False):
+        elapsed = time.perf_counter() - start
+        UPSTREAM_LATENCY.observe(elapsed, model=model, outcome="error" if error else "ok")
+        if error is not None:
+            span.record_exception(error)
+        elif not stream:
+            count_usage(model, result)
+            # The whole answer arrives at once, so the first token comes with the last
+            span.set_attribute("llm.time_to_first_token_ms", round(elapsed * 1000, 1))
+            usage = getattr(result, "usage", None)
+            if usage is not None:
+                span.set_attributes({"gen_ai.usage.input_tokens": usage.prompt_tokens,
+                                     "gen_ai.usage.output_tokens": usage.completion_tokens})
+
+    def _span(self, model, attempt, stream):
+        return tracer.span("llm.completion", **{"gen_ai.request.model": model, "llm.fallback": attempt > 0,
+                                                "llm.stream": stream})
+
+    # Chat completion for a request routed to `model`, falling back on upstream failures
+    def complete(self, client, model, **kwargs):
+        chain = self._chain(model)
+        stream = kwargs.get("stream", False)
+        for i, candidate in enumerate(chain):
+            start = time.perf_counter()
+            with self._span(candidate, i, stream) as span:
+                try:
+                    result = self.policy(candidate).complete(client, model=candidate, **kwargs)
+                except Exception as e:
+                    self._observe(candidate, start, span, error=e)
+                    if not self._fall_back(candidate, e, i == len(chain) - 1):
+                        raise
+                else:
+                    self._observe(candidate, start, span, result, stream=stream)
+                    return result
+
+    async def acomplete(self, client, model, **kwargs):
+        chain = self._chain(model)
+        stream = kwargs.get("stream", False)
+        for i, candidate in enumerate(chain):
+            start = time.perf_counter()
+            with self._span(candidate, i, stream) as span:
+                try:
+                    result = await self.policy(candidate).acomplete(client, model=candidate, **kwargs)
+                except Exception as e:
+                    self._observe(candidate, start, span, error=e)
+                    if not self._fall_back(candidate, e, i == len(chain) - 1):
+                        raise
+                else:
+                    self._observe(candidate, start, span, result, stream=stream)
+                    return result
+
+    def policy_stats(self):
+        with self._lock:
+            policies = dict(self._policies)
+        return {model: policy.stats() for model, policy in policies.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "routed": [{"reason": reason, "model": model, "requests": n} for (reason, model), n in self.routed.items()],
+                "fallbacks": [{"model": model, "cause": cause, "requests": n} for (model, cause), n in self.fallen_back.items()],
+            }
+
+
+# Read ROUTE_FALLBACKS, e.g. "llama-3.3-70b-versatile=llama-3.1-8b-instant"
+def parse_fallbacks(value):
+    fallbacks = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        model, _, fallback = item.partition("=")
+        fallbacks[model.strip()] = fallback.strip()
+    return fallbacks
+
+# Build the router configured through environment variables
+def make_router():
+    fallbacks, slo_ms = os.getenv("ROUTE_FALLBACKS"), os.getenv("ROUTE_SLO_MS", 5000)
+    return Router(
+        large=os.getenv("MODEL_LARGE", MODEL),
+        small=os.getenv("MODEL_SMALL", SMALL_MODEL),
+        short_prompt_tokens=int(os.getenv("ROUTE_SHORT_PROMPT_TOKENS", 32)),
+        summary_model=os.getenv("ROUTE_SUMMARY_MODEL"),
+        fallbacks=parse_fallbacks(fallbacks) if fallbacks is not None else None,
+        slo_ms=float(slo_ms) if slo_ms else None,
+        enabled=os.getenv("ROUTING", "on") == "on",
+    )
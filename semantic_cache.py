@@ -0,0 +1,168 @@
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from cache import normalize_prompt
+
+# Opt-in semantic cache: answers a question with the cached response of a
+# previously asked question whose embedding is close enough (cosine similarity).
+# Turn it on with SEMANTIC_CACHE=hashing (no download) or SEMANTIC_CACHE=model.
+#
+# Embeddings blur the details that change an answer ("10 km" vs "100 km", "Austria"
+# vs "Australia"), so a hit also needs the same numbers, in the same order, and the
+# same words outside the embedder's vocabulary.
+
+# Punctuation stripped from the ends of words ("python?" is "python", "c++" stays)
+PUNCTUATION = "?!.,;:'\"()[]"
+
+# Words the hashing embedder lets questions differ in
+COMMON_WORDS = frozenset("""a an the is are was were be been do does did can could would should will i me my
+    you your we our it its this that these those in on of for at by with about please""".split())
+
+
+# Case-folded words of a question, without surrounding punctuation
+def semantic_words(text):
+    words = (word.strip(PUNCTUATION) for word in text.casefold().split())
+    return [word for word in words if word]
+
+
+# Embeds text as hashed character n-grams. Needs no model download; it sees spelling,
+# not meaning, so it only matches questions that differ in case, punctuation or a few
+# common words, with a strict default threshold.
+class HashingEmbedder:
+    threshold = 0.95
+    vocabulary = COMMON_WORDS
+
+    def __init__(self, dim=1024, ngram=3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def embed(self, text):
+        text = f" {normalize_prompt(text)} "
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for i in range(max(len(text) - self.ngram + 1, 1)):
+            digest = hashlib.blake2b(text[i:i + self.ngram].encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            # Use one hash bit as the sign so collisions tend to cancel out
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+# Embeds text with a local sentence-transformers model on the CPU. Words missing from
+# its tokenizer's vocabulary (names, identifiers) are split into pieces it may not tell
+# apart, so those have to match exactly.
+class ModelEmbedder:
+    threshold = 0.9
+
+    def __init__(self, model_name="all-MiniLM-L6-v2"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("SEMANTIC_CACHE=model requires the 'sentence-transformers' package.")
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.vocabulary = COMMON_WORDS | set(self.model.tokenizer.get_vocab())
+
+    def embed(self, text):
+        vector = self.model.encode(normalize_prompt(text), normalize_embeddings=True)
+        return np.asarray(vector, dtype=np.float32)
+
+
+# Fixed-size NumPy index of question embeddings. A lookup is one matrix-vector
+# product over the stored rows of the same group (model, numbers and out-of-vocabulary
+# words); when full, the least recently used row is reused.
+class SemanticCache:
+    def __init__(self, embedder, threshold=None, max_entries=1000):
+        self.embedder = embedder
+        self.threshold = embedder.threshold if threshold is None else threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self._vectors = np.zeros((max_entries, embedder.dim), dtype=np.float32)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._groups = np.zeros(max_entries, dtype=np.int64)
+        self._values = [None] * max_entries
+        self._size = 0
+        self._lock = threading.Lock()
+
+    # Embedding of a question, and a hash of what a match must share with it
+    def _embed(self, model, text):
+        words = semantic_words(text)
+        numbers = [word for word in words if any(c.isdigit() for c in word)]
+        unknown = sorted({word for word in words if word not in self.embedder.vocabulary} - set(numbers))
+        digest = hashlib.blake2b(repr((model, numbers, unknown)).encode(), digest_size=8).digest()
+        return self.embedder.embed(" ".join(words)), int.from_bytes(digest, "little", signed=True)
+
+    # Return the cached response for the closest matching question, or None
+    def get(self, model, text):
+        start = time.perf_counter()
+        vector, group = self._embed(model, text)
+        with self._lock:
+            value = None
+            if self._size:
+                scores = self._vectors[:self._size] @ vector
+                scores[self._groups[:self._size] != group] = -1.0
+                i = int(np.argmax(scores))
+                if scores[i] >= self.threshold:
+                    self._last_used[i] = time.monotonic()
+                    value = self._values[i]
+
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.lookup_seconds += time.perf_counter() - start
+            return value
+
+    # Store the response for a question
+    def set(self, model, text, value):
+        vector, group = self._embed(model, text)
+        with self._lock:
+            if self._size < self.max_entries:
+                i = self._size
+                self._size += 1
+            else:
+                i = int(np.argmin(self._last_used))
+            self._vectors[i] = vector
+            self._last_used[i] = time.monotonic()
+            self._groups[i] = group
+            self._values[i] = value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "semantic",
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "avg_lookup_ms": round(self.lookup_seconds / lookups * 1000, 3) if lookups else 0.0,
+                "size": self._size,
+                "threshold": self.threshold,
+            }
+
+
+# Build the semantic cache configured through environment variables, or None when off
+def make_semantic_cache():
+    mode = os.getenv("SEMANTIC_CACHE", "off")
+    if mode == "off":
+        return None
+    if mode == "hashing":
+        embedder = HashingEmbedder()
+    elif mode == "model":
+        embedder = ModelEmbedder(os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2"))
+    else:
+        raise ValueError(f"Unknown SEMANTIC_CACHE: {mode}")
+
+    # Unset: the embedder's default
+    threshold = os.getenv("SEMANTIC_CACHE_THRESHOLD")
+    return SemanticCache(
+        embedder,
+        threshold=float(threshold) if threshold else None,
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000)),
+    )
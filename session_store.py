@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+import time
+
+from history_store import SQLiteHistoryStore
+from llm import bot_text, split_response
+
+# Chat sessions of the Streamlit app, persisted in SQLite so they survive a page
+# refresh. A small chat_sessions table holds each session's title and summary, which
+# is all the sidebar reads; a session's turns live in the chat_history table of a
+# SQLiteHistoryStore in the same file, appended one at a time by its background
+# writer, and are only read when the session is opened. Its full-text index makes
+# every session searchable.
+#
+# Every session belongs to an owner, the ID of the browser that created it: the
+# sidebar lists, searches and clears only that owner's sessions.
+
+
+class SessionStore:
+    def __init__(self, path="chat_sessions.db"):
+        self.path = path
+        self.history = SQLiteHistoryStore(path)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                session_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                summary TEXT,
+                summary_covered INTEGER NOT NULL DEFAULT 0,
+                owner TEXT
+            );
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chat_sessions)")}
+        if "owner" not in columns:
+            # Table from before sessions had owners; its sessions are left without one
+            with self._conn:
+                self._conn.execute("ALTER TABLE chat_sessions ADD COLUMN owner TEXT")
+        self._conn.executescript("""
+            DROP INDEX IF EXISTS idx_chat_sessions_updated;
+            CREATE INDEX IF NOT EXISTS idx_chat_sessions_owner_updated
+                ON chat_sessions (owner, updated_at);
+        """)
+        self._lock = threading.Lock()
+
+    # (session ID, title) of the owner's most recently used sessions, newest first
+    def sessions(self, owner, limit=None):
+        sql = "SELECT session_id, title FROM chat_sessions WHERE owner = ? ORDER BY updated_at DESC"
+        params = (owner,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # Turns of a session, oldest first, with the answer split into bullets
+    def transcript(self, session_id):
+        return [dict(entry, bot=split_response(entry['bot'])) for entry in self.history.list(session_id)]
+
+    # IDs of the owner's sessions
+    def _owned(self, owner):
+        with self._lock:
+            rows = self._conn.execute("SELECT session_id FROM chat_sessions WHERE owner = ?", (owner,)).fetchall()
+        return [session_id for session_id, in rows]
+
+    # Turns of the owner's sessions matching every term of `query`, best first,
+    # optionally within one of them
+    def search(self, query, owner, session_id=None, limit=20, offset=0):
+        owned = self._owned(owner)
+        if session_id is not None:
+            owned = [key for key in owned if key == session_id]
+        return self.history.search(query, session_id, limit, offset, sessions=owned)
+
+    # Add a turn to a session; the session is created with the turn's question as
+    # title, belonging to `owner`
+    def append(self, session_id, turn, owner):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO chat_sessions (session_id, title, created_at, updated_at, owner) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (session_id) DO UPDATE SET updated_at = excluded.updated_at""",
+                (session_id, turn['user'], now, now, owner),
+            )
+        self.history.append(dict(turn, bot=bot_text(turn['bot'])), session_id)
+
+    # (summary, number of turns it covers) of a session
+    def summary(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, summary_covered FROM chat_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row or (None, 0)
+
+    def set_summary(self, session_id, summary, covered):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE chat_sessions SET summary = ?, summary_covered = ? WHERE session_id = ?",
+                (summary, covered, session_id),
+            )
+
+    # Delete the owner's sessions
+    def clear(self, owner):
+        owned = self._owned(owner)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chat_sessions WHERE owner = ?", (owner,))
+        for session_id in owned:
+            self.history.delete(session_id)
+
+
+# Build the session store configured through environment variables
+def make_session_store():
+    return SessionStore(os.getenv("SESSION_DB", "chat_sessions.db"))
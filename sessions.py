@@ -0,0 +1,29 @@
+import uuid
+
+# Per-client session IDs for the chat API. A client identifies itself with the
+# X-Session-ID header or the session cookie; anything else gets a new uuid4,
+# like the session IDs the Streamlit apps generate.
+
+SESSION_HEADER = "X-Session-ID"
+SESSION_COOKIE = "chat_session_id"
+
+# Keep the cookie for a year; idle sessions are expired by the history store
+SESSION_COOKIE_MAX_AGE = 365 * 24 * 3600
+
+# Session ID sent with a request, or None if missing or not a UUID
+def session_id_from(request):
+    value = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    if not value:
+        return None
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        return None
+
+def new_session_id():
+    return str(uuid.uuid4())
+
+# Remember a newly created session ID in the client's cookie
+def set_session_cookie(response, session_id):
+    response.set_cookie(SESSION_COOKIE, session_id, max_age=SESSION_COOKIE_MAX_AGE, httponly=True, samesite="Lax")
+    response.headers[SESSION_HEADER] = session_id
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+# Request coalescing: concurrent callers asking for the same key share one upstream
+# call instead of each starting their own. The first caller (the leader) does the
+# work; everyone else waits for its result. Optionally, leaders in different worker
+# processes are serialized through file locks, so a follower in another worker finds
+# the answer in the shared cache once the leader is done.
+
+
+# One in-flight call that followers wait on
+class Call:
+    def __init__(self):
+        self._done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+# Cross-worker locks: one lock file per key in a local directory
+class FileLockStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def lock(self, key):
+        import fcntl
+
+        name = hashlib.sha1(key.encode()).hexdigest()
+        with open(os.path.join(self.directory, f"{name}.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SingleFlight:
+    def __init__(self, lock_store=None):
+        self.lock_store = lock_store
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    # Join the in-flight call for `key`. Returns the call and whether this caller is
+    # the leader; the leader must end it with finish() (followers call call.wait()).
+    def join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = Call()
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.finish(result, error)
+
+    # Run `fn()` once for all concurrent callers with the same key. With a lock
+    # store, the leader first takes the cross-worker lock and then tries `lookup()`
+    # (e.g. a shared cache read) in case another worker just produced the result.
+    def do(self, key, fn, lookup=None):
+        call, leader = self.join(key)
+        if not leader:
+            return call.wait()
+
+        try:
+            if self.lock_store is None:
+                result = fn()
+            else:
+                with self.lock_store.lock(key):
+                    result = lookup() if lookup else None
+                    if result is None:
+                        result = fn()
+        except Exception as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+# Enter a cross-worker lock from a coroutine. flock blocks, so it is taken in a worker
+# thread, which can't be stopped: if the caller is cancelled while waiting, the lock
+# is released as soon as the thread has it.
+async def acquire(lock):
+    entering = asyncio.ensure_future(asyncio.to_thread(lock.__enter__))
+    try:
+        await asyncio.shield(entering)
+    except asyncio.CancelledError:
+        entering.add_done_callback(
+            lambda task: task.cancelled() or task.exception() or lock.__exit__(None, None, None))
+        raise
+
+
+# asyncio version for the ASGI app: followers await the leader's future
+class AsyncSingleFlight:
+    def __init__(self, lock_store=None):
+        self.lock_store = lock_store
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+
+    # Join the in-flight call for `key`. Returns the future and whether this caller
+    # is the leader; the leader must end it with finish(), followers await wait().
+    def join(self, key):
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+            # Mark the exception as retrieved in case nobody else is waiting
+            future.exception()
+        else:
+            future.set_result(result)
+
+    # shield() so one follower being cancelled doesn't cancel the others
+    async def wait(self, future):
+        return await asyncio.shield(future)
+
+    # As SingleFlight.do, with `fn()` and `lookup()` returning awaitables
+    async def do(self, key, fn, lookup=None):
+        future, leader = self.join(key)
+        if not leader:
+            return await self.wait(future)
+
+        try:
+            if self.lock_store is None:
+                result = await fn()
+            else:
+                lock = self.lock_store.lock(key)
+                await acquire(lock)
+                try:
+                    result = await lookup() if lookup else None
+                    if result is None:
+                        result = await fn()
+                finally:
+                    lock.__exit__(None, None, None)
+        except (Exception, asyncio.CancelledError) as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def stats(self):
+        return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+# Lock store configured through SINGLEFLIGHT_LOCK_DIR, or None for in-process only
+def make_lock_store():
+    directory = os.getenv("SINGLEFLIGHT_LOCK_DIR")
+    return FileLockStore(directory) if directory else None
@@ -0,0 +1,168 @@
+import os
+from datetime import datetime
+
+import streamlit as st
+from dotenv import load_dotenv
+
+from cache import cache_key, make_cache
+from llm import summary_messages
+from singleflight import SingleFlight, make_lock_store
+from tracing import tracer
+from transcript import STREAMING, completion_tokens, render_stream
+
+# Answering questions in the Streamlit apps (final.py, app6.py), which differ in
+# where they keep their sessions. The client, router, response cache and
+# single-flight group are built once per process (st.cache_resource) and shared by
+# all browser sessions and reruns.
+
+
+# Load environment variables once per process, not on every rerun
+@st.cache_resource
+def get_config():
+    load_dotenv()
+    return {"api_key": os.getenv("GROQ_API_KEY")}
+
+# LLM backend (the shared Groq client by default): one per process, so its connection pool survives reruns.
+# Built on first use, so the page renders before the Groq SDK is imported.
+@st.cache_resource
+def get_client():
+    from backends import get_backend
+    return get_backend(get_config()["api_key"])
+
+# Pick a model per request, with fallbacks and per-model call policies, shared across reruns and sessions
+@st.cache_resource
+def get_router():
+    from router import make_router
+    return make_router()
+
+# Share one response cache across reruns and sessions
+@st.cache_resource
+def get_response_cache():
+    return make_cache()
+
+# Coalesce identical questions asked at the same time, across all browser sessions
+@st.cache_resource
+def get_flight():
+    return SingleFlight(make_lock_store())
+
+# Fold turns into a running summary: older turns that no longer fit the context
+# window, and new turns when "Summarize Session" is clicked
+def summarize_turns(summary, turns):
+    messages = summary_messages(summary, turns)
+    router = get_router()
+    summary_completion = router.complete(
+        get_client(),
+        router.choose("summarize", messages[-1]['content']),
+        messages=messages,
+    )
+    return summary_completion.choices[0].message.content
+
+# Ask the Groq client for an answer and cache it
+def fetch_answer(key, model, messages):
+    chat_completion = get_router().complete(
+        get_client(),
+        model,
+        messages=messages,
+    )
+    if chat_completion and chat_completion.choices:
+        response_content = chat_completion.choices[0].message.content
+        get_response_cache().set(key, response_content)
+        return response_content
+    return None
+
+# Stream the answer from the Groq client and cache it. Identical concurrent questions
+# share one upstream call; the others get the finished answer in one piece.
+def stream_answer(key, model, messages):
+    flight = get_flight()
+    call, leader = flight.join(key)
+    if not leader:
+        yield call.wait() or ""
+        return
+
+    parts = []
+    try:
+        stream = get_router().complete(
+            get_client(),
+            model,
+            messages=messages,
+            stream=True,
+        )
+        for token in completion_tokens(stream):
+            if not parts:
+                tracer.current_span().add_event("first_token")
+            parts.append(token)
+            yield token
+    except BaseException as e:
+        # Release the waiting sessions even if this one stopped reading
+        flight.finish(key, call, error=e if isinstance(e, Exception) else RuntimeError("Stream was closed."))
+        raise
+
+    response_content = "".join(parts)
+    if response_content.strip():
+        get_response_cache().set(key, response_content)
+    flight.finish(key, call, response_content)
+
+# The whole answer at once, behind a spinner (STREAMLIT_STREAMING=off)
+def fetch_tokens(key, model, messages):
+    with st.spinner("🤖 Analyzing... Please wait..."):  # Show loading indicator
+        # Identical concurrent questions share one upstream call
+        response_content = get_flight().do(
+            key,
+            lambda: fetch_answer(key, model, messages),
+            lookup=lambda: get_response_cache().get(key),
+        )
+    if response_content:
+        yield response_content
+
+# Answer a question, writing the answer into the chat container as it arrives. The
+# turn is added to st.session_state.chat_history and handed to `save(turn)`;
+# `context(messages)`, if given, prefixes the prompt with earlier turns.
+def answer(user_input, save, context=None):
+    # Only needed once a question is asked, like the client
+    from groq import RateLimitError
+    from ratelimit import retry_after
+
+    if user_input:
+        # One trace per question, with a span for each stage
+        with tracer.span("streamlit.answer", **{"session.id": st.session_state.session_id}) as root:
+            try:
+                with tracer.span("chat.build_prompt") as span:
+                    messages = [
+                        {"role": "user", "content": f"You are a helpful assistant. {user_input} Give a short, bullet-pointed response."}
+                    ]
+                    if context:
+                        messages = context(messages)
+                    model = get_router().choose("chat", user_input)
+                    span.set_attributes({"gen_ai.request.model": model, "chat.messages": len(messages)})
+
+                # Serve repeated questions from the cache, otherwise ask the Groq client
+                with tracer.span("chat.cache_lookup") as span:
+                    key = cache_key(model, messages)
+                    response_content = get_response_cache().get(key)
+                    span.set_attribute("chat.cache_hit", response_content is not None)
+
+                if response_content is not None:
+                    render_stream(user_input, [response_content])
+                else:
+                    with tracer.span("chat.upstream", **{"llm.stream": STREAMING}):
+                        tokens = stream_answer(key, model, messages) if STREAMING else fetch_tokens(key, model, messages)
+                        response_content = render_stream(user_input, tokens)
+
+                current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+                if response_content.strip():
+                    with tracer.span("chat.postprocess"):
+                        response_list = [line.strip() for line in response_content.split("\n") if line.strip()]
+
+                        new_chat = {"date": current_date, "user": user_input, "bot": response_list}
+                        st.session_state.chat_history.append(new_chat)
+                        save(new_chat)
+
+                    st.session_state.selected_session = st.session_state.session_id  # Set active session
+
+            except RateLimitError as e:
+                root.record_exception(e)
+                st.warning(f"The AI is rate limited. Please retry in {retry_after(e)} seconds.")
+            except Exception as e:
+                root.record_exception(e)
+                st.error(f"An error occurred: {e}")
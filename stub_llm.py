@@ -0,0 +1,216 @@
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+
+from cache import cache_key
+
+# Minimal stand-in for the Groq chat-completions API, for offline benchmarks.
+# Run it with an ASGI server and point the apps at it:
+#   uvicorn stub_llm:app --port 9000
+#   LLM_BACKEND=stub python app.py
+# Latency follows a configurable distribution, a share of requests can fail with
+# 500 or 429, and answers can be replayed from a file recorded with LLM_BACKEND=record.
+# Set STUB_SEED for a repeatable sequence of latencies and errors.
+
+# Simulated upstream latency: STUB_LATENCY_MS is the median, STUB_LATENCY_SPREAD_MS
+# the spread (half-width for uniform, standard deviation for normal, and how far the
+# 84th percentile is above the median for lognormal)
+LATENCY_MS = float(os.environ.get("STUB_LATENCY_MS", 500))
+LATENCY_DIST = os.environ.get("STUB_LATENCY_DIST", "fixed")
+LATENCY_SPREAD_MS = float(os.environ.get("STUB_LATENCY_SPREAD_MS", 0))
+RESPONSE_TEXT = os.environ.get(
+    "STUB_RESPONSE",
+    "- This is a stub answer\n- It has a few bullet points\n- Nothing was sent upstream\n",
+)
+
+# Share of requests answered with a 500 or a 429
+ERROR_RATE = float(os.environ.get("STUB_ERROR_RATE", 0))
+RATE_LIMIT_RATE = float(os.environ.get("STUB_RATE_LIMIT_RATE", 0))
+
+# Recorded answers to replay, and whether unknown prompts get RESPONSE_TEXT or a 404
+REPLAY_FILE = os.environ.get("STUB_REPLAY_FILE")
+REPLAY_MISS = os.environ.get("STUB_REPLAY_MISS", "default")
+
+# Quota reported in the x-ratelimit-* headers
+TOKENS_PER_MINUTE = int(os.environ.get("STUB_TPM", 1_000_000))
+REQUESTS_PER_DAY = int(os.environ.get("STUB_RPD", 1_000_000))
+
+rng = random.Random(os.environ.get("STUB_SEED"))
+
+
+# Draw one latency in seconds
+def sample_latency(rng=rng, dist=LATENCY_DIST, median_ms=LATENCY_MS, spread_ms=LATENCY_SPREAD_MS):
+    if dist == "fixed":
+        ms = median_ms
+    elif dist == "uniform":
+        ms = rng.uniform(median_ms - spread_ms, median_ms + spread_ms)
+    elif dist == "normal":
+        ms = rng.gauss(median_ms, spread_ms)
+    elif dist == "lognormal":
+        ms = rng.lognormvariate(math.log(median_ms), math.log1p(spread_ms / median_ms)) if median_ms else 0
+    elif dist == "exponential":
+        ms = rng.expovariate(math.log(2) / median_ms) if median_ms else 0
+    else:
+        raise ValueError(f"Unknown STUB_LATENCY_DIST: {dist}")
+    return max(ms, 0) / 1000
+
+
+# Recorded answers, one JSON object per line: {"model", "messages", "content"}.
+# Looked up by model and prompt first, then by prompt alone, so a recording still
+# matches when requests are routed to a different model.
+class ReplayStore:
+    def __init__(self, path):
+        self.path = path
+        self._by_model = {}
+        self._by_prompt = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._index(record["model"], record["messages"], record["content"])
+
+    def _index(self, model, messages, content):
+        self._by_model[cache_key(model, messages)] = content
+        self._by_prompt[cache_key("", messages)] = content
+
+    def get(self, model, messages):
+        with self._lock:
+            content = self._by_model.get(cache_key(model, messages))
+            return content if content is not None else self._by_prompt.get(cache_key("", messages))
+
+    def record(self, model, messages, content):
+        with self._lock:
+            self._index(model, messages, content)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"model": model, "messages": messages, "content": content}) + "\n")
+
+    def __len__(self):
+        return len(self._by_model)
+
+
+replay = ReplayStore(REPLAY_FILE) if REPLAY_FILE else None
+
+# Build a chat.completion body in the OpenAI/Groq format
+def completion_body(model, content):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+        ],
+        "usage": {"prompt_tokens": 20, "completion_tokens": len(content.split()), "total_tokens": 20 + len(content.split())},
+    }
+
+# Build one chat.completion.chunk body for streaming
+def chunk_body(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+# Split an answer into streamed tokens, keeping the spaces between them
+def stream_tokens(content):
+    tokens = content.split(" ")
+    return [token if i == 0 else " " + token for i, token in enumerate(tokens)]
+
+# Read the whole request body from an ASGI receive channel
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+def rate_limit_headers():
+    return [
+        (b"x-ratelimit-limit-requests", str(REQUESTS_PER_DAY).encode()),
+        (b"x-ratelimit-remaining-requests", str(REQUESTS_PER_DAY - 1).encode()),
+        (b"x-ratelimit-reset-requests", b"86.4ms"),
+        (b"x-ratelimit-limit-tokens", str(TOKENS_PER_MINUTE).encode()),
+        (b"x-ratelimit-remaining-tokens", str(TOKENS_PER_MINUTE - 100).encode()),
+        (b"x-ratelimit-reset-tokens", b"6ms"),
+    ]
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def send_stream(send, model, content, latency):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), *rate_limit_headers()],
+    })
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    tokens = stream_tokens(content)
+    # Spread the latency across the tokens so time-to-first-token is realistic
+    delay = latency / max(len(tokens), 1)
+    for token in tokens:
+        await asyncio.sleep(delay)
+        event = chunk_body(completion_id, model, {"content": token})
+        await send({"type": "http.response.body", "body": f"data: {json.dumps(event)}\n\n".encode(), "more_body": True})
+    event = chunk_body(completion_id, model, {}, finish_reason="stop")
+    await send({"type": "http.response.body", "body": f"data: {json.dumps(event)}\n\ndata: [DONE]\n\n".encode()})
+
+# ASGI app serving POST /openai/v1/chat/completions
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["path"] != "/openai/v1/chat/completions" or scope["method"] != "POST":
+        await send_json(send, 404, {"error": {"message": "Not found"}})
+        return
+
+    request = json.loads(await read_body(receive) or b"{}")
+    model = request.get("model", "stub")
+    latency = sample_latency()
+
+    # Injected failures, after the simulated latency like real ones
+    roll = rng.random()
+    if roll < ERROR_RATE:
+        await asyncio.sleep(latency)
+        await send_json(send, 500, {"error": {"message": "Injected stub error", "type": "internal_server_error"}})
+        return
+    if roll < ERROR_RATE + RATE_LIMIT_RATE:
+        headers = [(b"retry-after", b"1"), *rate_limit_headers()]
+        await send_json(send, 429, {"error": {"message": "Injected rate limit", "type": "rate_limit_exceeded"}}, headers)
+        return
+
+    content = RESPONSE_TEXT
+    if replay is not None:
+        content = replay.get(model, request.get("messages", []))
+        if content is None:
+            if REPLAY_MISS == "error":
+                await send_json(send, 404, {"error": {"message": "No recorded response for this prompt"}})
+                return
+            content = RESPONSE_TEXT
+
+    if request.get("stream"):
+        await send_stream(send, model, content, latency)
+    else:
+        await asyncio.sleep(latency)
+        await send_json(send, 200, completion_body(model, content), rate_limit_headers())
@@ -0,0 +1,41 @@
+import importlib
+
+import pytest
+
+from metrics import IN_FLIGHT
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv("LLM_BACKEND", "replay")
+        env.setenv("LLM_REPLAY_FILE", str(directory / "replay.jsonl"))
+        env.setenv("HISTORY_DB", str(directory / "history.db"))
+        env.setenv("LOG_LEVEL", "CRITICAL")
+        app = importlib.import_module("app")
+        yield app.app.test_client()
+
+
+def in_flight():
+    return sum(value for _, value in IN_FLIGHT.samples())
+
+
+@pytest.mark.parametrize("method, path, kwargs, status", [
+    ("GET", "/missing", {}, 404),
+    ("GET", "/api/chat", {}, 405),
+    ("POST", "/api/chat/stream", {"data": "text"}, 415),
+])
+def test_error_pages_leave_nothing_in_flight(client, method, path, kwargs, status):
+    response = client.open(path, method=method, **kwargs)
+    assert response.status_code == status
+    assert in_flight() == 0
+
+
+def test_stream_is_in_flight_until_it_ends(client):
+    response = client.post("/api/chat/stream", json={"message": "What is Python?"}, buffered=False)
+    assert response.status_code == 200
+    assert in_flight() == 1
+    assert b"event: done" in b"".join(response.response)
+    response.close()
+    assert in_flight() == 0
@@ -0,0 +1,58 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import clients
+from clients import PooledTransport, get_async_client, get_client, pool_stats, rate_limit_stats
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    monkeypatch.setattr(clients, "_clients", {})
+
+
+def test_clients_are_shared_per_key_and_base_url(shared):
+    assert get_client("key") is get_client("key")
+    assert get_client("key") is not get_client("other key")
+    assert get_client("key") is not get_client("key", base_url="http://127.0.0.1:9000")
+    assert get_async_client("key") is not get_client("key")
+    assert sorted(pool_stats()) == ["async", "sync", "sync #2", "sync http://127.0.0.1:9000"]
+    assert sorted(rate_limit_stats()) == sorted(pool_stats())
+
+
+def test_requests_are_in_flight_until_the_response_is_closed(server):
+    transport = PooledTransport(httpx.Limits(max_connections=1))
+    with httpx.Client(transport=transport) as client:
+        with client.stream("GET", server):
+            assert transport.in_flight == 1
+            # The only connection is taken, so a second request waits in the pool
+            second = threading.Thread(target=client.get, args=(server,))
+            second.start()
+            while transport.in_flight < 2 and second.is_alive():
+                second.join(0.001)
+            stats = transport.stats()
+            assert (stats["active"], stats["queued"], stats["waits"]) == (1, 1, 1)
+        second.join(1)
+        stats = transport.stats()
+        assert (transport.in_flight, stats["queued"], stats["requests"]) == (0, 0, 2)
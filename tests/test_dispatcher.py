@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dispatcher import AsyncDispatcher, Dispatcher, Overloaded
+
+
+# Queue `jobs` ((name, session, model) tuples) while a slot for `held` is taken,
+# then free it and return the order in which the jobs got their slots
+async def run_order(dispatcher, jobs, held="m"):
+    order = []
+
+    async def job(name, session_id, model):
+        async with dispatcher.slot(session_id, model):
+            order.append(name)
+
+    async with dispatcher.slot("holder", held):
+        tasks = [asyncio.create_task(job(*spec)) for spec in jobs]
+        await asyncio.sleep(0)
+        assert dispatcher.stats()["queued"] == len(jobs)
+    await asyncio.wait_for(asyncio.gather(*tasks), 1)
+    return order
+
+
+def test_sessions_take_turns_and_each_session_is_fifo():
+    jobs = [("a1", "a", "m"), ("a2", "a", "m"), ("a3", "a", "m"), ("b1", "b", "m"), ("c1", "c", "m")]
+    assert asyncio.run(run_order(AsyncDispatcher(max_in_flight=1), jobs)) == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_per_model_cap():
+    async def main():
+        dispatcher = AsyncDispatcher(max_in_flight=10, model_limits={"large": 1})
+        order = []
+
+        async def job(name, model):
+            async with dispatcher.slot(name, model):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(asyncio.gather(job("a", "large"), job("b", "large"), job("c", "small")), 1)
+        return order, dispatcher.stats()
+
+    order, stats = asyncio.run(main())
+    # "c" didn't wait for the capped model; "b" waited for "a"
+    assert order == ["a", "c", "b"]
+    assert (stats["dispatched"], stats["in_flight"]) == (3, 0)
+
+
+def test_full_queue_rejects():
+    async def main():
+        dispatcher = AsyncDispatcher(max_in_flight=1, max_queue=1)
+        order = []
+
+        async def job(name):
+            async with dispatcher.slot(name, "m"):
+                order.append(name)
+
+        async with dispatcher.slot("a", "m"):
+            queued = asyncio.create_task(job("b"))
+            await asyncio.sleep(0)
+            assert dispatcher.saturated()
+            with pytest.raises(Overloaded):
+                await job("c")
+        await asyncio.wait_for(queued, 1)
+        return order, dispatcher.stats()
+
+    order, stats = asyncio.run(main())
+    assert order == ["b"]
+    assert stats["rejected"] == 1
+
+
+def test_wait_times_out():
+    dispatcher = Dispatcher(max_in_flight=1, queue_timeout=0.01)
+    with dispatcher.slot("a", "m"), pytest.raises(Overloaded):
+        with dispatcher.slot("b", "m"):
+            pass
+    stats = dispatcher.stats()
+    assert (stats["timeouts"], stats["queued"], stats["in_flight"]) == (1, 0, 0)
+
+
+def test_threads_stay_within_the_caps():
+    dispatcher = Dispatcher(max_in_flight=2, model_limits={"large": 1})
+    running, peak = {"large": 0, "all": 0}, {"large": 0, "all": 0}
+    lock = threading.Lock()
+
+    def work(model):
+        with dispatcher.slot(threading.current_thread().name, model):
+            with lock:
+                for name in {model, "all"} & set(running):
+                    running[name] += 1
+                    peak[name] = max(peak[name], running[name])
+            time.sleep(0.01)
+            with lock:
+                for name in {model, "all"} & set(running):
+                    running[name] -= 1
+
+    threads = [threading.Thread(target=work, args=("large" if i % 2 else "small",)) for i in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == {"large": 1, "all": 2}
+    assert dispatcher.stats()["in_flight"] == 0
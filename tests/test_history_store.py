@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+import history_store
+from history_store import SQLiteHistoryStore, parse_search_args
+
+
+def entry(user):
+    return {"date": "2024-01-01 00:00:00", "user": user, "bot": "- answer"}
+
+
+def test_writer_drops_bad_rows_and_keeps_running(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    store.append(entry("first"), "s")
+    store.append(entry(None), "s")  # violates NOT NULL
+    store.append(entry("second"), "s")
+    assert [e["user"] for e in store.list("s")] == ["first", "second"]
+
+    store.append(entry("third"), "s")
+    assert [e["user"] for e in store.list("s")] == ["first", "second", "third"]
+    assert store._writer.is_alive()
+    store.close()
+
+
+def test_flush_returns_after_a_failed_batch(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    store.append(entry({"not": "text"}), "s")
+    flushed = threading.Thread(target=store.flush, daemon=True)
+    flushed.start()
+    flushed.join(5)
+    assert not flushed.is_alive()
+    assert store.list("s") == []
+    store.close()
+
+
+def test_read_does_not_wait_for_the_batch_window(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"), flush_interval=10)
+    store.append(entry("question"), "a")
+    start = time.monotonic()
+    assert [e["user"] for e in store.list("a")] == ["question"]
+    assert time.monotonic() - start < 1
+    store.close()
+
+
+def test_read_only_waits_for_its_own_session(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    store.append(entry("mine"), "a")
+    store.flush("a")
+    with store._progress:
+        # Hold the writer back from reporting progress: session b's entry stays pending
+        store.append(entry("other"), "b")
+        assert store._session_last == {"b": 2}
+        store.flush("a")
+    assert [e["user"] for e in store.list("b")] == ["other"]
+    store.close()
+
+
+def test_search_says_when_matches_were_left_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "SEARCH_CANDIDATES", 5)
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    for i in range(7):
+        store.append(entry(f"python question {i}"), "s")
+
+    results = store.search("python", "s", limit=3, offset=3)
+    assert [e["user"] for e in results] == ["python question 3", "python question 2"]
+    assert results.truncated
+    assert not store.search("question 6", "s").truncated
+    with pytest.raises(ValueError):
+        parse_search_args({"q": "python", "offset": "5"})
+    store.close()
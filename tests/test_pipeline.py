@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from pipeline import make_async_pipeline
+
+
+def test_async_pipeline_keeps_cache_calls_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "replay")
+    monkeypatch.setenv("LLM_REPLAY_FILE", str(tmp_path / "replay.jsonl"))
+    monkeypatch.setenv("HISTORY_DB", str(tmp_path / "history.db"))
+    monkeypatch.setenv("SEMANTIC_CACHE", "hashing")
+    pipeline = make_async_pipeline()
+    on_loop = []
+    for cache in (pipeline.response_cache, pipeline.semantic_cache):
+        for name in ("get", "set"):
+            method = getattr(cache, name)
+            def spy(*args, method=method):
+                on_loop.append(threading.current_thread() is threading.main_thread())
+                return method(*args)
+            monkeypatch.setattr(cache, name, spy)
+
+    async def main():
+        first = await pipeline.answer("a", "What is Python?")
+        second = await pipeline.answer("b", "What is Python?")
+        events = [event async for event in pipeline.stream("c", "What is Python?")]
+        return first[0], second[0], events[-1]
+
+    first, second, done = asyncio.run(main())
+    assert (first, second) == (200, 200)
+    assert done.startswith("event: done")
+    assert pipeline.response_cache.stats()["hits"] == 2
+    assert on_loop and not any(on_loop)
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dispatcher import AsyncDispatcher, Dispatcher, Overloaded
+from policy import CallPolicy, CircuitBreaker, CircuitOpen
+
+
+def test_breaker_opens_after_repeated_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.allow()
+    breaker.record(False)
+    breaker.allow()
+    breaker.record(False)
+    with pytest.raises(CircuitOpen) as error:
+        breaker.allow()
+    assert 1 <= error.value.retry_after <= 30
+    assert breaker.stats() == {"state": "open", "failures": 2, "opens": 1, "rejected": 1}
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record(False)
+    breaker.opened_at -= 30
+    breaker.allow()
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+
+    breaker.opened_at -= 30
+    breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    breaker.allow()
+
+
+def hedging_policy(**kwargs):
+    policy = CallPolicy(hedge=True, hedge_min_samples=1, **kwargs)
+    # Recent calls took 1 ms, so anything slower is hedged
+    policy._latencies.append((time.monotonic(), 0.001))
+    return policy
+
+
+class SlowUpstream:
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, timeout):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.seconds)
+        return "answer"
+
+
+class ConstrainedLimiter:
+    def constrained(self):
+        return True
+
+
+def test_hedges_are_paid_from_the_budget():
+    policy, upstream = hedging_policy(hedge_budget=0.5, hedge_burst=1), SlowUpstream()
+    assert policy.call(upstream) == "answer"
+    assert policy.call(upstream) == "answer"
+    stats = policy.stats()
+    assert (stats["hedged"], stats["hedges_skipped"]) == (1, 1)
+    assert upstream.calls == 3
+
+
+def test_no_hedge_while_the_breaker_is_half_open():
+    policy, upstream = hedging_policy(hedge_budget=1), SlowUpstream()
+    policy.breaker.opened_at = time.monotonic() - policy.breaker.reset_timeout
+    assert policy.call(upstream) == "answer"
+    assert upstream.calls == 1
+    assert policy.stats()["hedges_skipped"] == 1
+
+
+def test_no_hedge_while_rate_limited():
+    policy, upstream = hedging_policy(hedge_budget=1), SlowUpstream()
+    assert policy.call(upstream, limiter=ConstrainedLimiter()) == "answer"
+    assert upstream.calls == 1
+
+
+def test_hedge_holds_a_dispatcher_slot():
+    dispatcher = Dispatcher(max_in_flight=2)
+    policy = hedging_policy(hedge_budget=1)
+    seen = []
+
+    def upstream(timeout):
+        seen.append(dispatcher.stats()["in_flight"])
+        time.sleep(0.05)
+        return "answer"
+
+    with dispatcher.slot("s", "m"):
+        policy.call(upstream, hedge_slot=lambda: dispatcher.slot("s", "m", wait=False))
+    assert max(seen) == 2
+    time.sleep(0.1)
+    assert dispatcher.stats()["in_flight"] == 0
+
+
+def test_no_hedge_without_a_free_slot():
+    dispatcher = Dispatcher(max_in_flight=1)
+    policy, upstream = hedging_policy(hedge_budget=1), SlowUpstream()
+    with dispatcher.slot("s", "m"):
+        policy.call(upstream, hedge_slot=lambda: dispatcher.slot("s", "m", wait=False))
+    assert upstream.calls == 1
+    stats = policy.stats()
+    assert (stats["hedged"], stats["hedges_skipped"], stats["hedge_budget"]) == (0, 1, 1)
+
+
+def test_async_hedge_releases_its_slot():
+    async def main():
+        dispatcher = AsyncDispatcher(max_in_flight=2)
+        policy = hedging_policy(hedge_budget=1)
+
+        async def upstream(timeout):
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        async with dispatcher.slot("s", "m"):
+            assert await policy.acall(upstream, hedge_slot=lambda: dispatcher.slot("s", "m", wait=False)) == "answer"
+        await asyncio.sleep(0.01)
+        return policy.stats()["hedged"], dispatcher.stats()["in_flight"]
+
+    assert asyncio.run(main()) == (1, 0)
+
+
+def test_slot_without_waiting_does_not_queue():
+    dispatcher = Dispatcher(max_in_flight=1)
+    with dispatcher.slot("s", "m"), pytest.raises(Overloaded):
+        with dispatcher.slot("t", "m", wait=False):
+            pass
+    assert dispatcher.stats()["rejected"] == 0
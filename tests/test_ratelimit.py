@@ -0,0 +1,101 @@
+import types
+
+import httpx
+import pytest
+
+import ratelimit
+from ratelimit import RateLimited, RateLimiter, retry_after
+
+
+# Stop the clock, so buckets don't refill while a test runs
+@pytest.fixture
+def frozen(monkeypatch):
+    monkeypatch.setattr(ratelimit, "time", types.SimpleNamespace(time=lambda: 1000.0))
+
+
+def test_calls_within_the_budget_go_right_away(frozen):
+    limiter = RateLimiter(rpm=60, tpm=1000)
+    assert limiter.reserve(100) == 0
+    assert limiter.stats()["buckets"]["tokens"]["available"] == 900
+
+
+def test_calls_beyond_the_budget_wait_for_the_refill(frozen):
+    limiter = RateLimiter(rpm=60, max_wait=10)
+    for _ in range(60):
+        assert limiter.reserve(1) == 0
+    assert limiter.reserve(1) == 1
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_calls_that_would_wait_too_long_are_rejected_without_taking_budget():
+    limiter = RateLimiter(tpm=600, max_wait=1)
+    with pytest.raises(RateLimited):
+        limiter.reserve(700)
+    assert limiter.stats()["buckets"]["tokens"]["available"] == 600
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_headers_correct_the_buckets(frozen):
+    limiter = RateLimiter()
+    limiter.update(200, {"x-ratelimit-limit-tokens": "6000", "x-ratelimit-remaining-tokens": "3000",
+                         "x-ratelimit-reset-tokens": "30s"})
+    assert limiter.stats()["buckets"]["tokens"] == {"capacity": 6000.0, "available": 3000.0}
+
+
+def test_upstream_429_pauses_everyone():
+    limiter = RateLimiter(max_wait=1)
+    limiter.update(429, {"retry-after": "5"})
+    with pytest.raises(RateLimited):
+        limiter.reserve(1)
+    assert limiter.constrained()
+    assert limiter.stats()["upstream_429"] == 1
+
+
+@pytest.mark.parametrize("headers", [
+    {"x-ratelimit-limit-tokens": "lots", "x-ratelimit-remaining-tokens": "3000"},
+    {"x-ratelimit-limit-tokens": "6000", "x-ratelimit-remaining-tokens": ""},
+    {"x-ratelimit-limit-tokens": "nan", "x-ratelimit-remaining-tokens": "inf"},
+    {"x-ratelimit-limit-tokens": "0", "x-ratelimit-remaining-tokens": "0"},
+    {"x-ratelimit-limit-tokens": "6000", "x-ratelimit-remaining-tokens": "-1"},
+    {"x-ratelimit-limit-tokens": "6000", "x-ratelimit-remaining-tokens": "3000", "x-ratelimit-reset-tokens": "1.2.3s"},
+])
+def test_malformed_headers_keep_the_previous_state(frozen, headers):
+    limiter = RateLimiter(tpm=600)
+    before = limiter.stats()["buckets"]
+    limiter.update(200, headers)
+    if "x-ratelimit-reset-tokens" in headers:
+        # The limits themselves are fine; only the reset is ignored
+        assert limiter.stats()["buckets"]["tokens"] == {"capacity": 6000.0, "available": 3000.0}
+    else:
+        assert limiter.stats()["buckets"] == before
+
+
+@pytest.mark.parametrize("value", ["soon", "inf", "nan", "-5"])
+def test_malformed_retry_after_pauses_briefly(frozen, value):
+    limiter = RateLimiter(max_wait=5)
+    limiter.update(429, {"retry-after": value})
+    assert limiter.reserve(1) == 1
+
+
+def test_calls_do_not_wait_past_their_timeout(frozen):
+    limiter = RateLimiter(rpm=60, max_wait=10)
+    for _ in range(60):
+        limiter.reserve(1)
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions", json={"messages": []},
+                            extensions={"timeout": {"connect": 0.5, "read": 0.5, "write": 0.5, "pool": 0.5}})
+    with pytest.raises(RateLimited):
+        limiter.before_request(request)
+    assert limiter.stats()["rejected"] == 1
+    request.extensions["timeout"] = {"connect": 5, "read": 5, "write": 5, "pool": 5}
+    assert limiter.before_request(request) == 1
+
+
+def test_retry_after_of_an_upstream_error():
+    class Error:
+        def __init__(self, headers):
+            self.response = httpx.Response(429, headers=headers)
+
+    assert retry_after(Error({"retry-after": "2.5"})) == 3
+    assert retry_after(Error({"retry-after": "inf"})) == 1
+    assert retry_after(Error({})) == 1
+    assert retry_after(ValueError()) == 1
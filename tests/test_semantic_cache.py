@@ -0,0 +1,37 @@
+import pytest
+
+from semantic_cache import HashingEmbedder, SemanticCache
+
+
+def cache_with(question):
+    cache = SemanticCache(HashingEmbedder())
+    cache.set("model", question, "cached answer")
+    return cache
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What is Python?", "what is python"),
+    ("Explain Python generators.", "explain  python generators"),
+    ("How do I read a CSV file (with pandas)?", "how do I read a csv file, with pandas"),
+])
+def test_case_and_punctuation_changes_hit(cached, asked):
+    assert cache_with(cached).get("model", asked) == "cached answer"
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What is the capital of Australia?", "What is the capital of Austria?"),
+    ("Convert 10 km to miles", "Convert 100 km to miles"),
+    ("Is Python slow?", "Why is Python slow?"),
+    ("What is C++?", "What is C?"),
+])
+def test_different_questions_miss(cached, asked):
+    assert cache_with(cached).get("model", asked) is None
+
+
+def test_hits_are_per_model():
+    assert cache_with("What is Python?").get("other model", "What is Python?") is None
+
+
+def test_hashing_is_stricter_by_default():
+    assert SemanticCache(HashingEmbedder()).threshold == 0.95
+    assert SemanticCache(HashingEmbedder(), threshold=0.8).threshold == 0.8
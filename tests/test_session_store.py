@@ -0,0 +1,36 @@
+from session_store import SessionStore
+
+
+def turn(user):
+    return {"date": "2024-01-01 00:00:00", "user": user, "bot": ["answer"]}
+
+
+def test_owners_only_see_and_clear_their_sessions(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.append("a1", turn("python threads"), "alice")
+    store.append("b1", turn("python asyncio"), "bob")
+
+    assert store.sessions("alice") == [("a1", "python threads")]
+    assert [r["session_id"] for r in store.search("python", "alice")] == ["a1"]
+    assert store.search("python", "alice", session_id="b1") == []
+
+    store.clear("alice")
+    assert store.sessions("alice") == []
+    assert store.transcript("a1") == []
+    assert store.sessions("bob") == [("b1", "python asyncio")]
+    assert [r["session_id"] for r in store.search("python", "bob")] == ["b1"]
+    store.history.close()
+
+
+def test_sessions_from_before_owners_are_kept(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(path)
+    store.append("old", turn("question"), None)
+    store._conn.execute("DROP INDEX idx_chat_sessions_owner_updated")
+    store._conn.execute("ALTER TABLE chat_sessions DROP COLUMN owner")
+    store.history.close()
+
+    store = SessionStore(path)
+    assert store.sessions("alice") == []
+    assert [e["user"] for e in store.transcript("old")] == ["question"]
+    store.history.close()
@@ -0,0 +1,113 @@
+import asyncio
+import fcntl
+import hashlib
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, FileLockStore, SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+
+    def fetch():
+        calls.append(1)
+        release.wait(1)
+        return "answer"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", fetch))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 1
+    while flight.stats()["coalesced"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_errors_reach_followers_and_free_the_key():
+    flight = SingleFlight()
+    call, leader = flight.join("key")
+    follower, _ = flight.join("key")
+    flight.finish("key", call, error=ValueError("upstream"))
+    with pytest.raises(ValueError):
+        follower.wait()
+    assert flight.do("key", lambda: "retried") == "retried"
+
+
+def test_lookup_after_the_lock(tmp_path):
+    flight = SingleFlight(FileLockStore(str(tmp_path)))
+    assert flight.do("key", lambda: "fetched", lookup=lambda: "cached") == "cached"
+    assert flight.do("key", lambda: "fetched", lookup=lambda: None) == "fetched"
+
+
+def test_async_followers_await_the_leader():
+    async def main():
+        flight, calls = AsyncSingleFlight(), []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        return results, len(calls), flight.stats()
+
+    results, calls, stats = asyncio.run(main())
+    assert results == ["answer"] * 5
+    assert calls == 1
+    assert stats == {"leaders": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_cancelled_follower_does_not_cancel_the_others():
+    async def main():
+        flight = AsyncSingleFlight()
+        future, _ = flight.join("key")
+        first = asyncio.create_task(flight.wait(future))
+        second = asyncio.create_task(flight.wait(future))
+        await asyncio.sleep(0)
+        first.cancel()
+        flight.finish("key", future, "answer")
+        return await second
+
+    assert asyncio.run(main()) == "answer"
+
+
+def test_lock_is_released_when_cancelled_while_waiting_for_it(tmp_path):
+    store = FileLockStore(str(tmp_path))
+    path = tmp_path / (hashlib.sha1(b"key").hexdigest() + ".lock")
+
+    async def fetch():
+        return "answer"
+
+    async def main():
+        flight = AsyncSingleFlight(store)
+        with store.lock("key"):
+            leader = asyncio.create_task(flight.do("key", fetch))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError) as cancelled:
+                await leader
+        # The worker thread takes the lock once it is free, then must let it go (even
+        # while the traceback keeps the leader's frame alive)
+        deadline = time.monotonic() + 1
+        with open(path) as f:
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    assert time.monotonic() < deadline
+                    await asyncio.sleep(0.01)
+            fcntl.flock(f, fcntl.LOCK_UN)
+        assert cancelled.value
+        return await asyncio.wait_for(flight.do("key", fetch), 1)
+
+    assert asyncio.run(main()) == "answer"
@@ -0,0 +1,214 @@
+import atexit
+import contextvars
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+# Tracing spans for the chat path, in the OpenTelemetry model: each request is a
+# trace, a tree of timed spans (handler, prompt build, cache lookup, upstream call,
+# post-processing, serialization) with attributes and events. TRACING picks where
+# finished spans go:
+#   off      nowhere (default); opening a span is a single function call
+#   console  one JSON line per span on stdout
+#   file     JSON lines appended to TRACING_FILE
+#   otel     the OpenTelemetry tracer provider configured in the process, e.g. by
+#            running under opentelemetry-instrument (needs opentelemetry-api)
+# Span and attribute names follow OpenTelemetry conventions (gen_ai.* for model
+# calls), and a W3C traceparent header continues the caller's trace.
+
+_current = contextvars.ContextVar("span", default=None)
+
+
+def _random_id(size):
+    return os.urandom(size).hex()
+
+
+# Caller's span from a W3C traceparent header ("00-<trace id>-<span id>-<flags>")
+class RemoteParent:
+    def __init__(self, trace_id, span_id):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+def parse_traceparent(value):
+    parts = (value or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return RemoteParent(parts[1], parts[2])
+
+
+class NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+    def record_exception(self, error):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    def __init__(self, name, parent, attributes, export):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else _random_id(16)
+        self.span_id = _random_id(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.events = []
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self._export = export
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, error, tb):
+        if error is not None and self.status != "error":
+            self.record_exception(error)
+        duration_ns = time.time_ns() - self.start_ns
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Ended in another context, e.g. an async generator resumed by a different task
+            pass
+        self._export(self, duration_ns)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+
+    def add_event(self, name, attributes=None):
+        self.events.append({"name": name, "time_unix_nano": time.time_ns(), "attributes": attributes or {}})
+
+    def record_exception(self, error):
+        self.status = "error"
+        self.add_event("exception", {"exception.type": type(error).__name__, "exception.message": str(error)})
+
+
+class Tracer:
+    # `export(span, duration_ns)` receives finished spans; None makes every span a no-op
+    def __init__(self, export=None):
+        self._export = export
+
+    # Context manager for a span, a child of `parent` or else of the current span.
+    # `traceparent` continues a remote trace when there is no local parent.
+    def span(self, name, parent=None, traceparent=None, **attributes):
+        if self._export is None:
+            return NOOP_SPAN
+        parent = parent or _current.get() or parse_traceparent(traceparent)
+        return Span(name, parent, attributes, self._export)
+
+    def current_span(self):
+        return _current.get() or NOOP_SPAN
+
+
+# Tracer on top of the OpenTelemetry API
+class OtelTracer:
+    def __init__(self):
+        try:
+            from opentelemetry import propagate, trace
+        except ImportError:
+            raise ImportError("TRACING=otel requires the 'opentelemetry-api' package.")
+        self._trace = trace
+        self._propagate = propagate
+        self._tracer = trace.get_tracer("chat")
+
+    def span(self, name, parent=None, traceparent=None, **attributes):
+        if parent is not None:
+            context = self._trace.set_span_in_context(parent)
+        elif traceparent and not self._trace.get_current_span().get_span_context().is_valid:
+            context = self._propagate.extract({"traceparent": traceparent})
+        else:
+            context = None
+        return self._tracer.start_as_current_span(name, context=context, attributes=attributes)
+
+    def current_span(self):
+        return self._trace.get_current_span()
+
+
+# Writes finished spans as JSON lines from a background thread; drops spans when the queue is full
+class SpanWriter:
+    def __init__(self, path=None, max_queue=10000):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="span-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __call__(self, span, duration_ns):
+        record = {
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_span_id": span.parent_id,
+            "start_time_unix_nano": span.start_ns,
+            "end_time_unix_nano": span.start_ns + duration_ns,
+            "duration_ms": round(duration_ns / 1e6, 3),
+            "status": span.status,
+            "attributes": span.attributes,
+            "events": span.events,
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        out = open(self.path, "a") if self.path else sys.stdout
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            out.write("".join(json.dumps(record, default=str) + "\n" for record in batch if record is not None))
+            out.flush()
+            if None in batch:
+                return
+
+    # Write out queued spans on shutdown
+    def close(self):
+        try:
+            self._queue.put(None, timeout=1)
+        except queue.Full:
+            return
+        self._thread.join(timeout=5)
+
+
+# Build the tracer configured through environment variables
+def make_tracer():
+    exporter = os.getenv("TRACING", "off")
+    if exporter == "off":
+        return Tracer()
+    if exporter == "console":
+        return Tracer(SpanWriter())
+    if exporter == "file":
+        return Tracer(SpanWriter(os.getenv("TRACING_FILE", "traces.jsonl")))
+    if exporter == "otel":
+        return OtelTracer()
+    raise ValueError(f"Unknown TRACING: {exporter}")
+
+
+tracer = make_tracer()
@@ -0,0 +1,109 @@
+import functools
+import os
+import time
+
+import streamlit as st
+
+from llm import split_response
+
+# Chat transcript rendering for the Streamlit apps. Every rerun used to emit two
+# markdown elements per turn, so reruns got slower as the conversation grew. Here
+# turns are grouped into fixed pages (turns 0-19, 20-39, ...) and each page is one
+# markdown element built from memoized per-turn HTML. Only the latest pages are
+# shown, with a "load older" button for the rest. A full page never changes, so
+# its element is identical from one rerun to the next and the browser leaves it
+# alone; only the last page changes when a turn is added.
+#
+# A new answer is streamed into the page token by token (STREAMLIT_STREAMING=on,
+# the default) and becomes part of the transcript once it is complete.
+
+PAGE_SIZE = max(1, int(os.getenv("TRANSCRIPT_PAGE_SIZE", 20)))
+STREAMING = os.getenv("STREAMLIT_STREAMING", "on") != "off"
+
+# Entry formats as (user, bot, bullet separator): chat bubbles (styled by the apps'
+# .user-message and .bot-message CSS), bubbles without CSS classes (app2.py), and
+# plain markdown for a previous conversation
+_FORMATS = {
+    "bubbles": ("<div class='user-message'><b>You:</b> {}</div>", "<div class='bot-message'><b>Bot:</b> {}</div>", "<br>"),
+    "aligned": ("<div style='text-align: right;'><b>You:</b> {}</div>", "<div><b>Bot:</b> {}</div>", "<br>"),
+    "plain": ("**You:** {}\n\n", "**Bot:** {}\n\n", " "),
+}
+
+def _user(style, user):
+    return _FORMATS[style][0].format(user)
+
+def _bot(style, bot):
+    _, bot_format, separator = _FORMATS[style]
+    return bot_format.format(separator.join(bot))
+
+
+@functools.lru_cache(maxsize=8192)
+def _turn(style, user, bot):
+    return _user(style, user) + _bot(style, bot)
+
+def turn_markup(turn, style="bubbles"):
+    return _turn(style, turn['user'], tuple(turn['bot']))
+
+# The page's turns are the same string objects on every rerun, so hashing the key is cheap
+@functools.lru_cache(maxsize=1024)
+def _page(parts):
+    return "".join(parts)
+
+def page_markup(turns, style="bubbles"):
+    return _page(tuple(turn_markup(turn, style) for turn in turns))
+
+
+# Index of the first shown turn when the last `pages` pages of `total` turns are shown
+def window_start(total, pages):
+    last_page = max(0, total - 1) // PAGE_SIZE
+    return max(0, last_page - pages + 1) * PAGE_SIZE
+
+
+_keys = set()
+
+def _load_older(key):
+    st.session_state[key] = st.session_state.get(key, 1) + 1
+
+# Go back to showing the latest page of every transcript, e.g. after switching sessions
+def reset_transcript():
+    for key in _keys:
+        st.session_state.pop(key, None)
+
+# Render the latest pages of `history`, with a button that shows one more page
+def render_transcript(history, key="transcript_pages", style="bubbles"):
+    _keys.add(key)
+    start = window_start(len(history), st.session_state.get(key, 1))
+    if start:
+        st.button(f"⬆️ Load older messages ({start} more)", key=f"{key}_older", on_click=_load_older, args=(key,))
+    for page_start in range(start, len(history), PAGE_SIZE):
+        st.markdown(page_markup(history[page_start:page_start + PAGE_SIZE], style),
+                    unsafe_allow_html=style != "plain")
+
+
+# Text of the tokens in a streamed completion
+def completion_tokens(stream):
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+# Show the question, then the answer as its `tokens` arrive; returns the answer's text.
+# The answer is redrawn at most every `interval` seconds so long answers don't flood
+# the browser, and ends up split into bullets like the rest of the transcript.
+def render_stream(user_input, tokens, style="bubbles", interval=0.05):
+    html = style != "plain"
+    st.markdown(_user(style, user_input), unsafe_allow_html=html)
+    placeholder = st.empty()
+    parts = []
+    drawn = 0.0
+    for token in tokens:
+        parts.append(token)
+        now = time.monotonic()
+        if now - drawn >= interval:
+            placeholder.markdown(_bot(style, split_response("".join(parts) + " ▌")), unsafe_allow_html=html)
+            drawn = now
+    response_content = "".join(parts)
+    if response_content.strip():
+        placeholder.markdown(_bot(style, split_response(response_content)), unsafe_allow_html=html)
+    else:
+        placeholder.empty()
+    return response_content